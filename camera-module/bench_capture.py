@@ -0,0 +1,194 @@
+"""Camera host cost per camera and capture format: CPU time and USB bus bandwidth
+
+All cameras run at once, each on its own thread doing what main.py does with a camera before its
+frames go on the wire. Raw YUYV and MJPEG are decoded and encoded to VP8, H.264 is split into RTP
+payloads as it comes (passthrough). Bus bandwidth is the bytes read off each device, CPU is the
+process's CPU time over the run shared out per camera.
+
+    python bench_capture.py                              # every camera in /dev, each format it offers
+    python bench_capture.py --synthetic --cameras 4      # pre-encoded test pattern, no devices needed
+
+--synthetic encodes a couple of seconds of the synthetic.py pattern to each format up front and
+plays the packets back at the frame rate, so the host side can be compared without hardware. The
+pattern is smooth, so its compressed bitrates are lower than a real scene's.
+"""
+import argparse
+import os
+import threading
+import time
+
+import av
+import numpy as np
+from aiortc.codecs.h264 import H264Encoder
+from aiortc.codecs.vpx import Vp8Encoder
+from aiortc.mediastreams import VIDEO_TIME_BASE
+
+from devices import find_cameras
+from synthetic import SyntheticVideoTrack
+
+FORMATS = ("raw", "mjpeg", "h264")
+# V4L2 FourCC a camera has to offer for each format
+FOURCCS = {"raw": "YUYV", "mjpeg": "MJPG", "h264": "H264"}
+# FFmpeg decoder for the packets of each format
+DECODERS = {"raw": "rawvideo", "mjpeg": "mjpeg"}
+
+def device_packets(path, input_format, fps, size, stop):
+    """Packets straight off a V4L2 device until stop is set"""
+    options = {"framerate": str(fps), "video_size": f"{size[0]}x{size[1]}"}
+    if input_format != "raw":
+        options["input_format"] = input_format
+    container = av.open(path, format="v4l2", options=options)
+    try:
+        stream = container.streams.video[0]
+        for packet in container.demux(stream):
+            if stop.is_set():
+                return
+            if packet.size:
+                yield packet
+    finally:
+        container.close()
+
+def encode_pattern(input_format, fps, size, seconds=2.0):
+    """Bytes of each packet of the synthetic pattern in one format, one keyframe at the start"""
+    width, height = size
+    count = max(1, int(fps * seconds))
+    pattern = SyntheticVideoTrack(width, height, fps)
+    if input_format == "raw":
+        codec = None
+    else:
+        codec = av.CodecContext.create("libx264" if input_format == "h264" else "mjpeg", "w")
+        codec.width, codec.height = width, height
+        codec.pix_fmt = "yuv420p" if input_format == "h264" else "yuvj420p"
+        codec.time_base = VIDEO_TIME_BASE
+        if input_format == "h264":
+            # Annex B with a single GOP, like a UVC camera's stream between keyframes
+            codec.options = {"tune": "zerolatency", "g": str(count), "bf": "0"}
+        else:
+            # UVC cameras send MJPEG at high quality
+            codec.qmin = codec.qmax = 2
+
+    packets = []
+    for index in range(count):
+        shift = (index * 8) % width
+        pattern.yuv[:height] = pattern.pattern[:, shift:shift + width]
+        frame = av.VideoFrame.from_ndarray(pattern.yuv, format="yuv420p")
+        if codec is None:
+            packets.append(bytes(frame.reformat(format="yuyv422").planes[0]))
+            continue
+        frame.pts = index
+        packets += [bytes(packet) for packet in codec.encode(frame)]
+    if codec is not None:
+        packets += [bytes(packet) for packet in codec.encode(None)]
+    return packets
+
+def synthetic_packets(payloads, fps, stop):
+    """Replay pre-encoded packets at the frame rate until stop is set"""
+    start = time.monotonic()
+    index = 0
+    while not stop.is_set():
+        delay = start + index / fps - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        packet = av.Packet(payloads[index % len(payloads)])
+        packet.pts = int(index / fps * 90000)
+        packet.time_base = VIDEO_TIME_BASE
+        index += 1
+        yield packet
+
+def run_camera(packets, input_format, size, result):
+    """Decode and re-encode, or pass through, everything the camera sends. Fills result"""
+    passthrough = input_format == "h264"
+    encoder = H264Encoder() if passthrough else Vp8Encoder()
+    decoder = None
+    if not passthrough:
+        decoder = av.CodecContext.create(DECODERS[input_format], "r")
+        if input_format == "raw":
+            decoder.width, decoder.height = size
+            decoder.pix_fmt = "yuyv422"
+        # Keep the work on this thread so it shows up as this camera's
+        decoder.thread_count = 1
+
+    for packet in packets:
+        result["bytes"] += packet.size
+        if passthrough:
+            encoder.pack(packet)
+        else:
+            for frame in decoder.decode(packet):
+                frame.pts = packet.pts
+                frame.time_base = VIDEO_TIME_BASE
+                encoder.encode(frame)
+        result["frames"] += 1
+
+def run_format(sources, input_format, fps, size, duration):
+    """Per camera results of running every source at once in one format"""
+    stop = threading.Event()
+    results, threads = [], []
+    for name, packets in sources:
+        result = {"camera": name, "frames": 0, "bytes": 0}
+        results.append(result)
+        threads.append(threading.Thread(target=run_camera, args=(packets(stop), input_format, size, result),
+                                        name=f"capture-{name}", daemon=True))
+
+    cpu_start, wall_start = time.process_time(), time.monotonic()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=5)
+    wall = time.monotonic() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    for result in results:
+        result["fps"] = result["frames"] / wall
+        result["bus_mbps"] = result["bytes"] * 8 / wall / 1e6
+        result["cpu_percent"] = 100 * cpu / wall / len(results)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per format")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--formats", default=",".join(FORMATS), help="comma separated, from raw, mjpeg and h264")
+    parser.add_argument("--synthetic", action="store_true", help="replay an encoded test pattern instead of devices")
+    parser.add_argument("--cameras", type=int, default=4, help="synthetic cameras to run")
+    args = parser.parse_args()
+    size = (args.width, args.height)
+
+    if args.synthetic:
+        print(f"🧪 {args.cameras} synthetic cameras")
+    else:
+        cameras = find_cameras()
+        if not cameras:
+            print("No cameras found, try --synthetic")
+            return
+        for path, info in cameras:
+            print(f"📷 {path}: {info['card']} {'/'.join(info.get('formats', []))}")
+
+    print(f"{'format':<7}{'camera':<14}{'fps':>7}{'bus Mbit/s':>12}{'CPU % of a core':>17}")
+    for input_format in args.formats.split(","):
+        if args.synthetic:
+            payloads = encode_pattern(input_format, args.fps, size)
+            sources = [(f"synthetic{i}", lambda stop, p=payloads: synthetic_packets(p, args.fps, stop))
+                       for i in range(args.cameras)]
+        else:
+            # Each camera in the formats it offers
+            sources = [(os.path.basename(path),
+                        lambda stop, path=path: device_packets(path, input_format, args.fps, size, stop))
+                       for path, info in cameras if FOURCCS[input_format] in info.get("formats", [])]
+            if not sources:
+                print(f"{input_format:<7}no camera offers it")
+                continue
+
+        results = run_format(sources, input_format, args.fps, size, args.duration)
+        for result in results:
+            print(f"{input_format:<7}{result['camera']:<14}{result['fps']:>7.1f}{result['bus_mbps']:>12.1f}"
+                  f"{result['cpu_percent']:>17.0f}")
+        total_bus = sum(result["bus_mbps"] for result in results)
+        total_cpu = sum(result["cpu_percent"] for result in results)
+        print(f"{input_format:<7}{'all':<14}{np.mean([r['fps'] for r in results]):>7.1f}{total_bus:>12.1f}{total_cpu:>17.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Video device discovery from V4L2 capabilities, and a watcher for cameras plugged in or out
+
+A device node is a camera when VIDIOC_QUERYCAP reports video capture. That ioctl only reads the
+driver's capability struct, so probing a node costs an open and a syscall instead of the format
+negotiation and buffer setup of a full capture open, and all nodes are probed at once on a thread
+pool. Metadata nodes (UVC cameras expose one next to each capture node) are skipped. The pixel
+formats a camera offers (VIDIOC_ENUM_FMT) come back with it, so capture can pick a compressed one.
+
+Everything takes the device directory and the probe function as arguments, so discovery can run
+against a directory of fake nodes and a stub probe:
+
+    python devices.py                  # cameras in /dev
+    python devices.py --watch          # and then report plug and unplug events
+"""
+import argparse
+import asyncio
+import fcntl
+import os
+import re
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+# _IOR('V', 0, struct v4l2_capability), the struct is 104 bytes
+VIDIOC_QUERYCAP = 0x80685600
+V4L2_CAPABILITY = struct.Struct("16s32s32sIII12x")
+V4L2_CAP_VIDEO_CAPTURE = 0x00000001
+V4L2_CAP_DEVICE_CAPS = 0x80000000
+# _IOWR('V', 2, struct v4l2_fmtdesc), the struct is 64 bytes
+VIDIOC_ENUM_FMT = 0xC0405602
+V4L2_FMTDESC = struct.Struct("III32sII12x")
+V4L2_BUF_TYPE_VIDEO_CAPTURE = 1
+
+def video_nodes(dev_dir="/dev"):
+    """/dev/videoN paths in N order"""
+    try:
+        names = os.listdir(dev_dir)
+    except FileNotFoundError:
+        return []
+    numbered = [(int(m.group(1)), name) for name in names if (m := re.fullmatch(r"video(\d+)", name))]
+    return [os.path.join(dev_dir, name) for _, name in sorted(numbered)]
+
+def enum_formats(fd):
+    """FourCCs of the capture formats a node offers, in the driver's order ("YUYV", "MJPG", "H264", ...)"""
+    formats = []
+    while True:
+        buf = bytearray(V4L2_FMTDESC.pack(len(formats), V4L2_BUF_TYPE_VIDEO_CAPTURE, 0, b"", 0, 0))
+        try:
+            fcntl.ioctl(fd, VIDIOC_ENUM_FMT, buf)
+        except OSError:
+            # EINVAL past the last index
+            return formats
+        pixelformat = V4L2_FMTDESC.unpack(buf)[4]
+        formats.append(pixelformat.to_bytes(4, "little").decode(errors="replace").strip())
+
+def query_capabilities(path):
+    """Driver, card, bus, capability flags and capture formats of a V4L2 node, or None if it can't be queried"""
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+    except OSError:
+        return None
+    try:
+        buf = bytearray(V4L2_CAPABILITY.size)
+        fcntl.ioctl(fd, VIDIOC_QUERYCAP, buf)
+        formats = enum_formats(fd)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+
+    driver, card, bus_info, _version, capabilities, device_caps = V4L2_CAPABILITY.unpack(buf)
+    # device_caps describes this node, capabilities the whole physical device
+    if capabilities & V4L2_CAP_DEVICE_CAPS:
+        capabilities = device_caps
+    return {
+        "driver": driver.split(b"\0", 1)[0].decode(errors="replace"),
+        "card": card.split(b"\0", 1)[0].decode(errors="replace"),
+        "bus_info": bus_info.split(b"\0", 1)[0].decode(errors="replace"),
+        "capabilities": capabilities,
+        "formats": formats,
+    }
+
+def is_camera(info):
+    return info is not None and bool(info["capabilities"] & V4L2_CAP_VIDEO_CAPTURE)
+
+def find_cameras(dev_dir="/dev", max_cameras=None, probe=query_capabilities):
+    """(path, info) of each capture device, probing every node concurrently"""
+    paths = video_nodes(dev_dir)
+    if not paths:
+        return []
+    with ThreadPoolExecutor(max_workers=min(16, len(paths)), thread_name_prefix="probe") as pool:
+        infos = list(pool.map(probe, paths))
+    cameras = [(path, info) for path, info in zip(paths, infos) if is_camera(info)]
+    return cameras[:max_cameras]
+
+class DeviceWatcher:
+    """Polls the device directory and calls back when capture devices appear or disappear
+
+    on_added(path, info) is awaited for each new camera and returns False when it couldn't take it,
+    in which case it is offered again on the next poll. on_removed(path) is awaited when a node
+    that was taken goes away. Only new nodes are probed, so a poll is one directory listing.
+    """
+    def __init__(self, on_added, on_removed, dev_dir="/dev", interval=1.0, probe=query_capabilities):
+        self.on_added = on_added
+        self.on_removed = on_removed
+        self.dev_dir = dev_dir
+        self.interval = interval
+        self.probe = probe
+        self.known = set()
+        self.ignored = set()  # nodes that answered but don't capture video
+        self.task = None
+
+    def start(self, known=()):
+        self.known = set(known)
+        self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def poll(self):
+        present = set(video_nodes(self.dev_dir))
+        for path in sorted(self.known - present):
+            self.known.discard(path)
+            await self.on_removed(path)
+        self.ignored &= present
+
+        new = sorted(present - self.known - self.ignored)
+        infos = await asyncio.gather(*(asyncio.to_thread(self.probe, path) for path in new))
+        for path, info in zip(new, infos):
+            if info is None:
+                # Nodes can show up before the driver answers, try again next time
+                continue
+            if not is_camera(info):
+                self.ignored.add(path)
+            elif await self.on_added(path, info) is not False:
+                self.known.add(path)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll()
+            except Exception as e:
+                print(f"⚠️ Device watcher error: {e}")
+
+async def watch(dev_dir, interval):
+    async def added(path, info):
+        print(f"🔌 {path} plugged in: {info['card']} ({info['bus_info']})")
+
+    async def removed(path):
+        print(f"❎ {path} unplugged")
+
+    watcher = DeviceWatcher(added, removed, dev_dir, interval)
+    watcher.start(path for path, _ in find_cameras(dev_dir))
+    await asyncio.Event().wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dev-dir", default="/dev")
+    parser.add_argument("--watch", action="store_true", help="keep running and report devices coming and going")
+    parser.add_argument("--interval", type=float, default=1.0)
+    args = parser.parse_args()
+
+    cameras = find_cameras(args.dev_dir)
+    for path, info in cameras:
+        print(f"📷 {path}: {info['card']} [{info['driver']}] {info['bus_info']} {'/'.join(info.get('formats', []))}")
+    if not cameras:
+        print("No cameras found")
+    if args.watch:
+        try:
+            asyncio.run(watch(args.dev_dir, args.interval))
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == "__main__":
+    main()
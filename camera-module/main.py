@@ -1,13 +1,42 @@
 import asyncio
+import json
+import math
 import os
 import sys
+import time
 import socketio
 import ssl
-from aiortc import RTCPeerConnection, RTCSessionDescription, RTCIceCandidate, RTCConfiguration, RTCIceServer, MediaStreamTrack
+from concurrent.futures import ThreadPoolExecutor
+from aiortc import RTCPeerConnection, RTCSessionDescription, RTCIceCandidate, RTCConfiguration, RTCIceServer, MediaStreamTrack, RTCRtpSender
 from aiortc.contrib.media import MediaPlayer
+from aiortc.mediastreams import MediaStreamError, VIDEO_CLOCK_RATE, VIDEO_TIME_BASE
+from av import Packet
 import platform
-import cv2
 
+from devices import DeviceWatcher, find_cameras, query_capabilities
+from synthetic import SyntheticVideoTrack
+
+# Signaling server, the Node one in webrtc/ or central_server/signaling.py for local runs
+SIGNALING_URL = os.environ.get("SIGNALING_URL", "https://192.168.0.151:8181/")
+# Signaling user name. The server keys camera sessions on it, so every camera module needs its own,
+# starting with the server's DEPTH_CAMERA_PREFIX
+CAMERA_NAME = os.environ.get("CAMERA_NAME", f"camera-module-{platform.node() or os.getpid()}")
+# "v4l2" (or the platform's camera API) for real devices, "synthetic" for a generated test pattern
+CAMERA_SOURCE = os.environ.get("CAMERA_SOURCE", "v4l2")
+# Capture settings to start with, the server can lower them over the "control" data channel
+CAMERA_FRAMERATE = os.environ.get("CAMERA_FRAMERATE", "30")
+CAMERA_VIDEO_SIZE = os.environ.get("CAMERA_VIDEO_SIZE", "640x480")
+# Seconds between checks for cameras being plugged in or unplugged (Linux), 0 turns the watcher off
+CAMERA_WATCH_INTERVAL = float(os.environ.get("CAMERA_WATCH_INTERVAL", "1.0"))
+# Simulcast: also send each camera as a small stream for the server's model, next to the full one
+CAMERA_SIMULCAST = os.environ.get("CAMERA_SIMULCAST", "0") == "1"
+# Size of the small stream until the server says what its model takes
+CAMERA_INFERENCE_SIZE = os.environ.get("CAMERA_INFERENCE_SIZE", "256x256")
+# V4L2 capture format: "auto" prefers what the camera compresses itself, H.264 (sent on without
+# re-encoding) and then MJPEG, over raw YUYV that fills the USB bus. "h264", "mjpeg" or "raw" force one
+CAMERA_INPUT_FORMAT = os.environ.get("CAMERA_INPUT_FORMAT", "auto")
+# Simulcast scales decoded frames for the inference stream, so it can't pass H.264 through
+PASSTHROUGH = CAMERA_INPUT_FORMAT in ("auto", "h264") and not CAMERA_SIMULCAST
 
 # Create an SSL context that doesn't verify certificates
 ssl_context = ssl.create_default_context()
@@ -18,6 +47,9 @@ ssl_context.verify_mode = ssl.CERT_NONE
 sio = socketio.AsyncClient(ssl_verify=False)
 pc = None
 local_tracks = None
+slots = []
+watcher = None
+control_channel = None
 
 config = RTCConfiguration(iceServers=[
     RTCIceServer(urls=["stun:stun.l.google.com:19302"])
@@ -39,7 +71,8 @@ async def create_peer_connection():
 async def send_ice_candidate(candidate):
     await sio.emit('sendIceCandidateToSignalingServer', {
         'didIOffer': True,  # Change this based on your role (offerer/answerer)
-        'iceUserName': 'python_client',
+        'iceUserName': CAMERA_NAME,
+        'offerSdp': pc.localDescription.sdp if pc.localDescription else None,
         'iceCandidate': {
             'candidate': candidate.candidate,
             'sdpMid': candidate.sdpMid,
@@ -47,61 +80,322 @@ async def send_ice_candidate(candidate):
         }
     })
   
-def find_available_cameras(max_cameras=3):
-    """Discover available video devices"""
-    cameras = []
-    for i in range(max_cameras*2 + 1):  # Check up to double the requested
-        dev_path = f"/dev/video{i}"
-        if os.path.exists(dev_path):
+class CameraSlot(MediaStreamTrack):
+    """One negotiated video track whose camera can come and go while the connection stays up
+
+    With no camera attached recv() waits and the sender goes quiet. Frames are restamped on the
+    slot's own clock so RTP timestamps keep increasing from one camera to the next.
+
+    configure() applies the rate and size the server asks for: frames over the rate are dropped
+    here straight away, before they cost an encode, and the camera is reopened with new capture
+    settings when the size changes or it captures far more frames than get sent. The rate the slot
+    was created with is a ceiling, the server can lower it and raise it back but not past that.
+
+    A passthrough slot negotiated H.264 and sends its camera's H.264 packets as they come. Packets
+    can't be dropped without breaking the frames that refer to them, so there the rate is only
+    changed by reopening the camera, and keyframes come at the camera's own interval.
+
+    Every frame sent gets an id, announced with its capture time on the control channel.
+    """
+    kind = "video"
+
+    def __init__(self, opener, fps, size):
+        super().__init__()
+        self.source = None
+        self.path = None
+        self.changed = asyncio.Event()
+        self.start = None
+        self.opener = opener  # opener(path, fps, size, passthrough) -> video track or None
+        self.capture_fps = fps
+        self.max_fps = fps  # CAMERA_FRAMERATE, never captured or sent faster
+        self.size = size
+        self.interval = 0.0
+        self.due = None
+        self.companion = None  # InferenceStream fed from this slot when simulcasting
+        self.passthrough = False
+        self.frame_id = 0
+        self.origin = None  # pts of the first frame sent, see announce_frame
+
+    async def configure(self, fps, size=None):
+        """Send at most fps frames per second, at size (width, height) if given"""
+        # The configured rate is a ceiling, asking for more gets the camera's full rate
+        unlimited = not fps or fps >= self.max_fps
+        fps = self.max_fps if unlimited else fps
+        self.interval = 0.0 if unlimited else 1.0 / fps
+        size = tuple(size) if size else self.size
+        capture_fps = min(math.ceil(fps), self.max_fps)
+        if getattr(self.source, "passthrough", False):
+            if size == self.size and self.capture_fps == capture_fps:
+                return
+        elif size == self.size and fps <= self.capture_fps <= 1.5 * fps:
+            return
+        if self.source is None:
+            # The next camera plugged into this slot opens with these settings
+            self.capture_fps, self.size = capture_fps, size
+            return
+
+        # A V4L2 device can only be opened once, so close it before reopening
+        path = self.path
+        self.detach()
+        track = await asyncio.to_thread(self.opener, path, capture_fps, size, self.passthrough)
+        if track is not None:
+            self.capture_fps, self.size = capture_fps, size
+        else:
+            track = await asyncio.to_thread(self.opener, path, self.capture_fps, self.size, self.passthrough)
+        if track is not None and self.source is None and self.readyState == "live":
+            self.attach(track, path)
+            print(f"🎚️ {path or 'camera'} now captures {self.size[0]}x{self.size[1]} at {self.capture_fps} fps")
+        elif track is not None:
+            track.stop()
+
+    def attach(self, source, path=None):
+        self.detach()
+        self.source, self.path = source, path
+        self.changed.set()
+
+    def detach(self):
+        if self.source is not None:
+            self.source.stop()
+            self.source = self.path = None
+            self.changed.set()
+
+    async def recv(self):
+        while self.readyState == "live":
+            source = self.source
+            self.changed.clear()
+            if source is None:
+                await self.changed.wait()
+                continue
+
+            # A stopped camera never answers recv(), so also wake up when it is swapped out
+            frame_task = asyncio.ensure_future(source.recv())
+            change_task = asyncio.ensure_future(self.changed.wait())
+            await asyncio.wait((frame_task, change_task), return_when=asyncio.FIRST_COMPLETED)
+            change_task.cancel()
+            if not frame_task.done():
+                frame_task.cancel()
+                continue
             try:
-                # Basic validation attempt
-                cap = cv2.VideoCapture(dev_path)
-                if cap.isOpened():
-                    cameras.append(dev_path)
-                    cap.release()
-            except:
+                frame = frame_task.result()
+            except MediaStreamError:
+                if self.source is source:
+                    print(f"⚠️ Camera {self.path} stopped delivering frames")
+                    self.detach()
                 continue
-    return cameras[:max_cameras]  # Return up to requested amount
+
+            now = time.monotonic()
+            captured = time.time()
+            if self.interval and not isinstance(frame, Packet):
+                # Thin down to the rate the server asked for
+                if self.due is not None and now < self.due:
+                    continue
+                self.due = max((self.due or now) + self.interval, now)
+            if self.start is None:
+                self.start = now
+            frame.pts = int((now - self.start) * VIDEO_CLOCK_RATE)
+            frame.time_base = VIDEO_TIME_BASE
+            self.frame_id += 1
+            announce_frame(self, frame.pts, self.frame_id, captured)
+            if self.companion is not None:
+                self.companion.put(frame, self.frame_id, captured)
+            return frame
+        raise MediaStreamError
+
+    def stop(self):
+        self.detach()
+        super().stop()
+        self.changed.set()
+
+class InferenceStream(MediaStreamTrack):
+    """Small copy of a slot's frames for the server's model, sent as a second track (simulcast)
+
+    aiortc can't send RID simulcast layers, so this is a track of its own. The slot hands over each
+    frame it sends and only the newest is scaled down, a frame the encoder didn't get to is replaced
+    rather than queued. Track ids pair the two up: "<id>-display" for the slot, "<id>-inference" here.
+    """
+    kind = "video"
+
+    def __init__(self, slot, size):
+        super().__init__()
+        self.size = size
+        self.frame = None  # (frame, pts, time base, frame id, capture time)
+        self.ready = asyncio.Event()
+        self.origin = None
+        base = self._id
+        slot._id = f"{base}-display"
+        self._id = f"{base}-inference"
+        slot.companion = self
+
+    def put(self, frame, frame_id, captured):
+        # The display stream's encoder rebases the frame's pts to its own time base in place, keep
+        # the pts it was sent with so both streams announce the same one
+        self.frame = (frame, frame.pts, frame.time_base, frame_id, captured)
+        self.ready.set()
+
+    async def recv(self):
+        while self.readyState == "live":
+            await self.ready.wait()
+            self.ready.clear()
+            latest, self.frame = self.frame, None
+            if latest is None:
+                continue
+            frame, pts, time_base, frame_id, captured = latest
+            small = frame.reformat(width=self.size[0], height=self.size[1])
+            small.pts = pts
+            small.time_base = time_base
+            # Same id as the full-size frame, so the server can pair the two
+            announce_frame(self, small.pts, frame_id, captured)
+            return small
+        raise MediaStreamError
+
+    def stop(self):
+        super().stop()
+        self.ready.set()
+
+def announce_frame(track, pts, frame_id, captured):
+    """Tell the server the id and capture time of the frame it will see at pts
+
+    aiortc's receiver counts pts from the first RTP timestamp it gets, so the pts announced is
+    relative to the first frame this track sent.
+    """
+    if track.origin is None:
+        track.origin = pts
+    if control_channel is None or control_channel.readyState != "open":
+        return
+    control_channel.send(json.dumps({"type": "frame", "track": track.id, "pts": pts - track.origin,
+                                     "id": frame_id, "captured": round(captured * 1000)}))
+
+def input_formats(path, passthrough=False):
+    """FFmpeg input formats to try on a camera, best first, None for the driver's default"""
+    if CAMERA_INPUT_FORMAT != "auto":
+        return [None if CAMERA_INPUT_FORMAT == "raw" else CAMERA_INPUT_FORMAT]
+    info = query_capabilities(path)
+    offered = info.get("formats", []) if info else []
+    # H.264 is only worth it sent on as is, decoding it costs more than decoding MJPEG
+    preferred = (("H264", "h264"), ("MJPG", "mjpeg")) if passthrough else (("MJPG", "mjpeg"), ("H264", "h264"))
+    return [name for fourcc, name in preferred if fourcc in offered] + [None]
+
+def open_camera(path, fps, size, passthrough=False):
+    """Video track of a V4L2 device, None if it can't be opened
+
+    With passthrough, H.264 capture comes out as encoded packets, every other format is decoded.
+    The track's input_format and passthrough attributes say what was picked.
+    """
+    for input_format in input_formats(path, passthrough):
+        options = {"framerate": str(fps), "video_size": f"{size[0]}x{size[1]}"}
+        if input_format is not None:
+            options["input_format"] = input_format
+        decode = not (passthrough and input_format == "h264")
+        try:
+            track = MediaPlayer(path, format="v4l2", options=options, decode=decode).video
+        except Exception as e:
+            print(f"⚠️ Failed to open {path} as {input_format or 'raw'}: {str(e)}")
+            continue
+        if track is None:
+            continue
+        track.input_format = input_format or "raw"
+        track.passthrough = not decode
+        return track
+    return None
+
+def open_synthetic(path, fps, size, passthrough=False):
+    return SyntheticVideoTrack(size[0], size[1], fps)
+
+async def attach_camera(path, info):
+    """Put a camera that was just plugged in on a free slot, False if there is none or it won't open"""
+    slot = next((s for s in slots if s.source is None), None)
+    if slot is None:
+        return False
+    track = await asyncio.to_thread(slot.opener, path, slot.capture_fps, slot.size, slot.passthrough)
+    if track is None:
+        return False
+    slot.attach(track, path)
+    print(f"🔌 {info['card']} on {path} streaming {track.input_format} on slot {slots.index(slot)}")
+    return True
+
+async def detach_camera(path):
+    for i, slot in enumerate(slots):
+        if slot.path == path:
+            slot.detach()
+            print(f"❎ {path} unplugged, slot {i} paused")
 
 def create_local_tracks(camera_amount):
+    """Video tracks to send, one per camera"""
     tracks = []
-    options = {"framerate": "30", "video_size": "640x480"}
+    options = {"framerate": CAMERA_FRAMERATE, "video_size": CAMERA_VIDEO_SIZE}
+
+    fps = float(CAMERA_FRAMERATE)
+    size = tuple(int(v) for v in CAMERA_VIDEO_SIZE.split("x"))
+    if CAMERA_SOURCE == "synthetic":
+        slots[:] = [CameraSlot(open_synthetic, fps, size) for _ in range(camera_amount)]
+        for slot in slots:
+            slot.attach(open_synthetic(None, fps, size))
+        return with_inference_streams(slots)
 
     if platform.system() == "Darwin":  # macOS
-        tracks.append(MediaPlayer("default:none", format="avfoundation", options=options))
+        tracks.append(MediaPlayer("default:none", format="avfoundation", options=options).video)
         return tracks
     elif platform.system() == "Windows":
-        tracks.append(MediaPlayer("video=Integrated Camera", format="dshow", options=options))
+        tracks.append(MediaPlayer("video=Integrated Camera", format="dshow", options=options).video)
         return tracks
     else:  # Linux
-        available_cams = find_available_cameras(camera_amount)
+        # Every camera gets a slot up front, cameras plugged in later fill the free ones
+        slots[:] = [CameraSlot(open_camera, fps, size) for _ in range(camera_amount)]
+        available_cams = [path for path, _ in find_cameras(max_cameras=camera_amount)]
         print(f"Discovered cameras: {available_cams}")
-        
         if not available_cams:
-            raise RuntimeError("No valid cameras found!")
-        
-        for cam_dev in available_cams:
-            try:
-                player = MediaPlayer(cam_dev, format="v4l2", options=options)
-                tracks.append(player)
-            except Exception as e:
-                print(f"⚠️ Failed to open {cam_dev}: {str(e)}")
-                continue
-                
-        return tracks
+            print("⚠️ No cameras found yet, waiting for one to be plugged in")
+
+        # Opening negotiates formats and allocates buffers, do all cameras at once
+        with ThreadPoolExecutor(max_workers=max(1, len(available_cams))) as pool:
+            opened = list(pool.map(lambda path: open_camera(path, fps, size, PASSTHROUGH), available_cams))
+        free = iter(slots)
+        for cam_dev, track in zip(available_cams, opened):
+            if track is not None:
+                slot = next(free)
+                # Fixed for the connection, it decides the codec the slot negotiates
+                slot.passthrough = track.passthrough
+                slot.attach(track, cam_dev)
+                print(f"📷 {cam_dev} captures {track.input_format}" + (", sent without re-encoding" if track.passthrough else ""))
+
+        return with_inference_streams(slots)
+
+def with_inference_streams(camera_slots):
+    """The slots, each followed by its inference stream when simulcasting"""
+    if not CAMERA_SIMULCAST:
+        return list(camera_slots)
+    size = tuple(int(v) for v in CAMERA_INFERENCE_SIZE.split("x"))
+    tracks = []
+    for slot in camera_slots:
+        tracks += [slot, InferenceStream(slot, size)]
+    return tracks
 
 async def create_offer():
     global local_tracks
     camera_amount = int(sys.argv[1])
     
-    tracks = create_local_tracks(camera_amount)
-    if not tracks:
+    local_tracks = create_local_tracks(camera_amount)
+    if not local_tracks:
         await shutdown()
         raise RuntimeError("No valid camera tracks available")
-    
-    local_tracks = [t.video for t in tracks]
+
     for track in local_tracks:
-        pc.addTrack(track)
+        sender = pc.addTrack(track)
+        if getattr(track, "passthrough", False):
+            # The camera's H.264 goes out as it is, so this sender has to negotiate H.264
+            transceiver = next(t for t in pc.getTransceivers() if t.sender is sender)
+            transceiver.setCodecPreferences([codec for codec in RTCRtpSender.getCapabilities("video").codecs
+                                             if codec.mimeType in ("video/H264", "video/rtx")])
+    # The server asks for the capture rate and size it can keep up with on this channel
+    global control_channel
+    control_channel = pc.createDataChannel("control")
+    control_channel.on("message", on_control_message)
+
+    # Hot-plug: cameras that appear or vanish are swapped in and out of the slots
+    global watcher
+    if CAMERA_SOURCE == "v4l2" and slots and CAMERA_WATCH_INTERVAL > 0:
+        watcher = DeviceWatcher(attach_camera, detach_camera, interval=CAMERA_WATCH_INTERVAL)
+        watcher.start(slot.path for slot in slots if slot.path)
 
     # Create and set local description
     offer = await pc.createOffer()
@@ -113,6 +407,31 @@ async def create_offer():
         'type': pc.localDescription.type
     })
 
+def on_control_message(message):
+    """{"type": "capture", "track": <track id>, "fps": 12.5, "width": 640, "height": 480}, size optional
+
+    {"type": "inference", "width": 256, "height": 256} sizes the simulcast inference streams.
+    The camera's own messages on this channel, {"type": "frame", ...}, go the other way.
+    """
+    try:
+        request = json.loads(message)
+    except ValueError:
+        return
+    if request.get("type") == "inference":
+        for slot in slots:
+            if slot.companion is not None:
+                slot.companion.size = (request["width"], request["height"])
+        print(f"🔍 Server model takes {request['width']}x{request['height']}")
+        return
+    if request.get("type") != "capture":
+        return
+    size = (request["width"], request["height"]) if request.get("width") and request.get("height") else None
+    for slot in slots:
+        # Asking for either stream of a simulcast pair paces both, they share the slot's frames
+        if request.get("track") in (slot.id, slot.companion and slot.companion.id):
+            print(f"📉 Server asks for {request['fps']} fps" + (f" at {size[0]}x{size[1]}" if size else ""))
+            asyncio.ensure_future(slot.configure(request["fps"], size))
+
 @sio.event
 async def connect():
     print("Connected to signaling server")
@@ -151,8 +470,8 @@ async def main():
         sys.exit(1)
 
     try:
-        await sio.connect('https://192.168.0.151:8181/',
-            auth={'userName': 'camera-module', 'password': 'x'}
+        await sio.connect(SIGNALING_URL,
+            auth={'userName': CAMERA_NAME, 'password': 'x'}
         )
         await sio.wait()
     except KeyboardInterrupt:
@@ -170,7 +489,9 @@ async def shutdown():
         print("Closed peer connection")
     
     # Release camera resources
-    for track in local_tracks:
+    if watcher is not None:
+        watcher.stop()
+    for track in local_tracks or []:
         track.stop()
     # Disconnect from signaling server
     if sio.connected:
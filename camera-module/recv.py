@@ -1,138 +1,311 @@
+"""Headless receiver and load generator for the camera module or the depth server's output
+
+Starts --clients viewers, each with its own signaling connection and peer connection, answering
+one offer from RECV_FROM. The server puts a new viewer offer up once one is taken, so clients are
+admitted one after another and setup time shows how long the last one waited. Frames are only
+looked at in place: arrival time, and the capture stamp of synthetic.py frames for latency.
+
+Every --interval seconds each client prints its tracks' frame rate, inter-frame jitter and freezes
+over that window. A final summary per client, with connection setup time, can go to --report as JSON.
+
+The depth server describes every frame it sends on a "frames" data channel: the camera's frame id,
+the wall-clock time it was captured and the times it reached the server, came out of inference and
+went to the encoder. Matched to frames by track and pts, that gives the latency of each stage and
+the frame id RGB and depth are paired by. Stage times are only meaningful with synced clocks.
+
+    RECV_FROM=server python recv.py --clients 8 --duration 60
+    python recv.py --dump             # one client, printing every frame it gets
+"""
+import argparse
 import asyncio
+import json
+import os
+import time
 import socketio
-from aiortc import RTCPeerConnection, VideoStreamTrack, RTCSessionDescription, RTCIceCandidate
+from aiortc import RTCPeerConnection, RTCSessionDescription, RTCIceCandidate
 import numpy as np
 
-class FrameReceiver(VideoStreamTrack):
-    def __init__(self):
-        super().__init__()
-        self.frame_count = 0
+from synthetic import stamp_latency_ms
 
-    async def recv(self):
-        try:
-            frame = await super().recv()
-            self.frame_count += 1
-            
-            # Print basic frame info
-            print(f"\n📦 Frame {self.frame_count}")
-            print(f"  Resolution: {frame.width}x{frame.height}")
-            print(f"  Format: {frame.format.name}")
-            print(f"  PTS: {frame.pts}")
-
-            # Convert to bytes and print sample data
-            if frame.format.name in ['yuv420p', 'nv12']:
-                y_plane = frame.planes[0]
-                bytes_data = bytes(y_plane)
-                print(f"  Y Plane First 16 bytes: {bytes_data[:16].hex()}")
-                
-                # Print 8x8 pixel grid from top-left corner
-                print("\n  Sample Y Channel 8x8 Grid:")
-                y_data = np.frombuffer(bytes_data, dtype=np.uint8)
-                y_data = y_data.reshape((frame.height, frame.width))
-                for row in y_data[:8, :8]:
-                    print("   ", " ".join(f"{pixel:03d}" for pixel in row))
+# Signaling server, the Node one in webrtc/ or central_server/signaling.py for local runs
+SIGNALING_URL = os.environ.get("SIGNALING_URL", "https://192.168.0.151:8181")
+# Whose offers to answer, by signaling name prefix: a camera module directly, or "server" for the
+# depth server's output
+RECV_FROM = os.environ.get("RECV_FROM", "camera-module")
+# With RECV_FROM=server, only answer viewer offers for this camera module's output. Empty for any
+RECV_CAMERA = os.environ.get("RECV_CAMERA", "")
+# Signaling name of the clients, numbered when there are several. Give each process its own
+RECV_NAME = os.environ.get("RECV_NAME", "recv-client")
 
-            elif frame.format.name == 'rgb24':
-                bytes_data = bytes(frame.planes[0])
-                print(f"  First 24 RGB bytes: {bytes_data[:24].hex()}")
+# Frame info timestamps in pipeline order
+STAGE_TIMES = ("captured", "received", "inferred", "sent", "arrived")
 
-            return frame
-            
-        except Exception as e:
-            print(f"Frame reception error: {str(e)}")
-            raise
+def stage_order(stage):
+    """Sort key putting "start->end" stages in pipeline order, a span ending where others do after them"""
+    start, end = (STAGE_TIMES.index(name) for name in stage.split("->"))
+    return end, -start
+
+def nearby_key(pending, index, pts, default=None):
+    """The (track, pts) key of pending within a tick or two of pts, decoded pts can be one off what was sent"""
+    for key in ((index, pts), (index, pts - 1), (index, pts + 1), (index, pts - 2), (index, pts + 2)):
+        if key in pending:
+            return key
+    return default
+
+class TrackStats:
+    """Arrival times of one received track, for frame rate, jitter and freeze counts"""
+    def __init__(self, track_id):
+        self.track_id = track_id
+        self.frames = 0
+        self.first = None
+        self.last = None
+        self.intervals = []  # ms between consecutive frames
+        self.freezes = 0
+        self.latency_ms = []
+        self.window = 0  # index into intervals where the current summary window starts
+        self.window_freezes = 0
+        self.stages = {}  # stage -> ms per frame, from the server's frame info
+        self.frame_ids = []
+
+    def add(self, now, latency=None):
+        if self.last is not None:
+            interval = (now - self.last) * 1000
+            recent = self.intervals[-30:]
+            if len(recent) >= 5:
+                average = sum(recent) / len(recent)
+                # WebRTC's freeze: three frame times late, or 150ms more than one at low frame rates
+                if interval > max(3 * average, average + 150):
+                    self.freezes += 1
+            self.intervals.append(interval)
+        if self.first is None:
+            self.first = now
+        self.last = now
+        self.frames += 1
+        if latency is not None:
+            self.latency_ms.append(latency)
+
+    def add_info(self, info, arrived):
+        """Stage latencies of one frame from its frame info and the wall-clock ms it arrived at
+
+        Frames the camera didn't announce have no capture time. They still count towards the
+        stages they have, but not towards captured->arrived, so each stage's median comes with how
+        many frames it is over.
+        """
+        times = [(name, info.get(name)) for name in STAGE_TIMES[:-1]] + [("arrived", arrived)]
+        times = [(name, t) for name, t in times if t is not None]
+        for (start, t0), (end, t1) in zip(times, times[1:]):
+            self.stages.setdefault(f"{start}->{end}", []).append(t1 - t0)
+        if info.get("captured") is not None:
+            self.stages.setdefault("captured->arrived", []).append(arrived - info["captured"])
+        if info.get("id") is not None:
+            self.frame_ids.append(info["id"])
+
+    def take_window(self):
+        """Frame rate, jitter and freezes since the last call"""
+        intervals = self.intervals[self.window:]
+        freezes = self.freezes - self.window_freezes
+        self.window, self.window_freezes = len(self.intervals), self.freezes
+        if not intervals:
+            return 0.0, 0.0, freezes
+        return 1000 * len(intervals) / sum(intervals), float(np.std(intervals)), freezes
+
+    def summary(self, start):
+        # Pipeline order, whichever frame first had them
+        stages = sorted(self.stages.items(), key=lambda item: stage_order(item[0]))
+        span = (self.last - self.first) if self.frames > 1 else 0.0
+        return {
+            "frames": self.frames,
+            "setup_s": self.first - start if self.first is not None else None,
+            "fps": (self.frames - 1) / span if span > 0 else 0.0,
+            "jitter_ms": float(np.std(self.intervals)) if self.intervals else 0.0,
+            "freezes": self.freezes,
+            "latency_ms": self.latency_ms,
+            "stage_ms": {stage: float(np.median(values)) for stage, values in stages},
+            "stage_frames": {stage: len(values) for stage, values in stages},
+            "identified": len(self.frame_ids),
+        }
 
 class RemoteStreamProcessor:
-    def __init__(self):
+    def __init__(self, verbose=False):
         self.frame_count = 0
         self.active_tracks = set()
+        self.verbose = verbose
+        self.start = time.perf_counter()
+        self.track_stats = []  # per track, in the order they arrived
+        # (track index, pts) -> frame info not matched to a frame yet, or the arrival time of a frame
+        # whose info hasn't come in. Whichever of the two comes second completes the pair
+        self.pending_info = {}
+        self.pending_frames = {}
+
+    def on_frame_info(self, message):
+        info = json.loads(message)
+        key = nearby_key(self.pending_frames, info["track"], info["pts"], (info["track"], info["pts"]))
+        arrived = self.pending_frames.pop(key, None)
+        if arrived is not None and info["track"] < len(self.track_stats):
+            self.track_stats[info["track"]].add_info(info, arrived)
+        else:
+            self.remember(self.pending_info, key, info)
+
+    def remember(self, pending, key, value, limit=300):
+        pending[key] = value
+        if len(pending) > limit:
+            del pending[next(iter(pending))]
 
     async def process_track(self, track):
         """Continuously process frames from an incoming media track"""
         self.active_tracks.add(track)
-        print(f"🚨 New track received: {track.kind} (ID: {track.id})")
-        
+        index = len(self.track_stats)
+        stats = TrackStats(track.id)
+        self.track_stats.append(stats)
+
         try:
             while True:
                 frame = await track.recv()
                 self.frame_count += 1
-                self.analyze_frame(frame)
-                
+                # Frames from the synthetic camera carry their capture time
+                stats.add(time.perf_counter(), stamp_latency_ms(frame))
+                arrived = round(time.time() * 1000)
+                info = self.pending_info.pop(nearby_key(self.pending_info, index, frame.pts), None)
+                if info is not None:
+                    stats.add_info(info, arrived)
+                else:
+                    self.remember(self.pending_frames, (index, frame.pts), arrived)
+                if self.verbose:
+                    self.analyze_frame(frame)
+
         except Exception as e:
-            print(f"Track processing failed: {str(e)}")
+            if self.verbose:
+                print(f"Track processing failed: {str(e)}")
         finally:
             self.active_tracks.discard(track)
 
+    def summary(self):
+        """Setup time, frame rate, jitter, freezes and stamped latency per track"""
+        return {"tracks": [stats.summary(self.start) for stats in self.track_stats]}
+
     def analyze_frame(self, frame):
-        """Detailed frame analysis matching JavaScript console output"""
-        # Basic frame info
+        """Frame info and the top-left 8x8 of the luma plane, read in place"""
         print(f"\n📦 Frame {self.frame_count}")
         print(f"  Resolution: {frame.width}x{frame.height}")
         print(f"  Format: {frame.format.name}")
         print(f"  PTS: {frame.pts}")
 
-        # Convert to bytes and print sample data
-        if frame.format.name in ['yuv420p', 'nv12']:
-            y_plane = frame.planes[0]
-            bytes_data = bytes(y_plane)
-            print(f"  Y Plane First 16 bytes: {bytes_data[:16].hex()}")
-            
-            # Print 8x8 pixel grid from top-left corner
-            print("\n  Sample Y Channel 8x8 Grid:")
-            y_data = np.frombuffer(bytes_data, dtype=np.uint8)
-            y_data = y_data.reshape((frame.height, frame.width))
-            for row in y_data[:8, :8]:
-                print("   ", " ".join(f"{pixel:03d}" for pixel in row))
-
-        elif frame.format.name == 'rgb24':
-            bytes_data = bytes(frame.planes[0])
-            print(f"  First 24 RGB bytes: {bytes_data[:24].hex()}")
-
-            
-async def main():
-    sio = socketio.AsyncClient(ssl_verify=False)
-    pc = RTCPeerConnection()
-    pc._canOffer = False  # Ensure this client can't create offers
-    # receiver = FrameReceiver()
-    processor = RemoteStreamProcessor()
-    # pc.addTrack(receiver)
-
-    @sio.event
-    async def connect():
-        print("✅ Connected to signaling server")
-        await sio.emit("requestOffers")
-
-    @sio.event
-    async def availableOffers(offers):
-        print(f"🎯 Found {len(offers)} available offers")
-        for offer in offers:
-            await handle_offer(offer)
-
-    @sio.event
-    async def newOfferAwaiting(offer_list):
-        print("📨 New offer received")
-        if offer_list:
-            await handle_offer(offer_list[0])
-
-    async def handle_offer(offer_data):
-        if(offer_data["offererUserName"] != "camera-module"):
-            print(f"❌ Ignoring offer from {offer_data['offererUserName']}")
+        if frame.format.name in ['yuv420p', 'nv12', 'rgb24']:
+            # Rows can be padded past the width, view the plane with its line size instead of copying it
+            plane = frame.planes[0]
+            data = np.frombuffer(plane, dtype=np.uint8).reshape(plane.height, plane.line_size)
+            print(f"  First 16 bytes: {data[0, :16].tobytes().hex()}")
+            if frame.format.name != 'rgb24':
+                print("\n  Sample Y Channel 8x8 Grid:")
+                for row in data[:8, :8]:
+                    print("   ", " ".join(f"{pixel:03d}" for pixel in row))
+
+class ReceiverClient:
+    """One viewer: a signaling connection and a peer connection answering a single offer
+
+    claimed is shared by all clients of the process, so two of them never answer the same offer.
+    """
+    def __init__(self, name, claimed, verbose=False):
+        self.name = name
+        self.claimed = claimed
+        self.verbose = verbose
+        self.sio = socketio.AsyncClient(ssl_verify=False)
+        self.pc = RTCPeerConnection()
+        self.pc._canOffer = False  # Ensure this client can't create offers
+        self.processor = RemoteStreamProcessor(verbose)
+        self.answering = False
+        self.camera = None  # camera module whose output the answered offer carries
+        self.register()
+
+    def log(self, message):
+        print(f"[{self.name}] {message}")
+
+    def register(self):
+        sio, pc = self.sio, self.pc
+
+        @sio.event
+        async def connect():
+            self.log("✅ Connected to signaling server")
+            await sio.emit("requestOffers")
+
+        @sio.event
+        async def availableOffers(offers):
+            for offer in offers:
+                await self.handle_offer(offer)
+
+        @sio.event
+        async def newOfferAwaiting(offer_list):
+            if offer_list:
+                await self.handle_offer(offer_list[0])
+
+        @sio.event
+        async def receivedIceCandidateFromServer(candidate):
+            try:
+                await pc.addIceCandidate(RTCIceCandidate(
+                    candidate=candidate["candidate"],
+                    sdpMid=candidate["sdpMid"],
+                    sdpMLineIndex=candidate["sdpMLineIndex"]
+                ))
+            except Exception as e:
+                self.log(f"Error adding ICE candidate: {str(e)}")
+
+        @pc.on("icecandidate")
+        def on_ice_candidate(candidate):
+            if candidate:
+                asyncio.create_task(sio.emit("sendIceCandidateToSignalingServer", {
+                    "didIOffer": False,
+                    "iceUserName": self.name,
+                    "offerSdp": pc.remoteDescription.sdp if pc.remoteDescription else None,
+                    "iceCandidate": {
+                        "candidate": candidate.candidate,
+                        "sdpMid": candidate.sdpMid,
+                        "sdpMLineIndex": candidate.sdpMLineIndex
+                    }
+                }))
+
+        @pc.on("datachannel")
+        def on_datachannel(channel):
+            if channel.label == "frames":
+                channel.on("message", self.processor.on_frame_info)
+
+        @pc.on("track")
+        def on_track(track):
+            self.log(f"🎉 Got a {track.kind} track (ID: {track.id})")
+            asyncio.create_task(self.processor.process_track(track))
+
+        @pc.on("connectionstatechange")
+        async def on_connectionstatechange():
+            self.log(f"Connection state is {pc.connectionState}")
+            if pc.connectionState == "failed":
+                await pc.close()
+                self.log("❌ Connection failed, closing peer connection")
+
+    async def handle_offer(self, offer_data):
+        if not offer_data["offererUserName"].startswith(RECV_FROM) or offer_data.get("answererUserName"):
+            return
+        camera = offer_data["offer"].get("camera")
+        if RECV_CAMERA and camera != RECV_CAMERA:
             return
+        # One peer connection per client, later offers are for other viewers
+        sdp = offer_data['offer']['sdp']
+        if self.answering or sdp in self.claimed:
+            return
+        self.answering = True
+        self.claimed.add(sdp)
+        self.camera = camera
         try:
-            await pc.setRemoteDescription(RTCSessionDescription(
-                sdp=offer_data['offer']['sdp'],
-                type=offer_data['offer']['type']
-            ))
-            
-            answer = await pc.createAnswer()
-            await pc.setLocalDescription(answer)
-            
-            # Use call() instead of emit() for proper timeout handling
+            await self.pc.setRemoteDescription(RTCSessionDescription(sdp=sdp, type=offer_data['offer']['type']))
+            answer = await self.pc.createAnswer()
+            await self.pc.setLocalDescription(answer)
+
+            # The ack carries the ICE candidates the offerer trickled so far
             try:
-                offer_ice_candidates = await sio.call(
+                offer_ice_candidates = await self.sio.call(
                     "newAnswer",
                     {
                         "offererUserName": offer_data["offererUserName"],
+                        # Which of the offerer's offers this answers, the server has one up per camera
+                        "offer": offer_data["offer"],
                         "answer": {
                             "type": answer.type,
                             "sdp": answer.sdp
@@ -140,80 +313,105 @@ async def main():
                     },
                     timeout=10  # Timeout in seconds
                 )
-                
-                if offer_ice_candidates:
-                    print(f"Received {len(offer_ice_candidates)} ICE candidates")
-                    for candidate in offer_ice_candidates:
-                        await pc.addIceCandidate(RTCIceCandidate(
-                            candidate=candidate["candidate"],
-                            sdpMid=candidate["sdpMid"],
-                            sdpMLineIndex=candidate["sdpMLineIndex"]
-                        ))
-                        
+                for candidate in offer_ice_candidates or []:
+                    await self.pc.addIceCandidate(RTCIceCandidate(
+                        candidate=candidate["candidate"],
+                        sdpMid=candidate["sdpMid"],
+                        sdpMLineIndex=candidate["sdpMLineIndex"]
+                    ))
             except asyncio.TimeoutError:
-                print("⌛ Timeout waiting for server acknowledgment")
-                
-        except Exception as e:
-            print(f"Offer handling error: {str(e)}")
+                self.log("⌛ Timeout waiting for server acknowledgment")
 
-    @sio.event
-    async def receivedIceCandidateFromServer(candidate):
-        try:
-            print("➕ Adding ICE candidate")
-            await pc.addIceCandidate(RTCIceCandidate(
-                candidate=candidate["candidate"],
-                sdpMid=candidate["sdpMid"],
-                sdpMLineIndex=candidate["sdpMLineIndex"]
-            ))
         except Exception as e:
-            print(f"Error adding ICE candidate: {str(e)}")
-
-    @pc.on("icecandidate")
-    def on_ice_candidate(candidate):
-        if candidate:
-            print("❄️ Sending ICE candidate")
-            asyncio.create_task(sio.emit("sendIceCandidateToSignalingServer", {
-                "didIOffer": False,
-                "iceUserName": "recv-client",
-                "iceCandidate": {
-                    "candidate": candidate.candidate,
-                    "sdpMid": candidate.sdpMid,
-                    "sdpMLineIndex": candidate.sdpMLineIndex
-                }
-            }))
-    @pc.on("track")
-    def on_track(track):
-        print("🎉 Got a track from the other peer! How exciting")
-        print(f"Track details: {track}")
-        asyncio.create_task(processor.process_track(track))
-
-    @pc.on("connectionstatechange")
-    async def on_connectionstatechange():
-        print(f"Connection state is {pc.connectionState}")
-        if pc.connectionState == "failed":
-            await pc.close()
-            print("❌ Connection failed, closing peer connection")
+            self.log(f"Offer handling error: {str(e)}")
 
-    try:
-        await sio.connect(
-            'https://192.168.0.151:8181',
-            auth={'userName': 'recv-client', 'password': 'x'},
+    async def start(self):
+        self.processor.start = time.perf_counter()
+        await self.sio.connect(
+            SIGNALING_URL,
+            auth={'userName': self.name, 'password': 'x'},
             transports=['websocket']
         )
-        await sio.wait()
+
+    async def close(self):
+        await self.pc.close()
+        if self.sio.connected:
+            await self.sio.disconnect()
+
+    def print_window(self):
+        for i, stats in enumerate(self.processor.track_stats):
+            fps, jitter, freezes = stats.take_window()
+            self.log(f"📈 track {i}: {fps:5.1f} fps, jitter {jitter:5.1f}ms, {freezes} freezes")
+        if not self.processor.track_stats:
+            self.log("⏳ no tracks yet")
+
+async def report_periodically(clients, interval):
+    while True:
+        await asyncio.sleep(interval)
+        for client in clients:
+            client.print_window()
+
+async def main(args):
+    claimed = set()
+    # A single client keeps the name the signaling server has always seen
+    names = [RECV_NAME] if args.clients == 1 else [f"{RECV_NAME}-{i}" for i in range(args.clients)]
+    clients = [ReceiverClient(name, claimed, verbose=args.dump) for name in names]
+    reporter = None
+    if args.interval > 0 and not args.quiet:
+        reporter = asyncio.create_task(report_periodically(clients, args.interval))
+
+    try:
+        for client in clients:
+            await client.start()
+            if args.ramp:
+                await asyncio.sleep(args.ramp)
+        # Run until interrupted, or for --duration seconds
+        if args.duration:
+            await asyncio.sleep(args.duration)
+            print(f"⏱️ Stopping after {args.duration}s")
+        else:
+            await asyncio.Event().wait()
     except asyncio.CancelledError:
         print("🛑 Asyncio task cancelled")
     except Exception as e:
         print(f"Connection error: {str(e)}")
     finally:
-        await pc.close()
-        await sio.disconnect()
-        print("🔌 Connection cleanly closed")
-    
-    
+        if reporter is not None:
+            reporter.cancel()
+        for client in clients:
+            await client.close()
+        print("🔌 Connections cleanly closed")
+
+        summaries = []
+        for client in clients:
+            summary = dict(client.processor.summary(), name=client.name, camera=client.camera)
+            summaries.append(summary)
+            for i, track in enumerate(summary["tracks"]):
+                latency = track["latency_ms"]
+                print(f"📊 {client.name} track {i}: {track['frames']} frames, {track['fps']:.1f} fps, "
+                      f"jitter {track['jitter_ms']:.1f}ms, {track['freezes']} freezes, first frame after "
+                      f"{track['setup_s'] or 0:.2f}s" + (f", median latency {np.median(latency):.0f}ms" if latency else ""))
+                if track["stage_ms"]:
+                    stages = ", ".join(f"{stage} {ms:.0f}ms (n={track['stage_frames'][stage]})"
+                                       for stage, ms in track["stage_ms"].items())
+                    print(f"   {track['identified']} frames identified, median {stages}")
+        setups = [track["setup_s"] for s in summaries for track in s["tracks"][:1] if track["setup_s"] is not None]
+        print(f"📊 {len(setups)}/{len(clients)} clients receiving" +
+              (f", setup median {np.median(setups):.2f}s, max {max(setups):.2f}s" if setups else ""))
+        if args.report:
+            with open(args.report, "w") as f:
+                json.dump({"clients": summaries}, f)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=1, help="concurrent viewers to run")
+    parser.add_argument("--ramp", type=float, default=0.0, help="seconds between client starts")
+    parser.add_argument("--duration", type=float, default=0, help="seconds to run, 0 runs until interrupted")
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between summaries, 0 for none")
+    parser.add_argument("--quiet", action="store_true", help="no periodic summaries, only the final one")
+    parser.add_argument("--dump", action="store_true", help="print every frame received")
+    parser.add_argument("--report", help="write the summary as JSON to this file")
     try:
-        asyncio.run(main())
+        asyncio.run(main(parser.parse_args()))
     except KeyboardInterrupt:
         print("\n👋 User interrupted execution")
@@ -0,0 +1,85 @@
+"""Synthetic camera for running without a video device, with the capture time drawn into each frame
+
+The stamp is a row of 40 black or white blocks along the top of the luma plane: 32 bits of the
+wall-clock capture time in milliseconds and an 8-bit checksum. Blocks are width / 40 pixels
+square, large enough to survive a couple of VP8 generations, so a receiver on the same machine
+can read the end-to-end latency off any frame that came from this source.
+"""
+import asyncio
+import time
+
+import numpy as np
+from aiortc import VideoStreamTrack
+from aiortc.mediastreams import VIDEO_CLOCK_RATE, VIDEO_TIME_BASE
+from av import VideoFrame
+
+STAMP_BITS = 40
+# Readings further back than this are a block pattern that happened to pass the checksum
+MAX_LATENCY_MS = 60000
+
+def stamp_bits(ms):
+    value = ms & 0xFFFFFFFF
+    checksum = sum(value.to_bytes(4, "big")) & 0xFF
+    return [(value >> (31 - i)) & 1 for i in range(32)] + [(checksum >> (7 - i)) & 1 for i in range(8)]
+
+def write_stamp(luma, ms):
+    """Draw the stamp for ms into the top of a (height, width) luma array"""
+    block = luma.shape[1] // STAMP_BITS
+    for i, bit in enumerate(stamp_bits(ms)):
+        luma[:block, i * block:(i + 1) * block] = 235 if bit else 16
+
+def read_stamp(frame):
+    """Capture time in ms (modulo 2**32) from a yuv420p frame, or None if it carries no valid stamp"""
+    plane = frame.planes[0]
+    block = frame.width // STAMP_BITS
+    if block < 4:
+        return None
+    # View the luma rows in place, line_size may be wider than the frame
+    luma = np.frombuffer(plane, np.uint8).reshape(plane.height, plane.line_size)
+    centers = luma[block // 2, block // 2:STAMP_BITS * block:block]
+    bits = (centers > 128).astype(np.int64)
+    value = int(bits[:32].dot(1 << np.arange(31, -1, -1, dtype=np.int64)))
+    checksum = int(bits[32:].dot(1 << np.arange(7, -1, -1, dtype=np.int64)))
+    if checksum != sum(value.to_bytes(4, "big")) & 0xFF:
+        return None
+    return value
+
+def stamp_latency_ms(frame):
+    """Milliseconds since the stamped frame was captured, None for unstamped frames"""
+    captured = read_stamp(frame)
+    if captured is None:
+        return None
+    latency = (int(time.time() * 1000) - captured) & 0xFFFFFFFF
+    return latency if latency <= MAX_LATENCY_MS else None
+
+class SyntheticVideoTrack(VideoStreamTrack):
+    """Moving test pattern at a fixed frame rate, stamped with its capture time"""
+    def __init__(self, width=640, height=480, fps=30.0):
+        super().__init__()
+        self.width = width
+        self.height = height
+        self.fps = fps
+        # Smooth gradients compress like a real scene, noise would eat the encoder's bitrate
+        x = np.linspace(0, 4 * np.pi, width * 2)
+        self.pattern = (128 + 80 * np.sin(x)[None, :] * np.cos(np.linspace(0, np.pi, height))[:, None]).astype(np.uint8)
+        self.yuv = np.full((height * 3 // 2, width), 128, dtype=np.uint8)
+        self.index = 0
+        self.start = None
+
+    async def recv(self):
+        if self.start is None:
+            self.start = time.monotonic()
+        else:
+            delay = self.start + self.index / self.fps - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        shift = (self.index * 8) % self.width
+        self.yuv[:self.height] = self.pattern[:, shift:shift + self.width]
+        write_stamp(self.yuv[:self.height], int(time.time() * 1000))
+
+        frame = VideoFrame.from_ndarray(self.yuv, format="yuv420p")
+        frame.pts = int(self.index / self.fps * VIDEO_CLOCK_RATE)
+        frame.time_base = VIDEO_TIME_BASE
+        self.index += 1
+        return frame
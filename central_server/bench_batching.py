@@ -0,0 +1,68 @@
+"""Compare aggregate depth fps for 1, 2, 4 and 8 synthetic tracks with and without batching
+
+    python bench_batching.py --synthetic --seconds 10
+"""
+import argparse
+import asyncio
+import time
+
+from bench_utils import bench_engine, synthetic_frames
+from inference_worker import InferenceWorker, BatchScheduler
+
+async def feed_track(track_id, infer, frames, stop, counts):
+    """Act like one camera's inference loop, always submitting its next frame as soon as the last one is done"""
+    for img in frames:
+        if stop.is_set():
+            break
+        await infer(track_id, img)
+        counts[track_id] += 1
+
+async def run(engine, track_count, batched, seconds, window):
+    worker = InferenceWorker(engine)
+    scheduler = BatchScheduler(worker, window=window, max_batch=track_count)
+    if batched:
+        infer = scheduler.infer
+    else:
+        async def infer(track_id, img):
+            return await worker.infer(img)
+
+    stop = asyncio.Event()
+    counts = {}
+    tasks = []
+    for i in range(track_count):
+        track_id = f"track-{i}"
+        counts[track_id] = 0
+        if batched:
+            scheduler.register(track_id)
+        frames = synthetic_frames(10_000, seed=i)
+        tasks.append(asyncio.create_task(feed_track(track_id, infer, frames, stop, counts)))
+
+    start = time.perf_counter()
+    await asyncio.sleep(seconds)
+    stop.set()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    scheduler.shutdown()
+    worker.shutdown()
+    total = sum(counts.values())
+    return total / elapsed, min(counts.values()) / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--window-ms", type=float, default=10.0)
+    parser.add_argument("--tracks", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--synthetic", action="store_true", help="use a synthetic conv net instead of MiDaS")
+    args = parser.parse_args()
+
+    engine = bench_engine(args.synthetic)
+    print(f"{'tracks':>6} {'mode':>10} {'total fps':>10} {'slowest track fps':>18}")
+    for track_count in args.tracks:
+        for batched in (False, True):
+            total_fps, slowest_fps = asyncio.run(run(engine, track_count, batched, args.seconds, args.window_ms / 1000))
+            mode = "batched" if batched else "per-frame"
+            print(f"{track_count:>6} {mode:>10} {total_fps:>10.2f} {slowest_fps:>18.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Bytes and server CPU per depth frame, 8-bit video track vs the depth data channel
+
+Video path: postprocess to 8-bit, write into a pooled yuv420p frame and VP8-encode it with aiortc's
+encoder, as the depth track does. Data channel path: quantize, delta code and compress the float
+depth with depth_channel.py, then decode it again to report the round-trip error. The input is a
+smooth synthetic depth sequence (a tilted plane with a moving blob) at the model's output size,
+with a few edge pixels flickering as MiDaS' extremes do.
+
+    python bench_depth_transport.py --frames 120 --width 640 --height 480
+"""
+import argparse
+import time
+from fractions import Fraction
+
+import numpy as np
+from aiortc import RTCRtpCodecParameters
+from aiortc.codecs import get_encoder
+
+import config
+from bench_utils import summarize
+from depth import postprocess_depth
+from depth_channel import DepthFrameDecoder, DepthFrameEncoder
+from main import DepthVideoStreamTrack
+
+def depth_sequence(count, size=256):
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.float32) / size
+    plane = 800.0 + 1500.0 * yy + 200.0 * xx
+    for i in range(count):
+        cx = 0.2 + 0.6 * (i % 60) / 60
+        blob = 900.0 * np.exp(-((xx - cx) ** 2 + (yy - 0.5) ** 2) / 0.01)
+        depth = plane + blob
+        # MiDaS' extremes flicker at object edges, which moves each frame's min/max without the
+        # rest of the scene changing
+        depth[:4, :4] = 600.0 + 150.0 * np.sin(i * 0.7)
+        depth[-4:, -4:] = 3600.0 + 200.0 * np.cos(i * 1.3)
+        yield depth.astype(np.float32)
+
+def video_path(depths, width, height):
+    track = DepthVideoStreamTrack()
+    encoder = get_encoder(RTCRtpCodecParameters(mimeType="video/VP8", clockRate=90000))
+    sizes, cpu_ms = [], []
+    for i, depth in enumerate(depths):
+        start = time.process_time()
+        frame = track.to_frame(postprocess_depth(depth, (height, width)))
+        frame.pts, frame.time_base = i * 3000, Fraction(1, 90000)
+        payloads, _ = encoder.encode(frame, force_keyframe=(i == 0))
+        cpu_ms.append((time.process_time() - start) * 1000)
+        sizes.append(sum(len(p) for p in payloads))
+    return sizes, cpu_ms
+
+def channel_path(depths, fmt, keyframe_interval):
+    encoder, decoder = DepthFrameEncoder(fmt, keyframe_interval), DepthFrameDecoder()
+    sizes, cpu_ms, errors = [], [], []
+    for i, depth in enumerate(depths):
+        start = time.process_time()
+        chunks = encoder.encode(i, depth)
+        cpu_ms.append((time.process_time() - start) * 1000)
+        sizes.append(sum(len(c) for c in chunks))
+
+        for chunk in chunks:
+            result = decoder.push(chunk)
+        errors.append(float(np.max(np.abs(result[1] - depth) / depth)))
+    return sizes, cpu_ms, errors
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=120)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--keyframe-interval", type=int, default=config.DEPTH_CHANNEL_KEYFRAME_INTERVAL)
+    args = parser.parse_args()
+
+    depths = list(depth_sequence(args.frames, config.INPUT_SIZE))
+
+    sizes, cpu_ms = video_path(depths, args.width, args.height)
+    summarize("video track (8-bit VP8) cpu", cpu_ms)
+    print(f"  {np.mean(sizes) / 1024:.1f} KiB/frame, 8-bit, lossy")
+
+    for fmt in ("uint16", "float16"):
+        sizes, cpu_ms, errors = channel_path(depths, fmt, args.keyframe_interval)
+        summarize(f"data channel ({fmt}) cpu", cpu_ms)
+        print(f"  {np.mean(sizes) / 1024:.1f} KiB/frame at {depths[0].shape[1]}x{depths[0].shape[0]}, "
+              f"max relative error {max(errors):.2e}")
+
+if __name__ == "__main__":
+    main()
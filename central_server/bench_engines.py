@@ -0,0 +1,62 @@
+"""Time every depth engine on this box so the fastest one can be set in DEPTH_ENGINE
+
+Exports the model to a temporary directory, then runs each engine and thread count on the same input.
+
+    python bench_engines.py --synthetic --threads 0 1 4
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+import config
+from bench_utils import summarize
+from depth import load_model
+from engines import EagerEngine, OnnxEngine, SyntheticDepthModel, TorchScriptEngine, export_onnx, export_torchscript
+
+def time_engine(engine, image_tensor, iterations):
+    engine.predict(image_tensor)  # warm up, lets TorchScript and ONNX Runtime finish optimizing
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        engine.predict(image_tensor)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--batch", type=int, default=1)
+    parser.add_argument("--threads", type=int, nargs="+", default=[0])
+    parser.add_argument("--graph-opt", default="all")
+    parser.add_argument("--synthetic", action="store_true", help="use a synthetic conv net instead of MiDaS")
+    args = parser.parse_args()
+
+    model = SyntheticDepthModel().eval() if args.synthetic else load_model(config.MODEL, config.HUB_DIR)
+    image_tensor = torch.randn(args.batch, 3, config.INPUT_SIZE, config.INPUT_SIZE)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ts_path = os.path.join(tmp, "model.pt")
+        onnx_path = os.path.join(tmp, "model.onnx")
+        size = (config.INPUT_SIZE, config.INPUT_SIZE)
+        export_torchscript(model, ts_path, size)
+        export_onnx(model, onnx_path, size)
+
+        reference = EagerEngine(model).predict(image_tensor)
+        for threads in args.threads:
+            engines = [
+                EagerEngine(model, threads),
+                TorchScriptEngine(ts_path, threads, args.graph_opt),
+                OnnxEngine(onnx_path, threads, args.graph_opt),
+            ]
+            for engine in engines:
+                drift = float(np.abs(engine.predict(image_tensor) - reference).max())
+                samples = time_engine(engine, image_tensor, args.iterations)
+                summarize(f"{engine.name} threads={threads or 'default'}", samples)
+                print(f"{'':<28} max abs diff vs eager {drift:.2e}")
+
+if __name__ == "__main__":
+    main()
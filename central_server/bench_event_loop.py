@@ -0,0 +1,59 @@
+"""Measure asyncio event-loop lag while depth frames are processed inline vs on the inference worker
+
+    python bench_event_loop.py --synthetic --frames 60 --fps 30
+"""
+import argparse
+import asyncio
+import time
+
+from bench_utils import bench_engine, synthetic_frames, summarize
+from depth import estimate_depth
+from inference_worker import InferenceWorker
+
+TICK_INTERVAL = 0.005  # 5ms, roughly the granularity aiortc's RTP timers care about
+
+async def measure_lag(samples, stop):
+    """Record how late the loop wakes up a task that asked to sleep TICK_INTERVAL"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + TICK_INTERVAL
+        await asyncio.sleep(TICK_INTERVAL)
+        samples.append(max(0.0, loop.time() - expected) * 1000)
+
+async def run(mode, engine, frames, fps):
+    lag_samples = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(measure_lag(lag_samples, stop))
+    worker = InferenceWorker(engine) if mode == "worker" else None
+
+    start = time.perf_counter()
+    for img in frames:
+        if worker is None:
+            estimate_depth(engine, img)  # the old analyze_frame path
+        else:
+            await worker.infer(img)
+        await asyncio.sleep(1.0 / fps)
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await ticker
+    if worker is not None:
+        worker.shutdown()
+    return lag_samples, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=60)
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--synthetic", action="store_true", help="use a synthetic conv net instead of MiDaS")
+    args = parser.parse_args()
+
+    engine = bench_engine(args.synthetic)
+    for mode in ("inline", "worker"):
+        frames = synthetic_frames(args.frames)
+        lag, elapsed = asyncio.run(run(mode, engine, frames, args.fps))
+        summarize(f"{mode} event-loop lag", lag)
+        print(f"{'':<28} {args.frames / elapsed:.2f} frames/s end to end")
+
+if __name__ == "__main__":
+    main()
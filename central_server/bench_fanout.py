@@ -0,0 +1,155 @@
+"""Server CPU as the number of viewers grows, with depth computed once per frame for all of them
+
+The server side is this process: a producer pushes synthetic camera frames at --fps, runs depth
+on each one through the inference worker and fills the output tracks, and a ViewerHub fans them
+out to one loopback peer connection per viewer. The viewers live in a child process so their
+decoding doesn't count against the server. Reported per viewer count: server CPU, inference
+passes per second (should stay flat) and the frame rate each viewer actually receives.
+
+    python bench_fanout.py --synthetic --viewers 1 2 4 8 16 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import numpy as np
+from aiortc import RTCPeerConnection, RTCSessionDescription
+from av import VideoFrame
+
+import config
+from bench_utils import bench_engine, synthetic_frames
+from fanout import ViewerHub
+from inference_worker import InferenceWorker
+from main import DepthVideoStreamTrack, QueuedVideoStreamTrack
+
+CHILD = """
+import asyncio, json, sys
+from aiortc import RTCPeerConnection, RTCSessionDescription
+from aiortc.mediastreams import MediaStreamError
+
+async def consume(track, counts, i):
+    try:
+        while True:
+            await track.recv()
+            counts[i] += 1
+    except MediaStreamError:
+        pass
+
+def watch(pc, counts, i):
+    consumers = []
+    @pc.on("track")
+    def on_track(track):
+        # Count frames of the first video track, the one the viewer would show
+        if not consumers:
+            consumers.append(asyncio.ensure_future(consume(track, counts, i)))
+
+async def run():
+    loop = asyncio.get_running_loop()
+    offers = json.loads(await loop.run_in_executor(None, sys.stdin.readline))
+    pcs, counts, answers = [], [0] * len(offers), []
+    for i, sdp in enumerate(offers):
+        pc = RTCPeerConnection()
+        watch(pc, counts, i)
+        await pc.setRemoteDescription(RTCSessionDescription(sdp=sdp, type="offer"))
+        await pc.setLocalDescription(await pc.createAnswer())
+        answers.append(pc.localDescription.sdp)
+        pcs.append(pc)
+    print(json.dumps(answers), flush=True)
+
+    while True:
+        command = (await loop.run_in_executor(None, sys.stdin.readline)).strip()
+        if command == "count":
+            print(json.dumps(counts), flush=True)
+        else:
+            break
+    for pc in pcs:
+        await pc.close()
+
+asyncio.run(run())
+"""
+
+async def produce(worker, original_track, depth_track, fps, width, height, stats):
+    """Camera stand-in: one decoded frame and one depth pass per tick, whatever the viewer count"""
+    frames = [VideoFrame.from_ndarray(img, format="bgr24").reformat(format="yuv420p")
+              for img in synthetic_frames(30, width, height)]
+    i = 0
+    while True:
+        tick = time.perf_counter()
+        frame = frames[i % len(frames)]
+        img = frame.to_ndarray(format="bgr24")
+        pts = original_track.put_frame(frame)
+        depth_img = (await worker.infer_batch([img]))[0]
+        stats["inference"] += 1
+        depth_track.put_frame(depth_img, pts)
+        i += 1
+        await asyncio.sleep(max(0.0, 1.0 / fps - (time.perf_counter() - tick)))
+
+async def ask(child, command):
+    child.stdin.write(command.encode() + b"\n")
+    await child.stdin.drain()
+    return json.loads(await child.stdout.readline())
+
+async def measure(hub, viewers, duration, stats):
+    pcs = [RTCPeerConnection() for _ in range(viewers)]
+    for pc in pcs:
+        hub.add_viewer(pc)
+        await pc.setLocalDescription(await pc.createOffer())
+
+    child = await asyncio.create_subprocess_exec(sys.executable, "-c", CHILD, stdin=asyncio.subprocess.PIPE,
+                                                 stdout=asyncio.subprocess.PIPE)
+    answers = await ask(child, json.dumps([pc.localDescription.sdp for pc in pcs]))
+    for pc, sdp in zip(pcs, answers):
+        await pc.setRemoteDescription(RTCSessionDescription(sdp=sdp, type="answer"))
+
+    # Let ICE, DTLS and the first keyframes settle before measuring
+    await asyncio.sleep(2.0)
+    counts_before = await ask(child, "count")
+    inference_before = stats["inference"]
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    await asyncio.sleep(duration)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    counts = await ask(child, "count")
+    inference = stats["inference"] - inference_before
+
+    child.stdin.write(b"stop\n")
+    await child.stdin.drain()
+    await child.wait()
+    for pc in pcs:
+        await pc.close()
+
+    received = [(after - before) / wall for before, after in zip(counts_before, counts)]
+    print(f"viewers {viewers:>3}   server cpu {cpu / wall:6.1%}   inference {inference / wall:5.1f}/s   "
+          f"received fps min {min(received):5.1f} mean {np.mean(received):5.1f}")
+
+async def run(args):
+    engine = bench_engine(args.synthetic)
+    worker = InferenceWorker(engine, (args.input_size, args.input_size))
+    original_track = QueuedVideoStreamTrack()
+    depth_track = DepthVideoStreamTrack()
+    hub = ViewerHub([original_track, depth_track])
+    stats = {"inference": 0}
+    producer = asyncio.create_task(produce(worker, original_track, depth_track, args.fps, args.width, args.height, stats))
+
+    for viewers in args.viewers:
+        await measure(hub, viewers, args.duration, stats)
+
+    producer.cancel()
+    worker.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--viewers", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--fps", type=float, default=10.0)
+    parser.add_argument("--width", type=int, default=320)
+    parser.add_argument("--height", type=int, default=240)
+    parser.add_argument("--input-size", type=int, default=config.INPUT_SIZE, help="model input, lower it to leave CPU for the viewers")
+    parser.add_argument("--synthetic", action="store_true", help="use a synthetic conv net instead of MiDaS")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
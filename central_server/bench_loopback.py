@@ -0,0 +1,153 @@
+"""End-to-end run on one machine: synthetic camera -> depth server -> receiver, no hardware or Node
+
+Starts the signaling stand-in from signaling.py in this process, then the three real entry points
+as subprocesses pointed at it: this server (headless), --cameras camera-module/main.py processes
+with their synthetic source, each its own camera session, and a camera-module/recv.py per camera
+watching that camera's output. The synthetic camera draws its capture time into every frame
+(camera-module/synthetic.py), the receiver reads it back off the server's original video track. Reported per receiver track: connection setup time (receiver start to first frame),
+frame rate, jitter and freezes, the latency of each stage from the server's "frames" channel, and
+for the original track the capture-to-receive latency read off the frame itself.
+--tracks gives each camera module several cameras, which the server keeps apart on their own output
+pairs. --clients runs several receivers per camera module at once. With more than one camera the frame rate each
+camera's output got shows whether the batch scheduler shares the model fairly. The server's CPU
+time over the run is printed too, --simulcast shows what a small inference stream saves it.
+
+    python bench_loopback.py --synthetic --duration 20
+    python bench_loopback.py --synthetic --duration 20 --simulcast
+    python bench_loopback.py --synthetic --duration 20 --cameras 1     # one session, nothing to share
+    python bench_loopback.py --synthetic --duration 20 --tracks 2      # two cameras per module
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+import config
+from bench_utils import summarize
+from signaling import SignalingServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CAMERA_DIR = os.path.join(HERE, "..", "camera-module")
+
+async def start(name, args, cwd, env, log_dir):
+    log = open(os.path.join(log_dir, f"{name}.log"), "w")
+    return await asyncio.create_subprocess_exec(sys.executable, "-u", *args, cwd=cwd, env=env,
+                                                stdout=log, stderr=asyncio.subprocess.STDOUT)
+
+async def wait_for_log(path, text, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with open(path) as f:
+            if text in f.read():
+                return True
+        await asyncio.sleep(0.1)
+    return False
+
+def cpu_seconds(pid):
+    """User plus system CPU time of a running process, None where /proc isn't available"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+async def run(args):
+    signaling = SignalingServer()
+    await signaling.start("127.0.0.1", args.port)
+    url = f"http://127.0.0.1:{args.port}"
+    env = dict(os.environ, SIGNALING_URL=url, DEPTH_HEADLESS="1",
+               DEPTH_INPUT_SIZE=str(args.input_size), CAMERA_SOURCE="synthetic",
+               CAMERA_FRAMERATE=str(args.fps), CAMERA_VIDEO_SIZE=f"{args.width}x{args.height}", RECV_FROM="server",
+               CAMERA_SIMULCAST="1" if args.simulcast else "0")
+    if args.synthetic:
+        env["DEPTH_ENGINE"] = "synthetic"
+
+    log_dir = tempfile.mkdtemp(prefix="loopback-")
+    cameras = [f"{config.CAMERA_PREFIX}-{i}" for i in range(args.cameras)]
+    reports = [os.path.join(log_dir, f"recv-{camera}.json") for camera in cameras]
+    processes = []
+    server_cpu = None
+    try:
+        # The server goes first so model loading isn't counted as connection setup
+        server = await start("server", ["main.py"], HERE, env, log_dir)
+        processes.append(server)
+        if not await wait_for_log(os.path.join(log_dir, "server.log"), "Model loaded", args.timeout):
+            raise RuntimeError(f"Server did not load its model, see {log_dir}/server.log")
+        loaded_cpu = cpu_seconds(server.pid)
+
+        receivers = []
+        for camera, report in zip(cameras, reports):
+            processes.append(await start(camera, ["main.py", str(args.tracks)], CAMERA_DIR,
+                                         dict(env, CAMERA_NAME=camera), log_dir))
+            receiver = await start(f"recv-{camera}", ["recv.py", "--quiet", "--duration", str(args.duration),
+                                                      "--report", report, "--clients", str(args.clients)],
+                                   CAMERA_DIR, dict(env, RECV_CAMERA=camera, RECV_NAME=f"recv-{camera}"), log_dir)
+            processes.append(receiver)
+            receivers.append(receiver)
+        await asyncio.wait_for(asyncio.gather(*(receiver.wait() for receiver in receivers)), args.duration + args.timeout)
+        end_cpu = cpu_seconds(server.pid)
+        if loaded_cpu is not None and end_cpu is not None:
+            server_cpu = end_cpu - loaded_cpu
+    finally:
+        for process in processes:
+            if process.returncode is None:
+                process.terminate()
+                await process.wait()
+        await signaling.stop()
+
+    clients = []
+    for report in reports:
+        if not os.path.exists(report):
+            raise RuntimeError(f"A receiver wrote no report, see the logs in {log_dir}")
+        with open(report) as f:
+            clients += json.load(f)["clients"]
+    if not any(client["tracks"] for client in clients):
+        raise RuntimeError(f"No tracks reached the receiver, see the logs in {log_dir}")
+
+    # The server's viewer tracks are an original and a depth track per camera track, in that order
+    for client in clients:
+        for i, track in enumerate(client["tracks"]):
+            name = f"{('original', 'depth')[i % 2]} {i // 2}" if args.tracks > 1 else ("original", "depth")[i % 2]
+            setup = f"{track['setup_s']:.2f}s" if track["setup_s"] is not None else "never"
+            print(f"{client['name']:<26} {name:<9} first frame after {setup}   {track['frames']} frames   "
+                  f"{track['fps']:.1f} fps   jitter {track['jitter_ms']:.1f}ms   {track['freezes']} freezes")
+            # Per stage, from the server's "frames" channel
+            if track.get("stage_ms"):
+                print("    " + "   ".join(f"{stage} {ms:.0f}ms (n={track['stage_frames'][stage]})"
+                                           for stage, ms in track["stage_ms"].items()))
+    if len(cameras) > 1 or args.tracks > 1:
+        # Every camera sends at the same rate, so a fair scheduler gives their depth outputs the same rate
+        for camera in cameras:
+            rates = [track["fps"] for client in clients if client.get("camera") == camera
+                     for track in client["tracks"][1::2]]
+            print(f"{camera:<26} depth {sum(rates) / len(rates) if rates else 0.0:5.1f} fps"
+                  f" over {len(rates)} depth tracks")
+    summarize("capture to receive latency", [ms for client in clients if client["tracks"]
+                                             for ms in client["tracks"][0]["latency_ms"]])
+    if server_cpu is not None:
+        print(f"server CPU after model load: {server_cpu:.1f}s ({100 * server_cpu / args.duration:.0f}% of one core)")
+    print(f"logs in {log_dir}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds the receiver runs, setup included")
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--input-size", type=int, default=config.INPUT_SIZE, help="model input, lower it to leave CPU for the rest")
+    parser.add_argument("--port", type=int, default=8190, help="signaling stand-in port")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds allowed for model loading and shutdown")
+    parser.add_argument("--synthetic", action="store_true", help="use a synthetic conv net instead of MiDaS")
+    parser.add_argument("--simulcast", action="store_true", help="camera also sends a small stream for inference")
+    parser.add_argument("--cameras", type=int, default=2, help="camera modules, each its own session on the server")
+    parser.add_argument("--tracks", type=int, default=1, help="cameras per camera module")
+    parser.add_argument("--clients", type=int, default=1, help="receivers watching each camera's output at once")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
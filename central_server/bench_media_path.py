@@ -0,0 +1,70 @@
+"""Per-frame CPU time and allocations of the server's media path around inference, old vs yuv420p
+
+Old path: original frame to bgr24 and back with from_ndarray, depth expanded to BGR, resized and
+converted by the encoder to yuv420p. New path: the decoded frame is forwarded as it is and depth is
+resized straight into the luma plane of a pooled yuv420p frame. Both include the yuv420p frame the
+encoder ends up consuming. Allocations are what tracemalloc sees (numpy, not libav internals).
+
+    python bench_media_path.py --frames 300
+"""
+import argparse
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from av import VideoFrame
+
+from bench_utils import synthetic_frames
+from main import DepthVideoStreamTrack, QueuedVideoStreamTrack
+
+def old_path(decoded, depth_map):
+    img = decoded.to_ndarray(format="bgr24")
+    original = VideoFrame.from_ndarray(img, format="bgr24").reformat(format="yuv420p")
+
+    normalized = ((depth_map - depth_map.min()) / (depth_map.max() - depth_map.min()) * 255).astype(np.uint8)
+    depth_bgr = cv2.resize(cv2.cvtColor(normalized, cv2.COLOR_GRAY2BGR), (img.shape[1], img.shape[0]))
+    depth = VideoFrame.from_ndarray(depth_bgr, format="bgr24").reformat(format="yuv420p")
+    return original, depth
+
+def new_path(decoded, depth_map, original_track, depth_track):
+    # The bgr24 copy is still made once, it is the model's input
+    img = decoded.to_ndarray(format="bgr24")
+    original = original_track.to_frame(decoded)
+
+    normalized = ((depth_map - depth_map.min()) / (depth_map.max() - depth_map.min()) * 255).astype(np.uint8)
+    depth = depth_track.to_frame(cv2.resize(normalized, (img.shape[1], img.shape[0])))
+    return original, depth
+
+def measure(label, fn, frames, depth_map):
+    fn(frames[0], depth_map)
+
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    for frame in frames:
+        fn(frame, depth_map)
+    wall = (time.perf_counter() - wall_start) / len(frames) * 1000
+    cpu = (time.process_time() - cpu_start) / len(frames) * 1000
+
+    tracemalloc.start()
+    for frame in frames:
+        fn(frame, depth_map)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<10} wall {wall:7.3f} ms/frame   cpu {cpu:7.3f} ms/frame   peak traced {peak / 1024:8.1f} KiB")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=300)
+    args = parser.parse_args()
+
+    # Decoder output is yuv420p, build the same thing from synthetic BGR frames
+    frames = [VideoFrame.from_ndarray(img, format="bgr24").reformat(format="yuv420p")
+              for img in synthetic_frames(args.frames)]
+    depth_map = np.random.default_rng(0).random((256, 256), dtype=np.float32)
+    original_track, depth_track = QueuedVideoStreamTrack(), DepthVideoStreamTrack()
+
+    measure("old", old_path, frames, depth_map)
+    measure("yuv420p", lambda frame, depth: new_path(frame, depth, original_track, depth_track), frames, depth_map)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Depth postprocessing per frame: the previous implementations vs the fused LUT postprocessor
+
+    legacy bgr     min/max normalize, astype, GRAY2BGR, resize (analyze_frame before yuv420p output)
+    legacy gray    the same without the BGR expansion (postprocess_depth before the fused stage)
+    colorize_depth matplotlib viridis on the raw map, then resize (float RGBA in between)
+    fused gray     DepthPostprocessor without a colormap
+    fused color    DepthPostprocessor with a 256-entry colormap LUT
+
+Input is a float32 prediction at model resolution, output is frame-sized. Also reports the
+largest difference between fused gray and legacy gray (the fused cast rounds where the legacy
+one truncated, so a level or two).
+
+    python bench_postprocess.py --frames 200 --width 640 --height 480
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+import config
+from bench_utils import summarize
+from depth import colorize_depth
+from postprocess import DepthPostprocessor
+
+def legacy_bgr(depth_map, shape):
+    normalized = ((depth_map - depth_map.min()) / (depth_map.max() - depth_map.min()) * 255).astype(np.uint8)
+    return cv2.resize(cv2.cvtColor(normalized, cv2.COLOR_GRAY2BGR), (shape[1], shape[0]))
+
+def legacy_gray(depth_map, shape):
+    normalized = ((depth_map - depth_map.min()) / (depth_map.max() - depth_map.min()) * 255).astype(np.uint8)
+    return cv2.resize(normalized, (shape[1], shape[0]))
+
+def colorize(depth_map, shape):
+    return cv2.resize(colorize_depth(depth_map), (shape[1], shape[0]))
+
+def measure(label, fn, depth_maps, shape):
+    fn(depth_maps[0], shape)
+    times = []
+    for depth_map in depth_maps:
+        start = time.perf_counter()
+        fn(depth_map, shape)
+        times.append((time.perf_counter() - start) * 1000)
+    summarize(label, times)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--colormap", default=config.DEPTH_COLORMAP)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    size = config.INPUT_SIZE
+    depth_maps = [cv2.GaussianBlur(rng.random((size, size), dtype=np.float32) * 3000, (9, 9), 0)
+                  for _ in range(args.frames)]
+    shape = (args.height, args.width)
+
+    measure("legacy bgr", legacy_bgr, depth_maps, shape)
+    measure("legacy gray", legacy_gray, depth_maps, shape)
+    measure("colorize_depth", colorize, depth_maps[:max(1, args.frames // 10)], shape)
+    measure("fused gray", DepthPostprocessor(), depth_maps, shape)
+    measure(f"fused color ({args.colormap})", DepthPostprocessor(args.colormap), depth_maps, shape)
+
+    difference = cv2.absdiff(DepthPostprocessor()(depth_maps[0], shape), legacy_gray(depth_maps[0], shape))
+    print(f"fused gray vs legacy gray: max difference {int(difference.max())} levels")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Per-frame preprocessing time and allocations, torchvision reference vs the reused-buffer Preprocessor
+
+    python bench_preprocess.py --frames 300
+"""
+import argparse
+import time
+import tracemalloc
+
+from bench_utils import synthetic_frames
+from depth import Preprocessor, process_image
+
+def measure(label, fn, frames):
+    # Warm up once so one-off buffer allocation isn't counted per frame
+    fn(frames[0])
+
+    start = time.perf_counter()
+    for img in frames:
+        fn(img)
+    per_frame_ms = (time.perf_counter() - start) / len(frames) * 1000
+
+    # Allocations are traced in a second pass, tracemalloc slows everything down
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for img in frames:
+        fn(img)
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, "filename")
+    allocated = sum(stat.size_diff for stat in stats if stat.size_diff > 0)
+    count = sum(stat.count_diff for stat in stats if stat.count_diff > 0)
+    print(f"{label:<14} {per_frame_ms:8.3f} ms/frame   peak traced {peak / 1024:9.1f} KiB   "
+          f"retained {allocated / len(frames):8.0f} B/frame in {count} blocks")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=300)
+    args = parser.parse_args()
+
+    frames = list(synthetic_frames(args.frames))
+    preprocessor = Preprocessor()
+
+    reference = process_image(frames[0])[0]
+    fast = preprocessor([frames[0]])
+    print(f"max abs difference vs torchvision: {float((reference - fast).abs().max()):.2e}")
+
+    measure("torchvision", lambda img: process_image(img), frames)
+    measure("preallocated", lambda img: preprocessor([img]), frames)
+
+if __name__ == "__main__":
+    main()
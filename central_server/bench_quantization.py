@@ -0,0 +1,79 @@
+"""Accuracy drift and throughput of the INT8 depth paths against fp32
+
+Mean relative error is measured per pixel against the fp32 eager prediction on the same frames.
+Calibration and evaluation frames come from --frames-dir when given (use different recordings for
+each if you can), synthetic frames otherwise.
+
+    python bench_quantization.py --frames-dir samples/ --calibration-dir calibration/
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import config
+from bench_utils import sample_frames
+from depth import Preprocessor, load_cached_model
+from engines import EagerEngine, OnnxEngine, SyntheticDepthModel, export_onnx
+from quantization import quantize_dynamic_model, quantize_onnx_dynamic, quantize_onnx_static
+
+def predict_all(engine, tensors):
+    start = time.perf_counter()
+    outputs = [engine.predict(tensor) for tensor in tensors]
+    fps = len(tensors) / (time.perf_counter() - start)
+    return outputs, fps
+
+def mean_relative_error(outputs, references):
+    errors = [np.abs(out - ref) / (np.abs(ref) + 1e-6) for out, ref in zip(outputs, references)]
+    return float(np.mean([error.mean() for error in errors]))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames-dir", help="evaluation images")
+    parser.add_argument("--calibration-dir", help="calibration images for static quantization")
+    parser.add_argument("--frames", type=int, default=16)
+    parser.add_argument("--synthetic", action="store_true", help="use a synthetic conv net instead of MiDaS")
+    args = parser.parse_args()
+
+    model = SyntheticDepthModel().eval() if args.synthetic else load_cached_model(config.MODEL, config.HUB_DIR, config.CACHE_DIR)
+    model = model.cpu()
+    size = (config.INPUT_SIZE, config.INPUT_SIZE)
+
+    preprocessor = Preprocessor(size)
+    frames = sample_frames(args.frames_dir, args.frames)
+    tensors = [preprocessor([img]).clone() for img in frames]
+    calibration = sample_frames(args.calibration_dir, args.frames)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fp32_path = os.path.join(tmp, "model.onnx")
+        dynamic_path = os.path.join(tmp, "model_dynamic.onnx")
+        static_path = os.path.join(tmp, "model_static.onnx")
+        export_onnx(model, fp32_path, size)
+        quantize_onnx_dynamic(fp32_path, dynamic_path)
+        quantize_onnx_static(fp32_path, static_path, calibration, size)
+
+        # The first row is the reference the others are compared to
+        engines = [
+            ("eager fp32", EagerEngine(model, cuda=False)),
+            ("eager dynamic int8", EagerEngine(quantize_dynamic_model(model), cuda=False)),
+            ("onnx fp32", OnnxEngine(fp32_path)),
+            ("onnx dynamic int8", OnnxEngine(dynamic_path)),
+            ("onnx static int8", OnnxEngine(static_path)),
+        ]
+
+        print(f"{'engine':<20} {'fps':>8} {'speedup':>8} {'mean rel err':>13} {'size MB':>8}")
+        paths = {"onnx fp32": fp32_path, "onnx dynamic int8": dynamic_path, "onnx static int8": static_path}
+        references = reference_fps = None
+        for label, engine in engines:
+            engine.predict(tensors[0])  # warm up
+            outputs, fps = predict_all(engine, tensors)
+            if references is None:
+                references, reference_fps = outputs, fps
+            size_mb = f"{os.path.getsize(paths[label]) / 1e6:.1f}" if label in paths else "-"
+            print(f"{label:<20} {fps:>8.2f} {fps / reference_fps:>7.2f}x "
+                  f"{mean_relative_error(outputs, references):>13.4f} {size_mb:>8}")
+
+if __name__ == "__main__":
+    main()
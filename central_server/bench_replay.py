@@ -0,0 +1,108 @@
+"""Replay a recorded camera track through RemoteStreamProcessor, no camera, signaling or WebRTC needed
+
+The recording (made with DEPTH_RECORD_DIR set on the server, or --make-synthetic) is played as the
+camera's decoded track into process_track, so frames go through the same frame policy, scheduler,
+inference worker, postprocessing and output tracks as live ones. The output tracks are drained
+here instead of by an encoder. Reported: frames delivered, what the pipeline did with them, depth
+frames out and their rate, and latency from a frame leaving the recording to its depth frame
+being queued for the encoder.
+
+At --speed 1 (or 2, 0.5, ...) frames arrive on the recorded timing and the pipeline drops what it
+can't keep up with, as it would live. At --speed 0 the next frame is handed over as soon as the
+previous one has been processed or dropped by the frame policy, so every run sees the same frames
+and the rate is the pipeline's maximum.
+
+    python bench_replay.py recordings/camera-module-<host>-<track> --speed 1      # recorded timing
+    python bench_replay.py recordings/camera-module-<host>-<track> --speed 0      # every frame, flat out
+    python bench_replay.py /tmp/synthetic --make-synthetic 300 --synthetic   # no camera, no weights
+
+Pipeline settings (DEPTH_FRAME_POLICY, DEPTH_MAX_BATCH, DEPTH_OUTPUT_FORMAT, ...) come from the
+environment as for the server.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import config
+from bench_utils import bench_engine, summarize, synthetic_frames
+from recording import RecordedVideoTrack, record_frames
+
+async def drain(track, items):
+    """Stand-in for the encoder: take every queued (frame data, pts, queued at) off an output track"""
+    while True:
+        items.append(await track.fdata_queue.get())
+
+async def run(args):
+    # The server module creates its metrics and preview globals on import, only pay for that when running
+    from main import CameraSession, RemoteStreamProcessor
+    # No window, imshow would end up in the measurement
+    config.HEADLESS = 1
+
+    load_tier = (lambda model_name: bench_engine(True)) if args.synthetic else None
+    processor = RemoteStreamProcessor(load_tier)
+    await processor.ready
+    if processor.engine is None:
+        raise RuntimeError("Model failed to load, try --synthetic")
+
+    session = CameraSession("replay", None, processor.send_video, processor.send_channel)
+
+    async def pace():
+        # Hold the next frame until the pipeline has accounted for every frame so far
+        stats = processor.frame_stats.get(track.id)
+        while stats is not None and stats.received > stats.dropped + stats.processed:
+            await asyncio.sleep(0.0005)
+
+    track = RecordedVideoTrack(args.recording, args.speed, args.loops, pace)
+    outputs = session.add_outputs(track.id)
+    originals, depths = [], []
+    drains = [asyncio.create_task(drain(outputs.original_track, originals)),
+              asyncio.create_task(drain(outputs.depth_track, depths))]
+
+    print(f"Replaying {len(track)} frames of {args.recording} at "
+          f"{'maximum speed' if args.speed <= 0 else f'{args.speed}x'}")
+    start = time.perf_counter()
+    process = asyncio.create_task(processor.process_track(track, session))
+    # The model is loaded, so the track's counters exist once process_track has had one turn
+    await asyncio.sleep(0)
+    stats = processor.frame_stats[track.id]
+    await process
+    # Let the last frame in flight come out of inference
+    await asyncio.sleep(0.5)
+    for task in drains:
+        task.cancel()
+    wall = time.perf_counter() - start
+
+    # The original track forwards the replayed frame itself, its pts is the index in the recording
+    index_of = {pts: frame.pts for frame, pts, _ in originals}
+    latencies = [(queued_at - track.delivered[index_of[pts]]) * 1000
+                 for _, pts, queued_at in depths if pts in index_of]
+    out = len(depths) if processor.send_video else len(originals)
+
+    print(f"delivered {track.index} frames in {wall:.1f}s, depth frames {out} ({out / wall:.1f}/s), "
+          f"output queue drops {outputs.depth_track.dropped}")
+    print(f"pipeline: {stats}")
+    summarize("frame to depth latency", latencies)
+
+    processor.worker.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recording", help="recording directory (see recording.py)")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 plays at the recorded rate, 0 as fast as possible")
+    parser.add_argument("--loops", type=int, default=1)
+    parser.add_argument("--make-synthetic", type=int, metavar="FRAMES",
+                        help="first write a synthetic 30 fps recording of this many frames to the directory")
+    parser.add_argument("--width", type=int, default=640, help="size of the synthetic recording")
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--synthetic", action="store_true", help="use a synthetic conv net instead of MiDaS")
+    args = parser.parse_args()
+
+    if args.make_synthetic:
+        record_frames(args.recording, synthetic_frames(args.make_synthetic, args.width, args.height))
+    elif not os.path.isdir(args.recording):
+        parser.error(f"No recording at {args.recording}")
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Server startup time to the first depth frame, cold (empty artifact cache) vs warm (cache filled)
+
+Each run is a fresh interpreter. Cold starts go through torch.hub and need the MiDaS repo and
+weights in the torch hub cache. --synthetic seeds the artifact cache with the synthetic model
+instead, so only the warm path is measured.
+
+    python bench_startup.py --runs 3
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import config
+
+CHILD = """
+import asyncio, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+import numpy as np
+
+async def run():
+    processor = main.RemoteStreamProcessor()
+    await processor.ready
+    loaded = time.perf_counter()
+    processor.scheduler.register("bench")
+    await processor.scheduler.infer("bench", np.zeros((480, 640, 3), np.uint8))
+    first = time.perf_counter()
+    print("TIMES", imported - start, loaded - start, first - start)
+
+asyncio.run(run())
+"""
+
+def run_child(cache_dir):
+    env = dict(os.environ, DEPTH_CACHE_DIR=cache_dir, DEPTH_ENGINE="eager")
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", CHILD], env=env, capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    wall = time.perf_counter() - start
+    for line in result.stdout.splitlines():
+        if line.startswith("TIMES"):
+            return [float(value) for value in line.split()[1:]] + [wall]
+    raise RuntimeError(f"Startup run failed:\n{result.stdout}\n{result.stderr}")
+
+def report(label, times):
+    imported, loaded, first, wall = times
+    print(f"{label:<6} import main {imported:6.2f}s   model ready {loaded:6.2f}s   "
+          f"first depth frame {first:6.2f}s   process wall {wall:6.2f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--synthetic", action="store_true", help="seed the cache with the synthetic model, warm runs only")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        if args.synthetic:
+            import torch
+            from engines import SyntheticDepthModel
+            torch.save(SyntheticDepthModel().eval(), os.path.join(cache_dir, f"{config.MODEL}.pt"))
+        else:
+            # The first run fills the artifact cache
+            report("cold", run_child(cache_dir))
+
+        for _ in range(args.runs):
+            report("warm", run_child(cache_dir))
+
+if __name__ == "__main__":
+    main()
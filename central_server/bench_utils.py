@@ -0,0 +1,59 @@
+"""Shared helpers for the central server benchmark scripts"""
+import os
+
+import cv2
+import numpy as np
+
+import config
+from engines import load_engine
+
+def bench_engine(synthetic):
+    """Load the configured engine, or the synthetic stand-in when --synthetic is given"""
+    if synthetic:
+        return load_engine("synthetic", threads=config.INTRA_OP_THREADS)
+    return load_engine(config.ENGINE, config.ENGINE_PATH, config.INTRA_OP_THREADS, config.GRAPH_OPT,
+                       config.MODEL, config.HUB_DIR, config.CACHE_DIR, config.QUANTIZE)
+
+def synthetic_frames(count, width=640, height=480, seed=0):
+    """Deterministic BGR frames of a smooth gradient moving sideways, so consecutive frames differ
+
+    Like camera-module/synthetic.py's pattern it compresses and changes like a real scene, where
+    noise would defeat the change detector and the encoder. The seed picks each channel's phase.
+    """
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 4 * np.pi, width * 2)[None, :, None]
+    y = np.cos(np.linspace(0, np.pi, height))[:, None, None]
+    phase = rng.uniform(0, 2 * np.pi, size=3)[None, None, :]
+    pattern = (128 + 80 * np.sin(x + phase) * y).astype(np.uint8)
+    for i in range(count):
+        shift = (i * 8) % width
+        yield np.ascontiguousarray(pattern[:, shift:shift + width])
+
+def sample_frames(frames_dir=None, count=32):
+    """BGR frames from a directory of images, or synthetic ones when no directory is given"""
+    if frames_dir is None:
+        return list(synthetic_frames(count))
+
+    frames = []
+    for name in sorted(os.listdir(frames_dir)):
+        img = cv2.imread(os.path.join(frames_dir, name))
+        if img is not None:
+            frames.append(img)
+        if len(frames) == count:
+            break
+    if not frames:
+        raise RuntimeError(f"No readable images in {frames_dir}")
+    return frames
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    return float(np.percentile(np.asarray(values), pct))
+
+def summarize(label, values_ms):
+    """One-line summary of a list of millisecond samples"""
+    print(f"{label:<28} n={len(values_ms):<5} "
+          f"mean={np.mean(values_ms) if values_ms else 0.0:8.2f}ms "
+          f"p50={percentile(values_ms, 50):8.2f}ms "
+          f"p99={percentile(values_ms, 99):8.2f}ms "
+          f"max={max(values_ms) if values_ms else 0.0:8.2f}ms")
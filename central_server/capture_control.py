@@ -0,0 +1,43 @@
+class CaptureController:
+    """Capture rate one camera track should be sent at, from how fast the server gets through its frames
+
+    Capacity is one over the smoothed time of a full pass through analyze_frame. That includes
+    waiting on the batch scheduler, so cameras sharing the model each come out with their share,
+    and it doesn't depend on how many frames the camera sends, so a rate that was lowered comes
+    back up as soon as passes get faster. The rate asked for is capacity times the camera frames
+    the frame policy wants per pass, with some headroom so inference never waits on the camera,
+    clamped to [min_fps, max_fps]. It is backpressure only: a camera never goes past the rate its
+    operator configured (CAMERA_FRAMERATE), however much the server could take.
+    """
+    def __init__(self, min_fps=5.0, max_fps=30.0, headroom=1.2, hysteresis=0.2, smoothing=0.2):
+        self.min_fps = min_fps
+        self.max_fps = max_fps
+        self.headroom = headroom
+        self.hysteresis = hysteresis
+        self.smoothing = smoothing
+        self.avg_pass = 0.0
+        self.sent = None
+
+    def record(self, seconds):
+        # Exponential moving average, like AdaptivePolicy
+        if self.avg_pass == 0.0:
+            self.avg_pass = seconds
+        else:
+            self.avg_pass += self.smoothing * (seconds - self.avg_pass)
+
+    def target(self, frames_per_inference=1):
+        if self.avg_pass <= 0.0:
+            return None
+        fps = frames_per_inference * self.headroom / self.avg_pass
+        return min(self.max_fps, max(self.min_fps, fps))
+
+    def update(self, frames_per_inference=1):
+        """Rate to send the camera now, or None while the last one sent is within the hysteresis"""
+        fps = self.target(frames_per_inference)
+        if fps is None:
+            return None
+        # Changing rate can mean reopening the camera, so small drifts aren't passed on
+        if self.sent is not None and abs(fps - self.sent) <= self.hysteresis * self.sent:
+            return None
+        self.sent = round(fps, 1)
+        return self.sent
@@ -0,0 +1,142 @@
+import cv2
+import numpy as np
+
+class ChangeDetector:
+    """Decides whether a frame differs enough from the last inferred one to need a new depth pass"""
+    def __init__(self, threshold=2.0, size=(64, 48), max_reuse=30):
+        # Mean absolute luma difference (0-255) on the thumbnail above which the scene counts as changed
+        self.threshold = threshold
+        self.size = size
+        # Force a fresh pass now and then so slow drift (lighting, small motion) can't build up forever
+        self.max_reuse = max_reuse
+        self.reused = 0
+
+        w, h = size
+        self.small = np.empty((h, w, 3), dtype=np.uint8)
+        self.luma = np.empty((h, w), dtype=np.uint8)
+        self.reference = np.empty((h, w), dtype=np.uint8)
+        self.has_reference = False
+
+    def needs_inference(self, img):
+        """Return True when img should go through the model, it then becomes the new reference"""
+        # Shrink first so the colour conversion only touches a few thousand pixels
+        cv2.resize(img, self.size, dst=self.small, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self.small, cv2.COLOR_BGR2GRAY, dst=self.luma)
+
+        if self.has_reference and self.reused < self.max_reuse:
+            difference = cv2.norm(self.luma, self.reference, cv2.NORM_L1) / self.luma.size
+            if difference <= self.threshold:
+                self.reused += 1
+                return False
+
+        self.reference[:] = self.luma
+        self.has_reference = True
+        self.reused = 0
+        return True
+
+class TiledDepthUpdater:
+    """Re-estimates depth only around the tiles that changed and blends it into a persistent full-frame buffer
+
+    MiDaS depth is relative, every pass has its own scale and shift, so each crop prediction is fitted
+    to the buffer on the unchanged padding around the changed tiles before it is blended in.
+    Crops run at a proportionally smaller model input, which is where the compute saving comes from.
+    Needs an engine that accepts any input size (eager, or an ONNX export with dynamic height and width).
+    """
+    def __init__(self, input_size=256, tile=32, threshold=8.0, padding=48, full_fraction=0.5, max_age=150):
+        self.input_size = input_size
+        self.tile = tile
+        # Mean absolute luma difference (0-255) inside a tile above which it counts as changed
+        self.threshold = threshold
+        self.padding = padding
+        # Above this share of changed tiles a full-frame pass is cheaper than a crop
+        self.full_fraction = full_fraction
+        # Frames between forced full passes, so small errors from blending can't pile up
+        self.max_age = max_age
+        self.age = 0
+
+        self.buffer = None
+        self.reference = None
+        self.gray = None
+        self.changed = None
+        self.last_action = None
+        self.stats = {"full": 0, "crop": 0, "reuse": 0, "pixels_inferred": 0, "pixels_total": 0}
+
+    def plan(self, img):
+        """Return ("full", None), ("crop", (x0, y0, x1, y1)) or ("reuse", None) for this frame"""
+        self.gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        h, w = self.gray.shape
+        self.age += 1
+        if self.buffer is None or self.buffer.shape != self.gray.shape or self.age >= self.max_age:
+            return "full", None
+
+        # Mean of the per-pixel difference over each tile, in one area-resize
+        grid = (max(1, w // self.tile), max(1, h // self.tile))
+        tile_diff = cv2.resize(cv2.absdiff(self.gray, self.reference), grid, interpolation=cv2.INTER_AREA)
+        self.changed = tile_diff > self.threshold
+        if not self.changed.any():
+            return "reuse", None
+        if self.changed.mean() > self.full_fraction:
+            return "full", None
+
+        rows, cols = np.nonzero(self.changed)
+        tile_w, tile_h = w / grid[0], h / grid[1]
+        x0 = max(0, int(cols.min() * tile_w) - self.padding)
+        y0 = max(0, int(rows.min() * tile_h) - self.padding)
+        x1 = min(w, int((cols.max() + 1) * tile_w) + self.padding)
+        y1 = min(h, int((rows.max() + 1) * tile_h) + self.padding)
+        return "crop", (x0, y0, x1, y1)
+
+    def crop_input_size(self, box):
+        """Model input for a crop with the same pixel density as a full-frame pass, rounded to MiDaS' multiple of 32"""
+        x0, y0, x1, y1 = box
+        h, w = self.gray.shape
+        def fit(length, full):
+            return max(64, int(round(length * self.input_size / full / 32)) * 32)
+        return fit(x1 - x0, w), fit(y1 - y0, h)
+
+    def apply_full(self, depth):
+        self.buffer = depth.astype(np.float32, copy=False)
+        self.reference = self.gray
+        self.age = 0
+
+    def apply_crop(self, box, depth):
+        x0, y0, x1, y1 = box
+        h, w = self.gray.shape
+        old = self.buffer[y0:y1, x0:x1]
+
+        # Changed tiles at pixel resolution, grown and softened so the seam fades out over the padding
+        mask = cv2.resize(self.changed.astype(np.float32), (w, h), interpolation=cv2.INTER_NEAREST)[y0:y1, x0:x1]
+        feather = max(1, self.padding // 3)
+        kernel = np.ones((feather, feather), np.uint8)
+        weight = np.clip(cv2.blur(cv2.dilate(mask, kernel), (feather, feather)), 0.0, 1.0)
+
+        # Least-squares scale and shift on the pixels that did not change
+        ring = weight < 0.01
+        if ring.sum() >= 64:
+            A = np.stack([depth[ring], np.ones(int(ring.sum()), dtype=np.float32)], axis=1)
+            (scale, shift), *_ = np.linalg.lstsq(A, old[ring], rcond=None)
+            depth = depth * scale + shift
+        else:
+            depth = depth * (np.median(old) / (np.median(depth) + 1e-8))
+
+        old[:] = old * (1.0 - weight) + depth * weight
+        self.reference[y0:y1, x0:x1] = self.gray[y0:y1, x0:x1]
+
+    async def update(self, worker, img):
+        """Bring the depth buffer up to date with img and return it as raw float depth"""
+        action, box = self.plan(img)
+        h, w = self.gray.shape
+        self.stats["pixels_total"] += h * w
+
+        if action == "full":
+            depth = await worker.infer_region(img, (self.input_size, self.input_size))
+            self.apply_full(depth)
+            self.stats["pixels_inferred"] += h * w
+        elif action == "crop":
+            x0, y0, x1, y1 = box
+            depth = await worker.infer_region(img[y0:y1, x0:x1], self.crop_input_size(box))
+            self.apply_crop(box, depth)
+            self.stats["pixels_inferred"] += (x1 - x0) * (y1 - y0)
+        self.stats[action] += 1
+        self.last_action = action
+        return self.buffer
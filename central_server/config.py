@@ -0,0 +1,122 @@
+"""Central server settings, read once at startup from DEPTH_* environment variables (and SIGNALING_URL)"""
+import os
+
+def _env(name, default, cast=str):
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    return cast(value)
+
+# Socket.IO signaling server, webrtc/server.js or the local stand-in in signaling.py. Unprefixed,
+# camera modules read the same variable
+SIGNALING_URL = _env("SIGNALING_URL", "https://192.168.0.151:8181/")
+
+# Which decoded frames get sent to depth inference: "latest", "every_nth" or "adaptive"
+FRAME_POLICY = _env("DEPTH_FRAME_POLICY", "latest")
+# For "every_nth", run inference on one frame out of every N
+FRAME_POLICY_N = _env("DEPTH_FRAME_POLICY_N", 2, int)
+
+# Frames held by each outgoing video track before the oldest is dropped
+OUTPUT_QUEUE_SIZE = _env("DEPTH_OUTPUT_QUEUE_SIZE", 4, int)
+
+# Depth backend: "eager" (torch.hub MiDaS), "torchscript", "onnx" or "synthetic" (untrained stand-in), see engines.py
+ENGINE = _env("DEPTH_ENGINE", "eager")
+# Exported model file for the torchscript and onnx engines, made with export_engine.py.
+# "{model}" is replaced with the MiDaS variant, e.g. models/{model}.onnx
+ENGINE_PATH = _env("DEPTH_ENGINE_PATH", None)
+
+# MiDaS variant: "MiDaS_small", "DPT_Hybrid" or "DPT_Large"
+MODEL = _env("DEPTH_MODEL", "DPT_Hybrid")
+# Cached checkout of the intel-isl/MiDaS hub repo, defaults to the one in the torch hub cache
+HUB_DIR = _env("DEPTH_HUB_DIR", None)
+# Serialized model artifacts, filled on first start so restarts skip torch.hub. Defaults to <torch hub dir>/depth_server
+CACHE_DIR = _env("DEPTH_CACHE_DIR", None)
+# Square model input size in pixels, MiDaS needs a multiple of 32
+INPUT_SIZE = _env("DEPTH_INPUT_SIZE", 256, int)
+# Per-frame inference budget (batch time over batch size), above it the server steps down to a cheaper model. 0 turns this off
+LATENCY_BUDGET_MS = _env("DEPTH_LATENCY_BUDGET_MS", 0.0, float)
+# Cheapest variant the server is allowed to step down to
+MIN_MODEL = _env("DEPTH_MIN_MODEL", "MiDaS_small")
+# Intra-op threads for the engine, 0 keeps the library default
+INTRA_OP_THREADS = _env("DEPTH_INTRA_OP_THREADS", 0, int)
+# Graph optimization level: "disable", "basic", "extended" or "all"
+GRAPH_OPT = _env("DEPTH_GRAPH_OPT", "all")
+# "dynamic" runs the eager engine with INT8 Linear layers. For static INT8 use quantize_engine.py
+# and point the onnx engine at its output
+QUANTIZE = _env("DEPTH_QUANTIZE", "none")
+
+# Mean absolute luma difference (0-255) on a 64x48 thumbnail under which a frame reuses the
+# previous depth map instead of running inference. 0 runs inference on every frame
+REUSE_THRESHOLD = _env("DEPTH_REUSE_THRESHOLD", 0.0, float)
+# Most frames in a row that may reuse one depth map before a fresh pass is forced
+REUSE_MAX_FRAMES = _env("DEPTH_REUSE_MAX_FRAMES", 30, int)
+
+# Tiled mode: re-estimate depth only around the tiles that changed and blend it into a persistent
+# buffer. Takes over from DEPTH_REUSE_THRESHOLD and bypasses batching. Needs the eager (or synthetic)
+# engine, the server falls back to full-frame inference on fixed-size torchscript and onnx exports
+TILED = _env("DEPTH_TILED", 0, int)
+# Tile edge in pixels, and the mean absolute luma difference (0-255) that marks a tile as changed
+TILE_SIZE = _env("DEPTH_TILE_SIZE", 32, int)
+TILE_THRESHOLD = _env("DEPTH_TILE_THRESHOLD", 8.0, float)
+# Context in pixels added around the changed tiles, also used to align the crop with the buffer
+TILE_PADDING = _env("DEPTH_TILE_PADDING", 48, int)
+# Share of changed tiles above which a full-frame pass is run instead
+TILE_FULL_FRACTION = _env("DEPTH_TILE_FULL_FRACTION", 0.5, float)
+
+# How long the batch scheduler waits for the other cameras' frames before running a partial batch
+BATCH_WINDOW_MS = _env("DEPTH_BATCH_WINDOW_MS", 10.0, float)
+# Largest number of frames sent through the model in one forward pass
+MAX_BATCH = _env("DEPTH_MAX_BATCH", 8, int)
+
+# How depth leaves the server: "video" (8-bit luma on a video track), "datachannel" (16-bit frames
+# on an RTCDataChannel named "depth", "depth-1", ... per camera track, see depth_channel.py) or "both"
+DEPTH_TRANSPORT = _env("DEPTH_TRANSPORT", "video")
+# Data channel sample format, "uint16" (scaled to a min/max range tracked across frames) or "float16"
+DEPTH_CHANNEL_FORMAT = _env("DEPTH_CHANNEL_FORMAT", "uint16")
+# Frames between self-contained keyframes on the data channel, the rest are deltas
+DEPTH_CHANNEL_KEYFRAME_INTERVAL = _env("DEPTH_CHANNEL_KEYFRAME_INTERVAL", 30, int)
+
+# 1 skips all OpenCV windows, for servers without a display
+HEADLESS = _env("DEPTH_HEADLESS", 0, int)
+# Port of the local HTTP preview (/preview.mjpg stream, /preview.jpg snapshot), 0 disables it
+PREVIEW_PORT = _env("DEPTH_PREVIEW_PORT", 0, int)
+PREVIEW_HOST = _env("DEPTH_PREVIEW_HOST", "127.0.0.1")
+# Most preview frames rendered per second, and the width of each half of the side-by-side image
+PREVIEW_FPS = _env("DEPTH_PREVIEW_FPS", 5.0, float)
+PREVIEW_WIDTH = _env("DEPTH_PREVIEW_WIDTH", 320, int)
+
+# Port of the Prometheus-text endpoint (/metrics) with per-stage latency histograms, 0 disables it.
+# Timings are recorded either way, they cost well under a microsecond per stage
+METRICS_PORT = _env("DEPTH_METRICS_PORT", 0, int)
+METRICS_HOST = _env("DEPTH_METRICS_HOST", "127.0.0.1")
+
+# Offers from signaling users whose name starts with this are treated as camera modules
+CAMERA_PREFIX = _env("DEPTH_CAMERA_PREFIX", "camera-module")
+# Camera sessions served at once, further cameras are turned away until one disconnects
+MAX_SESSIONS = _env("DEPTH_MAX_SESSIONS", 4, int)
+
+# Depth image format on the video track and previews: "gray" (8-bit luma) or "color" (DEPTH_COLORMAP)
+DEPTH_OUTPUT_FORMAT = _env("DEPTH_OUTPUT_FORMAT", "gray")
+# Any OpenCV colormap name: "turbo", "viridis", "inferno", "magma", "jet", ...
+DEPTH_COLORMAP = _env("DEPTH_COLORMAP", "turbo")
+
+# Directory to record every decoded camera frame into, one recording per track (see recording.py).
+# Unset records nothing
+RECORD_DIR = _env("DEPTH_RECORD_DIR", None)
+# Frames kept per recording, 0 for no limit (30 s of 640x480 at 30 fps is about 400 MB)
+RECORD_MAX_FRAMES = _env("DEPTH_RECORD_MAX_FRAMES", 900, int)
+
+# 1 tells camera modules (over their "control" data channel) the capture rate the server can keep up
+# with, so frames that would be dropped here are never captured, encoded or sent
+CAPTURE_CONTROL = _env("DEPTH_CAPTURE_CONTROL", 1, int)
+# Range of capture rates asked for, and seconds between updates
+CAPTURE_MIN_FPS = _env("DEPTH_CAPTURE_MIN_FPS", 5.0, float)
+CAPTURE_MAX_FPS = _env("DEPTH_CAPTURE_MAX_FPS", 30.0, float)
+CAPTURE_CONTROL_INTERVAL = _env("DEPTH_CAPTURE_CONTROL_INTERVAL", 3.0, float)
+# Capture size asked of every camera, 0 leaves the camera at its own setting
+CAPTURE_WIDTH = _env("DEPTH_CAPTURE_WIDTH", 0, int)
+CAPTURE_HEIGHT = _env("DEPTH_CAPTURE_HEIGHT", 0, int)
+
+# 1 gives every viewer a "frames" data channel: for each frame sent, the camera's frame id, its
+# capture time and the time it reached each server stage, keyed by the pts the viewer decodes it at
+FRAME_INFO = _env("DEPTH_FRAME_INFO", 1, int)
@@ -0,0 +1,186 @@
+import os
+import sys
+import time
+import numpy as np
+import cv2
+import torch
+
+from postprocess import DepthPostprocessor
+
+# MiDaS variants from cheapest to most accurate
+MODEL_TIERS = ["MiDaS_small", "DPT_Hybrid", "DPT_Large"]
+
+# Depth estimation model functions from webcam_simple.py
+def load_model(name="DPT_Hybrid", hub_dir=None):
+    if name not in MODEL_TIERS:
+        raise ValueError(f"Unknown MiDaS model: {name}")
+
+    # torch.hub goes to GitHub to resolve the repo even when it is cached, so load the
+    # cached checkout directly. Its hubconf finds the weights in the same hub cache.
+    if hub_dir is None:
+        hub_dir = os.path.join(torch.hub.get_dir(), "intel-isl_MiDaS_master")
+    if os.path.isdir(hub_dir):
+        model = torch.hub.load(hub_dir, name, source="local")
+    else:
+        model = torch.hub.load("intel-isl/MiDaS", name)
+
+    # Switch to eval mode
+    model.eval()
+
+    # Move to GPU if available
+    if torch.cuda.is_available():
+        model = model.cuda()
+
+    return model
+
+def load_cached_model(name="DPT_Hybrid", hub_dir=None, cache_dir=None):
+    """Load a MiDaS module from the serialized artifact cache, filling it from torch.hub on a miss"""
+    if cache_dir is None:
+        cache_dir = os.path.join(torch.hub.get_dir(), "depth_server")
+    path = os.path.join(cache_dir, f"{name}.pt")
+
+    if not os.path.exists(path):
+        model = load_model(name, hub_dir)
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write then rename so a server killed mid-save never leaves a truncated artifact behind
+        torch.save(model, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        return model
+
+    # The pickled classes come from the hub checkouts (midas, geffnet for MiDaS_small),
+    # so put them on the path instead of running hubconf, which may go to the network
+    hub_dirs = [hub_dir] if hub_dir else []
+    if os.path.isdir(torch.hub.get_dir()):
+        hub_dirs += [entry.path for entry in os.scandir(torch.hub.get_dir()) if entry.is_dir()]
+    for directory in hub_dirs:
+        if directory not in sys.path:
+            sys.path.append(directory)
+
+    model = torch.load(path, map_location="cuda" if torch.cuda.is_available() else "cpu", weights_only=False)
+    return model.eval()
+
+# ImageNet normalization constants MiDaS was trained with
+MIDAS_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+MIDAS_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+def process_image(img, size=(256, 256)):
+    """Reference torchvision preprocessing, kept for checking and benchmarking Preprocessor"""
+    # Only this reference path needs PIL and torchvision, keep them out of server startup
+    from PIL import Image
+    from torchvision import transforms
+
+    # OpenCV uses BGR color ordering, need to convert to RGB for the model
+    img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+    # Resize to model input size
+    img_resized = cv2.resize(img_rgb, size, interpolation=cv2.INTER_LINEAR)
+
+    # Convert to tensor and normalize
+    transform = transforms.Compose([
+        transforms.ToTensor(),
+
+        transforms.Normalize(mean=MIDAS_MEAN.tolist(), std=MIDAS_STD.tolist())
+    ])
+
+    img_tensor = transform(Image.fromarray(img_resized)).unsqueeze(0)
+    return img_tensor, img  # Return original BGR image for display
+
+class Preprocessor:
+    """Turns BGR frames into normalized NCHW model input, reusing the same buffers every frame"""
+    def __init__(self, size=(256, 256), max_batch=1):
+        self.size = size
+        w, h = size
+        self.resized = np.empty((h, w, 3), dtype=np.uint8)
+        self.allocate(max_batch)
+
+        # ToTensor + Normalize, (x / 255 - mean) / std, folded into one multiply-add per channel
+        self.scale = (1.0 / (255.0 * MIDAS_STD)).reshape(3, 1, 1)
+        self.offset = (-MIDAS_MEAN / MIDAS_STD).reshape(3, 1, 1)
+
+    def allocate(self, batch):
+        w, h = self.size
+        self.input = torch.empty((batch, 3, h, w), dtype=torch.float32)
+        # Shares memory with self.input so numpy can write straight into the tensor
+        self.planes = self.input.numpy()
+
+    def __call__(self, imgs):
+        """Return a (len(imgs), 3, H, W) tensor view of the reused input buffer"""
+        if len(imgs) > self.input.shape[0]:
+            self.allocate(len(imgs))
+
+        for i, img in enumerate(imgs):
+            cv2.resize(img, self.size, dst=self.resized, interpolation=cv2.INTER_LINEAR)
+
+            # BGR -> RGB and HWC -> CHW are both views, the only pass over the pixels is the multiply-add
+            chw_rgb = self.resized[:, :, ::-1].transpose(2, 0, 1)
+            np.multiply(chw_rgb, self.scale, out=self.planes[i])
+            np.add(self.planes[i], self.offset, out=self.planes[i])
+
+        return self.input[:len(imgs)]
+
+def get_depth_map(engine, image_tensor):
+    # Forward pass on whichever backend was configured, see engines.py
+    output = engine.predict(image_tensor)
+    return output.squeeze()
+
+def colorize_depth(depth, cmap=None):
+    if cmap is None:
+        import matplotlib.pyplot as plt
+        cmap = plt.cm.viridis
+
+    # Normalize depth to 0-1 range
+    normalized_depth = (depth - depth.min()) / (depth.max() - depth.min() + 1e-8)
+
+    # Apply colormap
+    colored_depth = (cmap(normalized_depth) * 255).astype(np.uint8)[:, :, :3]
+    return colored_depth
+
+def postprocess_depth(depth_map, shape, postprocessor=None):
+    """Turn a raw model prediction into an 8-bit depth image of the given frame shape
+
+    Single-channel unless the postprocessor has a colormap. Pass a long-lived postprocessor
+    to reuse its buffers, see postprocess.DepthPostprocessor.
+    """
+    if postprocessor is None:
+        postprocessor = DepthPostprocessor()
+    return postprocessor(depth_map, shape)
+
+def estimate_depth_batch(engine, imgs, preprocessor=None, raw=False, timings=None, postprocessor=None, shapes=None):
+    """Run several BGR frames through the model as a single NCHW batch
+
+    raw=True returns the float predictions at model resolution instead of 8-bit frame-sized images.
+    shapes sizes the 8-bit images when they go out with a larger frame than the one inferred on.
+    A timings dict gets the seconds spent in "preprocess", "inference" and (unless raw) "postprocess".
+    """
+    start = time.perf_counter()
+    if preprocessor is None:
+        preprocessor = Preprocessor(max_batch=len(imgs))
+    image_tensor = preprocessor(imgs)
+    preprocessed = time.perf_counter()
+
+    # Get depth prediction, squeeze drops the batch axis when there is only one frame
+    depth_maps = get_depth_map(engine, image_tensor)
+    depth_maps = depth_maps.reshape(len(imgs), *depth_maps.shape[-2:])
+    inferred = time.perf_counter()
+    if timings is not None:
+        timings["preprocess"] = preprocessed - start
+        timings["inference"] = inferred - preprocessed
+
+    if raw:
+        return list(depth_maps)
+    if shapes is None:
+        shapes = [img.shape for img in imgs]
+    results = [postprocess_depth(depth_map, shape, postprocessor) for depth_map, shape in zip(depth_maps, shapes)]
+    if timings is not None:
+        timings["postprocess"] = time.perf_counter() - inferred
+    return results
+
+def estimate_raw_depth(engine, img, preprocessor):
+    """Un-normalized float depth for one frame at the preprocessor's input size, resized back to the frame"""
+    depth_map = get_depth_map(engine, preprocessor([img]))
+    h, w = img.shape[:2]
+    return cv2.resize(depth_map, (w, h), interpolation=cv2.INTER_LINEAR)
+
+def estimate_depth(engine, img, preprocessor=None, postprocessor=None):
+    """Run the full depth pipeline on a BGR frame and return an 8-bit depth image of the same size"""
+    return estimate_depth_batch(engine, [img], preprocessor, postprocessor=postprocessor)[0]
@@ -0,0 +1,174 @@
+"""High-precision depth frames over an RTCDataChannel
+
+Each frame is quantized to 16 bits (uint16 over a tracked min/max range, or float16), delta coded
+against the previous frame with a keyframe every so often, byte-shuffled so the high and low bytes
+compress separately, then zlib-compressed at level 1. Frames are split into chunks because SCTP
+message size is limited (64 KiB in aiortc, less in some browsers).
+
+Frame layout, little-endian:
+    header  "<4sBBIHHff"  magic b"DPTH", version, flags, frame id, width, height, min, max
+    payload zlib(shuffled bytes of the uint16 values, or of their delta to the previous frame)
+Chunk layout:
+    "<IHH" frame id, chunk index, chunk count, followed by a slice of the frame
+
+The frame id is the camera's id for the frame, the one the server's "frames" channel reports for
+the matching RGB frame, or the server's output pts when the camera didn't announce the frame.
+"""
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = b"DPTH"
+VERSION = 1
+FLAG_KEYFRAME = 1
+FLAG_FLOAT16 = 2
+
+FRAME_HEADER = struct.Struct("<4sBBIHHff")
+CHUNK_HEADER = struct.Struct("<IHH")
+CHUNK_SIZE = 16 * 1024
+
+class DepthFrameEncoder:
+    """Turns float depth maps into chunked, delta-coded, compressed messages"""
+    def __init__(self, fmt="uint16", keyframe_interval=30, level=1, margin=0.1, slack=0.5):
+        if fmt not in ("uint16", "float16"):
+            raise ValueError(f"Unknown depth channel format: {fmt}")
+        self.fmt = fmt
+        # uint16 range shared by consecutive frames, so their deltas are changes in depth and not in
+        # scale. It is set with margin to spare, kept while frames fit inside it, and reset when one
+        # doesn't or its own span drops below slack of the range (too much precision lost)
+        self.margin = margin
+        self.slack = slack
+        self.range = None
+        self.keyframe_interval = keyframe_interval
+        self.level = level
+        self.previous = None
+        self.since_keyframe = 0
+
+    def force_keyframe(self):
+        """The next frame is sent whole, used after a frame was dropped and receivers lost the chain"""
+        self.previous = None
+
+    def quantize(self, depth):
+        lo, hi = float(depth.min()), float(depth.max())
+        if self.fmt == "float16":
+            return depth.astype(np.float16).view(np.uint16), lo, hi
+        if self.range is not None and self.range[0] <= lo and hi <= self.range[1] \
+                and hi - lo >= self.slack * (self.range[1] - self.range[0]):
+            lo, hi = self.range
+        else:
+            pad = (hi - lo) * self.margin
+            lo, hi = self.range = (lo - pad, hi + pad)
+        scale = 65535.0 / (hi - lo) if hi > lo else 0.0
+        return ((depth - lo) * scale + 0.5).astype(np.uint16), lo, hi
+
+    def encode(self, frame_id, depth):
+        """Return the list of chunk messages for one (H, W) float depth map"""
+        values, lo, hi = self.quantize(depth)
+        h, w = values.shape
+
+        keyframe = (self.previous is None or self.previous.shape != values.shape
+                    or self.since_keyframe >= self.keyframe_interval)
+        if keyframe:
+            residual = values
+            self.since_keyframe = 0
+        else:
+            # uint16 subtraction wraps, the decoder adds back with the same wrap
+            residual = values - self.previous
+            self.since_keyframe += 1
+        self.previous = values
+
+        # High bytes of neighbouring pixels are nearly identical, group them so zlib finds the runs
+        shuffled = residual.view(np.uint8).reshape(-1, 2).T.tobytes()
+
+        flags = (FLAG_KEYFRAME if keyframe else 0) | (FLAG_FLOAT16 if self.fmt == "float16" else 0)
+        frame_id &= 0xFFFFFFFF
+        frame = FRAME_HEADER.pack(MAGIC, VERSION, flags, frame_id, w, h, lo, hi) + zlib.compress(shuffled, self.level)
+
+        count = (len(frame) + CHUNK_SIZE - 1) // CHUNK_SIZE
+        return [CHUNK_HEADER.pack(frame_id, i, count) + frame[i * CHUNK_SIZE:(i + 1) * CHUNK_SIZE] for i in range(count)]
+
+class DepthFrameDecoder:
+    """Reassembles chunks and undoes the encoder, the reference for receivers"""
+    def __init__(self):
+        self.chunks = {}
+        self.previous = None
+
+    def push(self, message):
+        """Feed one chunk, returns (frame id, float32 depth) once a frame is complete, else None"""
+        frame_id, index, count = CHUNK_HEADER.unpack_from(message)
+        parts = self.chunks.setdefault(frame_id, {})
+        parts[index] = message[CHUNK_HEADER.size:]
+        if len(parts) < count:
+            return None
+
+        frame = b"".join(parts[i] for i in range(count))
+        # Frames started before a completed one can never be used. Go by arrival order (dicts keep
+        # it), ids aren't ordered when they mix camera ids with server pts or wrap around
+        pending = list(self.chunks)
+        self.chunks = {key: self.chunks[key] for key in pending[pending.index(frame_id) + 1:]}
+        return frame_id, self.decode(frame)
+
+    def decode(self, frame):
+        magic, version, flags, frame_id, w, h, lo, hi = FRAME_HEADER.unpack_from(frame)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a depth frame")
+
+        shuffled = np.frombuffer(zlib.decompress(frame[FRAME_HEADER.size:]), dtype=np.uint8)
+        residual = shuffled.reshape(2, -1).T.copy().view(np.uint16).reshape(h, w)
+
+        if flags & FLAG_KEYFRAME:
+            values = residual
+        elif self.previous is None or self.previous.shape != residual.shape:
+            return None  # joined mid-stream, wait for the next keyframe
+        else:
+            values = residual + self.previous
+        self.previous = values
+
+        if flags & FLAG_FLOAT16:
+            return values.view(np.float16).astype(np.float32)
+        return lo + values.astype(np.float32) * ((hi - lo) / 65535.0)
+
+class DepthChannelSender:
+    """Sends depth frames on every viewer's data channel, dropping frames instead of queueing when one backs up
+
+    Each frame is encoded once for all channels. A channel that joins or skips a frame has lost the
+    delta chain, so the next frame it gets is a keyframe for everyone.
+    """
+    def __init__(self, encoder, max_buffered=1 << 20):
+        self.encoder = encoder
+        self.max_buffered = max_buffered
+        self.channels = {}  # channel -> needs a keyframe
+        self.sent = 0
+        self.dropped = 0
+        self.bytes_sent = 0
+
+    def add_channel(self, channel):
+        self.channels[channel] = True
+
+    def remove_channel(self, channel):
+        self.channels.pop(channel, None)
+
+    def send(self, frame_id, depth):
+        ready = []
+        for channel in list(self.channels):
+            if channel.readyState != "open":
+                continue
+            if channel.bufferedAmount > self.max_buffered:
+                self.dropped += 1
+                self.channels[channel] = True
+            else:
+                ready.append(channel)
+        if not ready:
+            return False
+
+        if any(self.channels[channel] for channel in ready):
+            self.encoder.force_keyframe()
+        chunks = self.encoder.encode(frame_id, depth)
+        for channel in ready:
+            for chunk in chunks:
+                channel.send(chunk)
+                self.bytes_sent += len(chunk)
+            self.channels[channel] = False
+        self.sent += 1
+        return True
@@ -0,0 +1,136 @@
+"""Depth engines: the same MiDaS network run through eager torch, TorchScript or ONNX Runtime
+
+Every engine takes a normalized (N, 3, H, W) float tensor and returns an (N, H, W) float32 numpy array.
+"""
+import torch
+import torch.nn as nn
+
+from depth import load_cached_model
+
+# ONNX Runtime graph optimization levels by config name
+ORT_OPT_LEVELS = ("disable", "basic", "extended", "all")
+
+class SyntheticDepthModel(nn.Module):
+    """CPU-heavy stand-in with the MiDaS input/output shapes, for boxes without cached weights"""
+    def __init__(self, width=32, depth=6):
+        super().__init__()
+        layers = [nn.Conv2d(3, width, 3, padding=1), nn.ReLU()]
+        for _ in range(depth):
+            layers += [nn.Conv2d(width, width, 3, padding=1), nn.ReLU()]
+        layers.append(nn.Conv2d(width, 1, 1))
+        self.body = nn.Sequential(*layers)
+
+    def forward(self, x):
+        # MiDaS returns (N, H, W) relative inverse depth
+        return torch.sigmoid(self.body(x)).squeeze(1)
+
+class EagerEngine:
+    """Runs the torch module directly, the original behaviour"""
+    name = "eager"
+    # Takes any input size, which tiled mode's region passes need. Exports are fixed to one
+    any_size = True
+
+    def __init__(self, model, threads=0, cuda=None):
+        if threads:
+            torch.set_num_threads(threads)
+        self.model = model
+        self.cuda = torch.cuda.is_available() if cuda is None else cuda
+
+    def predict(self, image_tensor):
+        with torch.no_grad():
+            if self.cuda:
+                image_tensor = image_tensor.cuda()
+
+            # Forward pass
+            prediction = self.model(image_tensor)
+            return prediction.cpu().numpy()
+
+class TorchScriptEngine(EagerEngine):
+    """Runs a module exported with export_torchscript, frozen and optimized unless graph_opt is "disable" """
+    name = "torchscript"
+    any_size = False
+
+    def __init__(self, path, threads=0, graph_opt="all"):
+        model = torch.jit.load(path, map_location="cuda" if torch.cuda.is_available() else "cpu").eval()
+        if graph_opt != "disable":
+            model = torch.jit.optimize_for_inference(torch.jit.freeze(model))
+        super().__init__(model, threads)
+
+class OnnxEngine:
+    """Runs a model exported with export_onnx on ONNX Runtime's CPU execution provider"""
+    name = "onnx"
+    any_size = False
+
+    def __init__(self, path, threads=0, graph_opt="all"):
+        # Only needed for this engine, so deployments without it can still run eager or TorchScript
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        options.graph_optimization_level = {
+            "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+            "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+            "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+            "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+        }[graph_opt]
+
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, image_tensor):
+        return self.session.run(None, {self.input_name: image_tensor.numpy()})[0]
+
+def export_torchscript(model, path, size=(256, 256)):
+    """Trace a MiDaS module at a fixed input size and save it for TorchScriptEngine"""
+    w, h = size
+    example = torch.randn(1, 3, h, w)
+    with torch.no_grad():
+        traced = torch.jit.trace(model.cpu().eval(), example)
+    traced.save(path)
+
+def export_onnx(model, path, size=(256, 256)):
+    """Export a MiDaS module at a fixed input size with a dynamic batch axis for OnnxEngine"""
+    w, h = size
+    example = torch.randn(1, 3, h, w)
+    with torch.no_grad():
+        torch.onnx.export(
+            model.cpu().eval(), example, path,
+            input_names=["image"], output_names=["depth"],
+            dynamic_axes={"image": {0: "batch"}, "depth": {0: "batch"}},
+            opset_version=17,
+            dynamo=False,
+        )
+
+def load_engine(kind="eager", path=None, threads=0, graph_opt="all", model_name="DPT_Hybrid", hub_dir=None,
+                cache_dir=None, quantize="none"):
+    """Build the engine named in the server config
+
+    path may contain {model}, which is filled in with model_name so each tier has its own export.
+    quantize="dynamic" runs the eager model with INT8 Linear layers on the CPU. Statically quantized
+    models are exported with quantize_engine.py and run on the onnx engine.
+    """
+    if graph_opt not in ORT_OPT_LEVELS:
+        raise ValueError(f"Unknown graph optimization level: {graph_opt}")
+    if quantize not in ("none", "dynamic"):
+        raise ValueError(f"Unknown quantization mode: {quantize}")
+
+    if kind == "synthetic":
+        # No weights needed, for benchmarks and loopback runs
+        return EagerEngine(SyntheticDepthModel().eval(), threads)
+    if kind == "eager":
+        model = load_cached_model(model_name, hub_dir, cache_dir)
+        if quantize == "dynamic":
+            from quantization import quantize_dynamic_model
+            return EagerEngine(quantize_dynamic_model(model), threads, cuda=False)
+        return EagerEngine(model, threads)
+    if quantize != "none":
+        raise ValueError(f"DEPTH_QUANTIZE only applies to the eager engine, export a quantized {kind} model instead")
+    if path is None:
+        raise ValueError(f"The {kind} engine needs DEPTH_ENGINE_PATH pointing at an exported model")
+    path = path.format(model=model_name)
+    if kind == "torchscript":
+        return TorchScriptEngine(path, threads, graph_opt)
+    if kind == "onnx":
+        return OnnxEngine(path, threads, graph_opt)
+    raise ValueError(f"Unknown depth engine: {kind}")
@@ -0,0 +1,29 @@
+"""Export the MiDaS model for the torchscript or onnx depth engines
+
+    python export_engine.py --format onnx --model DPT_Hybrid --output models/DPT_Hybrid.onnx
+    DEPTH_ENGINE=onnx DEPTH_ENGINE_PATH=models/{model}.onnx python main.py
+"""
+import argparse
+
+import config
+from depth import MODEL_TIERS, load_model
+from engines import SyntheticDepthModel, export_onnx, export_torchscript
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--format", choices=["torchscript", "onnx"], required=True)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--model", choices=MODEL_TIERS, default=config.MODEL)
+    parser.add_argument("--size", type=int, nargs=2, default=[config.INPUT_SIZE] * 2, metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--synthetic", action="store_true", help="export the synthetic benchmark model instead of MiDaS")
+    args = parser.parse_args()
+
+    model = SyntheticDepthModel().eval() if args.synthetic else load_model(args.model, config.HUB_DIR)
+    if args.format == "torchscript":
+        export_torchscript(model, args.output, tuple(args.size))
+    else:
+        export_onnx(model, args.output, tuple(args.size))
+    print(f"✅ Exported {args.format} model to {args.output}")
+
+if __name__ == "__main__":
+    main()
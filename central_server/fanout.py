@@ -0,0 +1,100 @@
+import json
+import time
+
+from aiortc import MediaStreamTrack
+from aiortc.contrib.media import MediaRelay
+
+class ViewerTrack(MediaStreamTrack):
+    """One viewer's view of an output track, also times that viewer's encoder
+
+    With a "frames" channel, what the hub knows about each frame is sent on it as the frame goes to
+    the encoder. The viewer's decoder counts pts from the first frame it got, so the pts in the
+    message is counted from the first frame this track sent.
+    """
+    kind = "video"
+
+    def __init__(self, proxy, metrics=None, label="original", index=0, channel=None, frame_info=None):
+        super().__init__()
+        self.proxy = proxy
+        self.metrics = metrics
+        self.label = label
+        self.last_recv = None
+        self.index = index  # position among the viewer's tracks
+        self.channel = channel
+        self.frame_info = frame_info
+        self.origin = None
+
+    async def recv(self):
+        if self.metrics is not None and self.last_recv is not None:
+            # The sender encodes and packetizes the previous frame before calling recv again
+            self.metrics.observe("encode", self.label, time.perf_counter() - self.last_recv)
+        frame = await self.proxy.recv()
+        self.last_recv = time.perf_counter()
+        if self.origin is None:
+            self.origin = frame.pts
+        if self.channel is not None and self.channel.readyState == "open":
+            info = self.frame_info.get(frame.pts)
+            if info is not None:
+                self.channel.send(json.dumps(dict(info, track=self.index, pts=frame.pts - self.origin,
+                                                  sent=round(time.time() * 1000))))
+        return frame
+
+    def stop(self):
+        super().stop()
+        self.proxy.stop()
+
+class ViewerHub:
+    """Fans the output tracks out to any number of viewer peer connections
+
+    The pipeline fills each output track once per frame, a MediaRelay reads it once and hands the
+    same frame to every subscriber. Only encoding and sending happen per viewer. Subscribers are
+    unbuffered, a viewer that can't keep up skips to the newest frame instead of queueing.
+
+    Tracks come in groups that share pts, one camera's original and depth track, each group with
+    its own frame info table. Every viewer gets every track added so far.
+    """
+    def __init__(self, tracks=(), metrics=None, max_info=300):
+        self.tracks = []  # (output track, frame info table of its group)
+        self.metrics = metrics
+        self.relay = MediaRelay()
+        self.viewers = {}  # peer connection -> its ViewerTracks
+        self.max_info = max_info
+        if tracks:
+            self.add_tracks(tracks)
+
+    def add_tracks(self, tracks):
+        """Add a group of output tracks, returns its frame info table (output pts -> frame id and stage times)"""
+        frame_info = {}
+        self.tracks += [(track, frame_info) for track in tracks]
+        return frame_info
+
+    def annotate(self, frame_info, pts, info):
+        """Attach what is known about a frame to its output pts, for the viewers' "frames" channels"""
+        frame_info[pts] = info
+        if len(frame_info) > self.max_info:
+            del frame_info[next(iter(frame_info))]
+
+    def add_viewer(self, pc, channel=None):
+        viewer_tracks = []
+        for index, (track, frame_info) in enumerate(self.tracks):
+            viewer_track = ViewerTrack(self.relay.subscribe(track, buffered=False), self.metrics,
+                                       getattr(track, "label", track.kind), index, channel, frame_info)
+            pc.addTrack(viewer_track)
+            viewer_tracks.append(viewer_track)
+        self.viewers[pc] = viewer_tracks
+
+        @pc.on("connectionstatechange")
+        async def on_viewer_state():
+            if pc.connectionState in ("failed", "closed"):
+                self.remove_viewer(pc)
+
+    def remove_viewer(self, pc):
+        for viewer_track in self.viewers.pop(pc, []):
+            viewer_track.stop()
+
+    def close(self):
+        for pc in list(self.viewers):
+            self.remove_viewer(pc)
+
+    def __len__(self):
+        return len(self.viewers)
@@ -0,0 +1,91 @@
+import asyncio
+
+class FrameStats:
+    """Per-track counters for frames received, dropped before inference, processed and served from the depth cache"""
+    def __init__(self):
+        self.received = 0
+        self.dropped = 0
+        self.processed = 0
+        self.reused = 0
+
+    def skip_rate(self):
+        return self.reused / self.processed if self.processed else 0.0
+
+    def __str__(self):
+        return (f"received={self.received} dropped={self.dropped} processed={self.processed} "
+                f"reused={self.reused} ({self.skip_rate():.0%} skipped inference)")
+
+class FrameSlot:
+    """Single-slot mailbox between the decode loop and the inference loop, the newest frame wins"""
+    def __init__(self):
+        self.frame = None
+        self.ready = asyncio.Event()
+
+    def put(self, frame):
+        """Store a frame, returns True if it replaced one that was never processed"""
+        replaced = self.frame is not None
+        self.frame = frame
+        self.ready.set()
+        return replaced
+
+    async def get(self):
+        await self.ready.wait()
+        self.ready.clear()
+        frame, self.frame = self.frame, None
+        return frame
+
+class LatestFramePolicy:
+    """Admit every frame, the slot alone keeps only the latest one waiting"""
+    # Camera frames wanted per inference pass, for sizing the capture rate
+    frames_per_inference = 1
+
+    def admit(self, now):
+        return True
+
+    def record_inference(self, seconds):
+        pass
+
+class EveryNthPolicy:
+    """Admit one frame out of every n"""
+    def __init__(self, n):
+        self.n = max(1, n)
+        self.frames_per_inference = self.n
+        self.count = 0
+
+    def admit(self, now):
+        self.count += 1
+        return (self.count - 1) % self.n == 0
+
+    def record_inference(self, seconds):
+        pass
+
+class AdaptivePolicy:
+    """Admit frames no faster than the measured inference time can keep up with"""
+    frames_per_inference = 1
+
+    def __init__(self, smoothing=0.2):
+        self.smoothing = smoothing
+        self.avg_inference = 0.0
+        self.last_admit = None
+
+    def admit(self, now):
+        if self.last_admit is not None and now - self.last_admit < self.avg_inference:
+            return False
+        self.last_admit = now
+        return True
+
+    def record_inference(self, seconds):
+        # Exponential moving average so one slow frame doesn't stall admission
+        if self.avg_inference == 0.0:
+            self.avg_inference = seconds
+        else:
+            self.avg_inference += self.smoothing * (seconds - self.avg_inference)
+
+def make_policy(name, n=2):
+    if name == "latest":
+        return LatestFramePolicy()
+    if name == "every_nth":
+        return EveryNthPolicy(n)
+    if name == "adaptive":
+        return AdaptivePolicy()
+    raise ValueError(f"Unknown frame policy: {name}")
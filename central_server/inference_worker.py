@@ -0,0 +1,225 @@
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from depth import MODEL_TIERS, Preprocessor, estimate_depth, estimate_depth_batch, estimate_raw_depth
+from postprocess import DepthPostprocessor
+
+class InferenceWorker:
+    """Runs depth estimation on a dedicated thread so the asyncio event loop never blocks on the model"""
+    def __init__(self, engine, input_size=(256, 256), tiers=None, raw=False, colormap=None):
+        self.engine = engine
+        self.tiers = tiers
+        # Batches return float predictions instead of 8-bit images, for the depth data channel
+        self.raw = raw
+
+        # One thread keeps results in submission order and stops two forward passes
+        # from fighting over the same CPU cores. Torch releases the GIL inside the
+        # forward pass, so aiortc and socket.io keep running while it works.
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="depth-inference")
+
+        # Only ever touched from the executor thread, so its buffers can be reused frame to frame
+        self.preprocessor = Preprocessor(input_size)
+        self.postprocessor = DepthPostprocessor(colormap)
+        # Region passes (see TiledDepthUpdater) run at many smaller sizes, one buffer set per size
+        self.region_preprocessors = {}
+
+    async def infer(self, img):
+        """Return the 8-bit depth image for a BGR frame without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, estimate_depth, self.engine, img, self.preprocessor,
+                                          self.postprocessor)
+
+    async def infer_batch(self, imgs, timings=None, shapes=None):
+        """Return 8-bit depth images (or raw float maps) for several frames from one batched forward pass"""
+        loop = asyncio.get_running_loop()
+        start_time = time.perf_counter()
+        results = await loop.run_in_executor(self.executor, estimate_depth_batch, self.engine, imgs,
+                                             self.preprocessor, self.raw, timings, self.postprocessor, shapes)
+        if self.tiers is not None:
+            self.tiers.record(self, (time.perf_counter() - start_time) / len(imgs))
+        return results
+
+    async def infer_region(self, img, input_size):
+        """Return raw float depth for a frame or crop, run at the given (width, height) model input size"""
+        preprocessor = self.region_preprocessors.get(input_size)
+        if preprocessor is None:
+            preprocessor = self.region_preprocessors[input_size] = Preprocessor(input_size)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, estimate_raw_depth, self.engine, img, preprocessor)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+class TierController:
+    """Steps the worker down to a cheaper MiDaS variant when frames go over budget, and back up when there is headroom
+
+    Samples are per-frame times, a batch's time divided by its size, so more cameras and bigger
+    batches don't read as a slower model.
+    """
+    def __init__(self, load_tier, tier, budget_ms, min_tier="MiDaS_small", window=30, headroom=0.4, retry_after=60.0):
+        self.load_tier = load_tier
+        self.engines = {}
+        self.tier = tier
+        self.budget = budget_ms / 1000
+        # The configured model is the ceiling, the server never loads anything more expensive
+        self.lowest = MODEL_TIERS.index(min_tier)
+        self.highest = MODEL_TIERS.index(tier)
+        # Stepping up costs roughly 2-3x, so only do it when the current tier is well under budget
+        self.headroom = headroom
+        # A tier that just went over budget isn't retried until retry_after seconds have passed
+        self.retry_after = retry_after
+        self.over_budget_at = {}
+        self.samples = deque(maxlen=window)
+        self.switching = None
+
+    def record(self, worker, seconds):
+        if self.switching is not None:
+            return
+        self.engines.setdefault(self.tier, worker.engine)
+        self.samples.append(seconds)
+        if len(self.samples) < self.samples.maxlen:
+            return
+
+        average = sum(self.samples) / len(self.samples)
+        index = MODEL_TIERS.index(self.tier)
+        now = time.monotonic()
+        if average > self.budget:
+            self.over_budget_at[self.tier] = now
+        if average > self.budget and index > self.lowest:
+            target = MODEL_TIERS[index - 1]
+        elif average < self.budget * self.headroom and index < self.highest:
+            target = MODEL_TIERS[index + 1]
+            if now - self.over_budget_at.get(target, -self.retry_after) < self.retry_after:
+                return
+        else:
+            return
+
+        print(f"🎚️ Average inference {average * 1000:.0f}ms per frame against a {self.budget * 1000:.0f}ms budget, switching {self.tier} -> {target}")
+        self.switching = asyncio.create_task(self.switch(worker, target))
+
+    async def switch(self, worker, tier):
+        try:
+            if tier not in self.engines:
+                # Loading takes seconds, keep it off both the event loop and the inference thread
+                loop = asyncio.get_running_loop()
+                self.engines[tier] = await loop.run_in_executor(None, self.load_tier, tier)
+
+            # Batches already submitted finish on the old engine, the next one picks this up
+            worker.engine = self.engines[tier]
+            self.tier = tier
+            print(f"✅ Now running {tier}")
+        except Exception as e:
+            print(f"❌ Failed to switch to {tier}: {e}")
+        finally:
+            self.samples.clear()
+            self.switching = None
+
+class BatchScheduler:
+    """Gathers the latest frame from every active track and runs them through the model as one batch
+
+    When more frames are waiting than fit in a batch, the groups (cameras) served least so far go
+    first, so a camera with many tracks or a fast frame rate can't crowd the others out.
+    """
+    def __init__(self, worker, window=0.01, max_batch=8, metrics=None):
+        self.worker = worker
+        self.metrics = metrics
+        self.window = window
+        self.max_batch = max_batch
+        self.tracks = set()
+        self.groups = {}  # track id -> group
+        self.served = {}  # group -> frames run
+        self.pending = {}  # track id -> (frame, output shape, future, time queued)
+        self.arrived = asyncio.Event()
+        self.task = None
+
+    def register(self, track_id, group=None):
+        self.tracks.add(track_id)
+        self.groups[track_id] = track_id if group is None else group
+        # A new group starts level with the least served one instead of owed everything it missed
+        self.served.setdefault(self.groups[track_id], min(self.served.values(), default=0))
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    def unregister(self, track_id):
+        self.tracks.discard(track_id)
+        self.pending.pop(track_id, None)
+        group = self.groups.pop(track_id, None)
+        if group not in self.groups.values():
+            self.served.pop(group, None)
+        # A batch may be waiting on this track, let it go without it
+        self.arrived.set()
+
+    async def infer(self, track_id, img, shape=None):
+        """Queue a frame for the next batch and wait for its depth image, sized to shape if given"""
+        future = asyncio.get_running_loop().create_future()
+        self.pending[track_id] = (img, img.shape if shape is None else shape, future, time.perf_counter())
+        self.arrived.set()
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            while not self.pending:
+                self.arrived.clear()
+                await self.arrived.wait()
+
+            # Give the other tracks a short window to catch up so they share this forward pass
+            deadline = loop.time() + self.window
+            while len(self.pending) < min(len(self.tracks), self.max_batch):
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                self.arrived.clear()
+                try:
+                    await asyncio.wait_for(self.arrived.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            track_ids = self.pick()
+            batch = [(track_id, *self.pending.pop(track_id)) for track_id in track_ids]
+            batch = [entry for entry in batch if not entry[3].done()]
+            if not batch:
+                continue
+
+            timings = {}
+            if self.metrics is not None:
+                now = time.perf_counter()
+                for track_id, _, _, _, queued_at in batch:
+                    self.metrics.observe("batch_wait", track_id, now - queued_at)
+
+            try:
+                results = await self.worker.infer_batch([img for _, img, _, _, _ in batch], timings,
+                                                        [shape for _, _, shape, _, _ in batch])
+            except Exception as e:
+                for _, _, _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            # Every frame in the batch waited for the whole pass, so each track sees the full stage times
+            if self.metrics is not None:
+                for track_id, *_ in batch:
+                    for stage, seconds in timings.items():
+                        self.metrics.observe(stage, track_id, seconds)
+
+            for (_, _, _, future, _), depth in zip(batch, results):
+                if not future.done():
+                    future.set_result(depth)
+
+    def pick(self):
+        """Track ids for the next batch, one at a time from whichever group has been served least"""
+        waiting = list(self.pending)
+        picked = []
+        while waiting and len(picked) < self.max_batch:
+            track_id = min(waiting, key=lambda t: self.served.get(self.groups.get(t), 0))
+            waiting.remove(track_id)
+            picked.append(track_id)
+            group = self.groups.get(track_id)
+            self.served[group] = self.served.get(group, 0) + 1
+        return picked
+
+    def shutdown(self):
+        if self.task is not None:
+            self.task.cancel()
@@ -3,128 +3,506 @@ import aiortc.sdp
 import socketio
 from aiortc import RTCPeerConnection, RTCSessionDescription, MediaStreamTrack, RTCConfiguration, RTCIceServer, RTCRtpCodecParameters, VideoStreamTrack
 from aiortc.contrib.media import MediaBlackhole
+from aiortc.mediastreams import VIDEO_CLOCK_RATE, VIDEO_TIME_BASE, MediaStreamError
 import aiortc
 import numpy as np
 import numpy
 import cv2
+import json
 import math
-import torch
-import torch.nn as nn
-import torch.nn.functional as F
-from PIL import Image
-from torchvision import transforms
-import matplotlib.pyplot as plt
+import os
+import sys
 import time
 from av import VideoFrame
 import queue
+from collections import deque
+
+import config
+from capture_control import CaptureController
+from change_detector import ChangeDetector, TiledDepthUpdater
+from depth_channel import DepthChannelSender, DepthFrameEncoder
+from fanout import ViewerHub
+from frame_policy import FrameSlot, FrameStats, make_policy
+from metrics import Metrics
+from postprocess import DepthPostprocessor, depth_to_bgr
+from preview import PreviewServer
+from recording import FrameRecorder
+
+# Simulcast camera modules send each camera twice, paired by track id: "<id>-display" at full size
+# for viewers and "<id>-inference" scaled down to the model input, the only one decoded into BGR
+DISPLAY_SUFFIX = "-display"
+INFERENCE_SUFFIX = "-inference"
+# Seconds a frame waits for its announcement on the control channel before going out without it
+ANNOUNCE_TIMEOUT = 0.05
 
 class QueuedVideoStreamTrack(VideoStreamTrack):
-    def __init__(self):
+    def __init__(self, metrics=None, label="original"):
         super().__init__()
-        self.fdata_queue = asyncio.Queue(maxsize=60)
-
-    def put_frame(self, frame_data):
+        self.fdata_queue = asyncio.Queue(maxsize=config.OUTPUT_QUEUE_SIZE)
+        self.dropped = 0
+        self.start = None
+        self.metrics = metrics
+        self.label = label
+
+    def stamp(self):
+        """Presentation time of a frame queued now, on the 90kHz video clock"""
+        now = time.monotonic()
+        if self.start is None:
+            self.start = now
+        return int((now - self.start) * VIDEO_CLOCK_RATE)
+
+    def put_frame(self, frame_data, pts=None):
+        """Queue a frame and return its pts. Passing the pts of another track's frame pairs the two"""
+        if pts is None:
+            pts = self.stamp()
+        if self.readyState != "live":
+            return pts
+
+        # When the encoder falls behind, drop the oldest frame so what goes out stays fresh
+        if self.fdata_queue.full():
+            try:
+                self.fdata_queue.get_nowait()
+                self.dropped += 1
+            except asyncio.QueueEmpty:
+                pass
         try:
-            self.fdata_queue.put_nowait(frame_data)
+            self.fdata_queue.put_nowait((frame_data, pts, time.perf_counter()))
         except Exception as e:
             pass
             #print(f"Error queuing frame: {e}")
+        return pts
 
     async def recv(self):
-        pts, time_base = await self.next_timestamp()
-
-        frame_data = await self.fdata_queue.get()
-        frame = VideoFrame.from_ndarray(frame_data, format="bgr24")
+        # The pts is fixed when the frame is queued rather than when the encoder pulls it,
+        # so the RGB frame, its depth frame and its depth channel message share one id
+        if self.readyState != "live":
+            raise MediaStreamError
+        item = await self.fdata_queue.get()
+        if item is None:
+            raise MediaStreamError
+        frame_data, pts, queued_at = item
+        if self.metrics is not None:
+            self.metrics.observe("queue_wait", self.label, time.perf_counter() - queued_at)
+
+        frame = self.to_frame(frame_data)
         frame.pts = pts
-        frame.time_base = time_base
+        frame.time_base = VIDEO_TIME_BASE
         return frame
 
-original_video_track = QueuedVideoStreamTrack()
-depth_video_track = QueuedVideoStreamTrack()
-
-# Depth estimation model functions from webcam_simple.py
-def load_model():
-    # Use MiDaS small model which is more reliable
-    model = torch.hub.load("intel-isl/MiDaS", "DPT_Hybrid")
-
-    # Switch to eval mode
-    model.eval()
-
-    # Move to GPU if available
-    if torch.cuda.is_available():
-        model = model.cuda()
-
-    return model
-
-def process_image(img, size=(256, 256)):
-    # OpenCV uses BGR color ordering, need to convert to RGB for the model
-    img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-    # Resize to model input size
-    img_resized = cv2.resize(img_rgb, size, interpolation=cv2.INTER_LINEAR)
-
-    # Convert to tensor and normalize
-    transform = transforms.Compose([
-        transforms.ToTensor(),
-
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-    ])
-
-    img_tensor = transform(Image.fromarray(img_resized)).unsqueeze(0)
-    return img_tensor, img  # Return original BGR image for display
-
-def get_depth_map(model, image_tensor):
-    with torch.no_grad():
-        if torch.cuda.is_available():
-            image_tensor = image_tensor.cuda()
-
-        # Forward pass
-        prediction = model(image_tensor)
-
-        # Normalize output
-        output = prediction.cpu().numpy().squeeze()
+    def stop(self):
+        super().stop()
+        # Drop the queued frames and wake a waiting recv, the relay reading this track ends once it raises
+        while not self.fdata_queue.empty():
+            self.fdata_queue.get_nowait()
+        self.fdata_queue.put_nowait(None)
+
+    def to_frame(self, frame_data):
+        # Decoded frames are forwarded as they are, the encoder takes their yuv420p without a conversion
+        if isinstance(frame_data, VideoFrame):
+            return frame_data
+        return VideoFrame.from_ndarray(frame_data, format="bgr24")
+
+class DepthVideoStreamTrack(QueuedVideoStreamTrack):
+    """Sends depth images as yuv420p frames
+
+    Single-channel depth goes in the luma plane with neutral chroma, colorized depth is converted to I420.
+    """
+    def __init__(self, pool_size=3, metrics=None, label="depth"):
+        super().__init__(metrics, label)
+        # Frames are cycled round-robin. Every viewer's encoder may still hold an older one,
+        # so a pooled frame is only rewritten once nothing but the pool references it
+        self.pool_size = pool_size
+        self.pool = []
+        self.next_index = 0
+        self.yuv = None
+
+    def new_frame(self, width, height):
+        frame = VideoFrame(width, height, "yuv420p")
+        # Chroma never changes, fill it once
+        for plane in frame.planes[1:]:
+            np.frombuffer(plane, dtype=np.uint8)[:] = 128
+        return frame
 
-        return output
+    def allocate(self, width, height):
+        self.pool = [self.new_frame(width, height) for _ in range(self.pool_size)]
+
+    def to_frame(self, depth):
+        h, w = depth.shape[:2]
+        if not self.pool or (self.pool[0].width, self.pool[0].height) != (w, h):
+            self.allocate(w, h)
+
+        frame = self.pool[self.next_index]
+        # Three references: the pool's, frame and getrefcount's argument
+        if sys.getrefcount(frame) > 3:
+            frame = self.pool[self.next_index] = self.new_frame(w, h)
+        self.next_index = (self.next_index + 1) % self.pool_size
+
+        if depth.ndim == 2:
+            # Copy depth rows into the luma plane, which may be padded past the frame width
+            luma = frame.planes[0]
+            np.frombuffer(luma, dtype=np.uint8).reshape(luma.height, luma.line_size)[:, :w] = depth
+            return frame
+
+        # Colorized depth: one conversion to planar I420, then each plane copied past its padding
+        if self.yuv is None or self.yuv.shape != (h * 3 // 2, w):
+            self.yuv = np.empty((h * 3 // 2, w), dtype=np.uint8)
+        cv2.cvtColor(depth, cv2.COLOR_BGR2YUV_I420, dst=self.yuv)
+        flat = self.yuv.reshape(-1)
+        offset = 0
+        for plane in frame.planes:
+            size = plane.width * plane.height
+            np.frombuffer(plane, dtype=np.uint8).reshape(plane.height, plane.line_size)[:, :plane.width] = \
+                flat[offset:offset + size].reshape(plane.height, plane.width)
+            offset += size
+        return frame
 
-def colorize_depth(depth, cmap=plt.cm.viridis):
-    # Normalize depth to 0-1 range
-    normalized_depth = (depth - depth.min()) / (depth.max() - depth.min() + 1e-8)
+metrics = Metrics()
+
+def nearby_pts(mapping, pts, default=None):
+    """The key of mapping within a tick or two of pts. Decoded pts can come out one off what was sent"""
+    for key in (pts, pts - 1, pts + 1, pts - 2, pts + 2):
+        if key in mapping:
+            return key
+    return default
+
+class TrackOutputs:
+    """Where the results for one of a camera module's tracks go: its forwarded frames, depth and depth channel"""
+    def __init__(self, label, hub, send_video=True, send_channel=False):
+        self.original_track = QueuedVideoStreamTrack(metrics, f"{label}/original")
+        self.depth_track = DepthVideoStreamTrack(metrics=metrics, label=f"{label}/depth")
+        # Frame ids of this pair's output pts, for the viewers' "frames" channels
+        self.frame_info = hub.add_tracks([self.original_track, self.depth_track] if send_video else [self.original_track])
+        # Encodes each depth frame once for every viewer's data channel, the delta chain is this track's own
+        self.depth_sender = None
+        if send_channel:
+            encoder = DepthFrameEncoder(config.DEPTH_CHANNEL_FORMAT, config.DEPTH_CHANNEL_KEYFRAME_INTERVAL)
+            self.depth_sender = DepthChannelSender(encoder)
+
+    def tracks(self):
+        return [self.original_track, self.depth_track]
+
+    def stop(self):
+        for track in self.tracks():
+            track.stop()
+
+class CameraSession:
+    """One camera module: its incoming peer connection, an output pair per camera track and the viewers watching them"""
+    def __init__(self, name, pc, send_video=True, send_channel=False):
+        self.name = name
+        self.pc = pc
+        self.offer_sdp = None  # the camera's offer, tells a repeated offer from a restarted camera
+        self.send_video = send_video
+        self.send_channel = send_channel
+        # Every viewer gets its own peer connection fed from the output tracks, so depth runs once per frame
+        self.hub = ViewerHub(metrics=metrics)
+        self.outputs = {}  # incoming track id -> TrackOutputs
+        self.pending_viewers = {}  # offer sdp -> viewer peer connection waiting for an answer
+        self.tasks = set()
+        # The camera's "control" data channel, for asking it to capture slower or smaller
+        self.control = None
+        # Latest (frame info, frame) pairs of each simulcast display stream, matched by the id its inference stream shares
+        self.display_frames = {}
+        # Frame id, capture time and arrival the camera's frames were announced with, per track by pts
+        self.camera_frames = {}
+        # Frames taken before their announcement came in, a late one is merged into what was taken
+        self.unannounced = {}
+        # Set and replaced whenever a display frame or a late announcement comes in, wakes every waiter
+        self.changed = asyncio.Event()
+        self.closed = False
+
+    def add_outputs(self, track_id):
+        """The output pair of an incoming track, created the first time. Viewers that connect later get it"""
+        outputs = self.outputs.get(track_id)
+        if outputs is None:
+            label = self.name if not self.outputs else f"{self.name}/{len(self.outputs)}"
+            outputs = self.outputs[track_id] = TrackOutputs(label, self.hub, self.send_video, self.send_channel)
+        return outputs
+
+    def remember_frame(self, track_id, pts, info, limit=300):
+        """Merge what is known about a camera frame, whichever of its frame and announcement came first"""
+        taken = self.unannounced.get(track_id, {})
+        key = nearby_pts(taken, pts)
+        if key is not None:
+            # Already on its way to the viewers, keep an id it was given in the meantime
+            entry = taken.pop(key)
+            for field, value in info.items():
+                entry.setdefault(field, value)
+            self.notify_changed()
+            return
+        frames = self.camera_frames.setdefault(track_id, {})
+        frames.setdefault(nearby_pts(frames, pts, pts), {}).update(info)
+        if len(frames) > limit:
+            del frames[next(iter(frames))]
+
+    def pop_frame(self, track_id, pts, limit=300):
+        """What is known about a frame. Without its announcement yet, the entry still gets it when it arrives"""
+        frames = self.camera_frames.get(track_id, {})
+        info = frames.pop(nearby_pts(frames, pts), {})
+        if "id" not in info and self.control is not None:
+            taken = self.unannounced.setdefault(track_id, {})
+            taken[pts] = info
+            if len(taken) > limit:
+                del taken[next(iter(taken))]
+        return info
+
+    def forget_track(self, track_id):
+        self.camera_frames.pop(track_id, None)
+        self.unannounced.pop(track_id, None)
+
+    def notify_changed(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    async def wait_for(self, predicate, timeout):
+        """Wait until predicate() holds or timeout runs out, rechecked on every change"""
+        deadline = time.perf_counter() + timeout
+        while not predicate():
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self.changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return predicate()
+        return True
 
-    # Apply colormap
-    colored_depth = (cmap(normalized_depth) * 255).astype(np.uint8)[:, :, :3]
-    return colored_depth
+    def on_control_message(self, message):
+        """{"type": "frame", "track", "pts", "id", "captured"} from the camera's control channel"""
+        try:
+            data = json.loads(message)
+        except (TypeError, ValueError):
+            return
+        if data.get("type") == "frame":
+            self.remember_frame(data["track"], data["pts"], {"id": data["id"], "captured": data["captured"]})
+
+    def peer_connections(self):
+        return [self.pc] + list(self.hub.viewers) + list(self.pending_viewers.values())
+
+    async def close(self):
+        self.closed = True
+        for task in list(self.tasks):
+            task.cancel()
+        for pc in self.peer_connections():
+            await pc.close()
+        # Viewers' relay proxies first, then the outputs, which ends the relay's reader on each
+        self.hub.close()
+        for outputs in self.outputs.values():
+            outputs.stop()
+
+class SessionManager:
+    """Admits camera modules up to a limit and gives each its own session around the shared model"""
+    def __init__(self, processor, max_sessions=4):
+        self.processor = processor
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.rejected = 0
+        self.register_metrics()
+
+    async def admit(self, name, pc_factory, sdp):
+        """Return a new session for this camera, or None when the offer is a repeat or the server is full"""
+        existing = self.sessions.get(name)
+        if existing is not None and existing.pc.connectionState not in ("failed", "closed"):
+            # The admitted offer, not pc.remoteDescription, which is only set once the offer is applied
+            if existing.offer_sdp == sdp:
+                return None
+            # A new offer under the same name is the camera restarting before its old connection
+            # timed out, that one will never carry frames again
+            print(f"🔄 Camera {name} reconnected, replacing its stale session")
+            await self.close(existing)
+            existing = None
+        if existing is None and len(self.sessions) >= self.max_sessions:
+            self.rejected += 1
+            print(f"⛔ Rejecting {name}: {len(self.sessions)}/{self.max_sessions} camera sessions in use")
+            return None
+
+        session = CameraSession(name, pc_factory(), self.processor.send_video, self.processor.send_channel)
+        session.offer_sdp = sdp
+        self.sessions[name] = session
+        print(f"📷 Camera session {name} admitted ({len(self.sessions)}/{self.max_sessions})")
+        return session
+
+    async def close(self, session):
+        # Closing the peer connection fires its state change, which lands here a second time
+        if session.closed:
+            return
+        if self.sessions.get(session.name) is session:
+            del self.sessions[session.name]
+        await session.close()
+        print(f"📴 Camera session {session.name} closed ({len(self.sessions)}/{self.max_sessions})")
+
+    async def close_all(self):
+        for session in list(self.sessions.values()):
+            await self.close(session)
+
+    def find_pending_viewer(self, sdp):
+        for session in self.sessions.values():
+            pc = session.pending_viewers.pop(sdp, None)
+            if pc is not None:
+                return session, pc
+        return None, None
+
+    def peer_connections(self):
+        return [pc for session in list(self.sessions.values()) for pc in session.peer_connections()]
+
+    def register_metrics(self):
+        def outputs():
+            for session in list(self.sessions.values()):
+                for track_outputs in list(session.outputs.values()):
+                    yield from track_outputs.tracks()
+        metrics.collect("depth_sessions", "gauge", "Camera sessions in use",
+                        lambda: [({}, len(self.sessions))])
+        metrics.collect("depth_sessions_rejected_total", "counter", "Camera offers turned away by admission control",
+                        lambda: [({}, self.rejected)])
+        metrics.collect("depth_viewers", "gauge", "Connected viewer peer connections per camera",
+                        lambda: [({"camera": s.name}, len(s.hub)) for s in list(self.sessions.values())])
+        metrics.collect("depth_output_queue_depth", "gauge", "Frames waiting for the encoder per output track",
+                        lambda: [({"track": t.label}, t.fdata_queue.qsize()) for t in outputs()])
+        metrics.collect("depth_output_dropped_total", "counter", "Frames dropped because the encoder fell behind",
+                        lambda: [({"track": t.label}, t.dropped) for t in outputs()])
+        channel_help = {"sent": "Depth frames sent on the data channel",
+                        "dropped": "Depth frames dropped because the data channel backed up",
+                        "bytes_sent": "Bytes sent on the depth data channel"}
+        for field, help_text in channel_help.items():
+            metrics.collect(f"depth_channel_{field}_total", "counter", help_text,
+                            lambda field=field: [({"camera": s.name, "track": track_id}, getattr(o.depth_sender, field))
+                                                 for s in list(self.sessions.values())
+                                                 for track_id, o in list(s.outputs.items()) if o.depth_sender])
 
 class RemoteStreamProcessor:
-    def __init__(self):
+    def __init__(self, load_tier=None):
         self.frame_count = 0
         self.active_tracks = set()
-
-        # Load the depth estimation model
-        print("Loading MiDaS model...")
+        self.frame_stats = {}
+        self.change_detectors = {}
+        self.tile_updaters = {}
+        self.last_depth = {}
+        self.capture_controllers = {}
+        self.engine = None
+        self.worker = None
+        self.scheduler = None
+        self.tiled = False
+        self.send_video = config.DEPTH_TRANSPORT in ("video", "both")
+        self.send_channel = config.DEPTH_TRANSPORT in ("datachannel", "both")
+        # Gray depth, or colorized through a lookup table
+        self.colormap = config.DEPTH_COLORMAP if config.DEPTH_OUTPUT_FORMAT == "color" else None
+        # For depth postprocessed on the event loop (tiled mode, raw output for the data channel)
+        self.postprocessor = DepthPostprocessor(self.colormap)
+        self.preview = None
+        if config.PREVIEW_PORT:
+            self.preview = PreviewServer(config.PREVIEW_HOST, config.PREVIEW_PORT, config.PREVIEW_FPS, config.PREVIEW_WIDTH)
+        self.register_metrics()
+        # Replay benchmarks swap in their own model loader
+        if load_tier is not None:
+            self.load_tier = load_tier
+
+        # Load the model in the background so signaling and WebRTC setup happen while torch starts up
+        self.ready = asyncio.create_task(self.load())
+
+    async def load(self):
+        # Load the depth estimation model on the configured backend
+        print(f"Loading MiDaS {config.MODEL} model ({config.ENGINE} engine)...")
+        start_time = time.perf_counter()
         try:
-            self.model = load_model()
-            print("Model loaded successfully")
+            self.engine = await asyncio.to_thread(self.load_tier, config.MODEL)
+            print(f"Model loaded successfully in {time.perf_counter() - start_time:.1f}s")
         except Exception as e:
             print(f"Error loading model: {e}")
-            self.model = None
+            return
 
-    async def process_track(self, track):
-        global original_video_track
+        # Tiled passes run at many input sizes, a fixed-size export would fail every one of them
+        self.tiled = bool(config.TILED) and self.engine.any_size
+        if config.TILED and not self.tiled:
+            print(f"⚠️ DEPTH_TILED needs an engine that takes any input size, {self.engine.name} exports are fixed. "
+                  f"Running full-frame inference instead")
+
+        # torch is already imported by the loader thread, so this is cheap
+        from inference_worker import InferenceWorker, BatchScheduler, TierController
+
+        # Step down to a cheaper model when inference goes over budget
+        tiers = None
+        if config.LATENCY_BUDGET_MS > 0:
+            tiers = TierController(self.load_tier, config.MODEL, config.LATENCY_BUDGET_MS, config.MIN_MODEL)
+
+        # Inference runs off the event loop so RTP, signaling and the outgoing tracks keep flowing,
+        # and frames from every camera share one batched forward pass
+        input_size = (config.INPUT_SIZE, config.INPUT_SIZE)
+        # The data channel wants full-precision depth, so the worker hands back raw predictions
+        self.worker = InferenceWorker(self.engine, input_size, tiers, raw=self.send_channel, colormap=self.colormap)
+        self.scheduler = BatchScheduler(self.worker, config.BATCH_WINDOW_MS / 1000, config.MAX_BATCH, metrics)
+
+    def register_metrics(self):
+        """Queue depths and counters, read from their owners when /metrics is scraped"""
+        metrics.collect("depth_batch_pending", "gauge", "Frames waiting in the batch scheduler",
+                        lambda: [({}, len(self.scheduler.pending) if self.scheduler else 0)])
+        for field in ("received", "dropped", "processed", "reused"):
+            metrics.collect(f"depth_frames_{field}_total", "counter", f"Camera frames {field} per track",
+                            lambda field=field: [({"track": track_id}, getattr(stats, field))
+                                                 for track_id, stats in list(self.frame_stats.items())])
+        metrics.collect("depth_capture_fps", "gauge", "Capture rate last asked of the camera per track",
+                        lambda: [({"track": track_id}, controller.sent)
+                                 for track_id, controller in list(self.capture_controllers.items())
+                                 if controller.sent is not None])
+
+    def load_tier(self, model_name):
+        # Imported here so torch and the model load on a worker thread, not at server startup
+        from engines import load_engine
+        return load_engine(config.ENGINE, config.ENGINE_PATH, config.INTRA_OP_THREADS, config.GRAPH_OPT,
+                           model_name, config.HUB_DIR, config.CACHE_DIR, config.QUANTIZE)
+
+    async def process_track(self, track, session):
         self.active_tracks.add(track)
-        print(f"🚨 New track received: {track.kind} (ID: {track.id})")
+        print(f"🚨 New track received from {session.name}: {track.kind} (ID: {track.id})")
+        session.add_outputs(track.id)
+
+        # Frames buffer in aiortc until the model is ready, the latest-frame slot skips the backlog
+        await self.ready
+
+        # Keep draining the decoder at full rate and only hand the admitted, latest frame to inference
+        policy = make_policy(config.FRAME_POLICY, config.FRAME_POLICY_N)
+        stats = self.frame_stats[track.id] = FrameStats()
+        slot = FrameSlot()
+        if self.tiled:
+            self.tile_updaters[track.id] = TiledDepthUpdater(config.INPUT_SIZE, config.TILE_SIZE, config.TILE_THRESHOLD,
+                                                             config.TILE_PADDING, config.TILE_FULL_FRACTION)
+        elif config.REUSE_THRESHOLD > 0:
+            self.change_detectors[track.id] = ChangeDetector(config.REUSE_THRESHOLD, max_reuse=config.REUSE_MAX_FRAMES)
+        if self.scheduler is not None:
+            # Inference is shared fairly between cameras, not between tracks
+            self.scheduler.register(track.id, session.name)
+        inference_task = asyncio.create_task(self.inference_loop(track.id, slot, policy, stats, session))
+        control_task = None
+        if config.CAPTURE_CONTROL:
+            controller = self.capture_controllers[track.id] = CaptureController(config.CAPTURE_MIN_FPS, config.CAPTURE_MAX_FPS)
+            control_task = asyncio.create_task(self.capture_control_loop(track.id, controller, policy, session))
+        # Every decoded frame, before admission, for replay with bench_replay.py
+        recorder = None
+        if config.RECORD_DIR:
+            recorder = FrameRecorder(os.path.join(config.RECORD_DIR, f"{session.name}-{track.id}"), config.RECORD_MAX_FRAMES)
 
-        frame_count = 0
         try:
             while True:
+                wait_start = time.perf_counter()
                 frame = await track.recv()
-                frame_count += 1
+                metrics.observe("decode_wait", track.id, time.perf_counter() - wait_start)
+                stats.received += 1
+                if config.FRAME_INFO:
+                    session.remember_frame(track.id, frame.pts, {"received": round(time.time() * 1000)})
+                if recorder is not None:
+                    recorder.write(frame)
                 self.frame_count += 1
 
-                if frame_count % 30 == 0:  # Log every 30 frames
-                    print(f"🔄 Processed {frame_count} frames from track {track.id}")
+                if stats.received % 30 == 0:  # Log every 30 frames
+                    print(f"🔄 Track {track.id}: {stats}")
 
-                self.analyze_frame(frame)
+                if not policy.admit(time.monotonic()):
+                    stats.dropped += 1
+                    continue
 
+                if slot.put(frame):
+                    stats.dropped += 1
+
+        except MediaStreamError:
+            print(f"📴 Track {track.id} ended")
         except asyncio.CancelledError:
             print(f"⚠️ Track processing was cancelled for {track.id}")
         except Exception as e:
@@ -132,58 +510,185 @@ class RemoteStreamProcessor:
             import traceback
             traceback.print_exc()
         finally:
+            inference_task.cancel()
+            if control_task is not None:
+                control_task.cancel()
+            self.capture_controllers.pop(track.id, None)
+            if recorder is not None:
+                recorder.close()
+            if self.scheduler is not None:
+                self.scheduler.unregister(track.id)
+            self.change_detectors.pop(track.id, None)
+            self.tile_updaters.pop(track.id, None)
+            self.last_depth.pop(track.id, None)
+            self.frame_stats.pop(track.id, None)
+            session.forget_track(track.id)
+            metrics.remove_track(track.id)
             self.active_tracks.discard(track)
             print(f"🔚 Track processing ended for {track.id}")
 
-    def analyze_frame(self, frame):
+    async def receive_display(self, track, session):
+        """Keep the newest frame of a simulcast display stream, forwarded with its inference stream's depth"""
+        print(f"🖥️ Display stream from {session.name} (ID: {track.id})")
+        base = track.id[:-len(DISPLAY_SUFFIX)]
+        # A few frames back, so the inference frame's own display frame can be found by id
+        frames = session.display_frames[base] = deque(maxlen=4)
+        try:
+            while True:
+                frame = await track.recv()
+                # The info is filled in if the announcement comes after the frame, so match reads the id late
+                frames.append((session.pop_frame(track.id, frame.pts), frame))
+                session.notify_changed()
+        except MediaStreamError:
+            print(f"📴 Track {track.id} ended")
+        finally:
+            session.display_frames.pop(base, None)
+            session.forget_track(track.id)
+
+    async def display_frame(self, session, base, frame_id, timeout=0.1):
+        """The simulcast display frame with frame_id, or the newest one if it doesn't show up in time
+
+        The full-size frame decodes after the small one, so it is usually a few ms behind.
+        """
+        def match():
+            frames = session.display_frames.get(base)
+            if not frames:
+                return None
+            return next((f for info, f in frames if info.get("id") == frame_id), None)
+
+        if frame_id is not None:
+            await session.wait_for(lambda: match() is not None, timeout)
+        frames = session.display_frames.get(base)
+        return match() or (frames[-1][1] if frames else None)
+
+    async def inference_loop(self, track_id, slot, policy, stats, session):
+        """Run depth on whatever frame is newest once the previous one is done"""
+        while True:
+            frame = await slot.get()
+            start_time = time.perf_counter()
+            await self.analyze_frame(frame, track_id, session)
+            elapsed = time.perf_counter() - start_time
+            policy.record_inference(elapsed)
+            controller = self.capture_controllers.get(track_id)
+            if controller is not None:
+                controller.record(elapsed)
+            stats.processed += 1
+
+    async def capture_control_loop(self, track_id, controller, policy, session):
+        """Ask the camera to capture this track no faster than it gets processed"""
+        while True:
+            await asyncio.sleep(config.CAPTURE_CONTROL_INTERVAL)
+            # Older camera modules have no control channel and keep their own settings
+            channel = session.control
+            if channel is None or channel.readyState != "open":
+                continue
+            fps = controller.update(policy.frames_per_inference)
+            if fps is None:
+                continue
+            request = {"type": "capture", "track": track_id, "fps": fps}
+            if config.CAPTURE_WIDTH and config.CAPTURE_HEIGHT:
+                request.update(width=config.CAPTURE_WIDTH, height=config.CAPTURE_HEIGHT)
+            channel.send(json.dumps(request))
+            print(f"📉 Asking {session.name} to capture {track_id} at {fps} fps")
+
+    async def analyze_frame(self, frame, track_id, session):
         """Apply depth estimation to the received frame and display results"""
-        if self.model is None:
+        if self.engine is None:
             # If model failed to load, just display the original frame
-            img = frame.to_ndarray(format='bgr24')
-            cv2.imshow('Remote Video Stream', img)
-            cv2.waitKey(1)
+            self.show(frame.to_ndarray(format='bgr24'))
             return
 
         # Convert frame to ndarray format that OpenCV can work with
         img = frame.to_ndarray(format='bgr24')
 
-        # Put frame in the original track's queue
-        original_video_track.put_frame(img)
+        # What the camera announced about this frame, passed on to viewers with the output pts. The
+        # announcement goes over SCTP and can land after the frame decoded, give it a moment
+        info = session.pop_frame(track_id, frame.pts)
+        if "id" not in info and session.control is not None:
+            await session.wait_for(lambda: "id" in info, ANNOUNCE_TIMEOUT)
+
+        # Viewers of a simulcast camera get its full-size stream, depth is scaled up to match
+        output = frame
+        if track_id.endswith(INFERENCE_SUFFIX):
+            output = await self.display_frame(session, track_id[:-len(INFERENCE_SUFFIX)], info.get("id")) or frame
+        shape = (output.height, output.width, 3)
+
+        # Forward the decoded frame itself, it goes back to the encoder without another conversion.
+        # Its pts is what the depth frame is paired with on the depth track
+        outputs = session.outputs[track_id]
+        pts = outputs.original_track.put_frame(output)
+        # Viewers decode at pts of their own, so the data channel and "frames" channel pair by the
+        # camera's frame id instead, or the output pts for a camera that didn't announce this frame
+        frame_id = info.setdefault("id", pts)
+        if config.FRAME_INFO:
+            # Before any await, the original frame can go out as soon as this returns
+            session.hub.annotate(outputs.frame_info, pts, info)
 
         try:
-            # Process frame for depth estimation
+            # Near-duplicate frames of a static scene reuse the last depth map instead of a new pass
             start_time = time.time()
-            image_tensor, original_frame = process_image(img)
-
-            # Get depth prediction
-            depth_map = get_depth_map(self.model, image_tensor)
-
-            # Normalize depth map to 0-255 for display
-            normalized_depth = ((depth_map - depth_map.min()) / (depth_map.max() - depth_map.min()) * 255).astype(np.uint8)
-
-            # Create a 3-channel grayscale image (BGR format)
-            depth_bgr = cv2.cvtColor(normalized_depth, cv2.COLOR_GRAY2BGR)
-
-            # Resize depth map to match original frame
-            h, w = original_frame.shape[:2]
-            depth_bgr_resized = cv2.resize(depth_bgr, (w, h))
-
-            # Send the depth map to the video track
-            depth_video_track.put_frame(depth_bgr_resized)
+            detector = self.change_detectors.get(track_id)
+            updater = self.tile_updaters.get(track_id)
+            depth_map = None
+            if updater is not None:
+                # Only the changed part of the view goes through the model
+                update_start = time.perf_counter()
+                depth_map = await updater.update(self.worker, img)
+                metrics.observe("inference", track_id, time.perf_counter() - update_start)
+                if updater.last_action == "reuse":
+                    self.frame_stats[track_id].reused += 1
+            elif detector is not None and not detector.needs_inference(img) and track_id in self.last_depth:
+                depth_map = self.last_depth[track_id]
+                self.frame_stats[track_id].reused += 1
+            else:
+                # Process frame for depth estimation on the inference thread
+                depth_map = await self.scheduler.infer(track_id, img, shape)
+                self.last_depth[track_id] = depth_map
+
+            # Raw float depth when the data channel is on or the frame was tiled, otherwise already 8-bit
+            if depth_map.dtype == np.uint8:
+                depth_img = depth_map
+            else:
+                postprocess_start = time.perf_counter()
+                depth_img = self.postprocessor(depth_map, shape)
+                metrics.observe("postprocess", track_id, time.perf_counter() - postprocess_start)
+
+            # Send the depth map to the video track and data channel
+            enqueue_start = time.perf_counter()
+            if outputs.depth_sender is not None and depth_map.dtype != np.uint8:
+                outputs.depth_sender.send(frame_id, depth_map)
+            if session.send_video:
+                outputs.depth_track.put_frame(depth_img, pts)
+            # The same dict the original frame was annotated with, the depth frame goes out with this too
+            info["inferred"] = round(time.time() * 1000)
+            metrics.observe("enqueue", track_id, time.perf_counter() - enqueue_start)
 
             # Show fps
             # fps = 1.0 / (time.time() - start_time)
-            # cv2.putText(original_frame, f"FPS: {fps:.2f}", (10, 30),
+            # cv2.putText(img, f"FPS: {fps:.2f}", (10, 30),
             #            cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
 
-            # Display original and depth side by side
-            display_img = np.hstack((original_frame, depth_bgr_resized))
-            cv2.imshow('Remote Depth Estimation (Original | Depth)', display_img)
+            self.show(img, depth_img)
         except Exception as e:
             print(f"Error processing frame for depth: {e}")
             # Display original frame if error occurs
-            cv2.imshow('Remote Video Stream', img)
+            self.show(img)
 
+    def show(self, img, depth_img=None):
+        """Hand the frames to the preview endpoint and, unless headless, the local window"""
+        if self.preview is not None:
+            self.preview.offer(img, depth_img)
+        if config.HEADLESS:
+            return
+
+        if depth_img is None:
+            cv2.imshow('Remote Video Stream', img)
+        else:
+            # Display original and depth side by side, depth is display-sized for simulcast cameras
+            if depth_img.shape[:2] != img.shape[:2]:
+                depth_img = cv2.resize(depth_img, (img.shape[1], img.shape[0]), interpolation=cv2.INTER_AREA)
+            display_img = np.hstack((img, depth_to_bgr(depth_img)))
+            cv2.imshow('Remote Depth Estimation (Original | Depth)', display_img)
         cv2.waitKey(1)  # Wait 1ms to allow GUI to update
 
 async def main():
@@ -215,15 +720,23 @@ async def main():
         )
     ]
 
-    # Create the peer connection with low bandwidth configuration
+    # Each camera gets its own peer connection with the low bandwidth configuration
     ice_servers = [RTCIceServer(urls=["stun:stun.l.google.com:19302"])]
-    config = RTCConfiguration(iceServers=ice_servers)
-    incoming_pc = RTCPeerConnection(configuration=config)
-    for transceiver in incoming_pc.getTransceivers():
-        transceiver.setCodecPreferences(preferred_codecs)
+    rtc_config = RTCConfiguration(iceServers=ice_servers)
+
+    def create_incoming_pc():
+        incoming_pc = RTCPeerConnection(configuration=rtc_config)
+        for transceiver in incoming_pc.getTransceivers():
+            transceiver.setCodecPreferences(preferred_codecs)
+        return incoming_pc
 
-    outgoing_pc = RTCPeerConnection()
+    # One model and inference worker, shared by every camera session
     processor = RemoteStreamProcessor()
+    sessions = SessionManager(processor, config.MAX_SESSIONS)
+    if processor.preview is not None:
+        await processor.preview.start()
+    if config.METRICS_PORT:
+        await metrics.start(config.METRICS_HOST, config.METRICS_PORT)
 
     @sio.event
     async def availableOffers(offers):
@@ -231,18 +744,35 @@ async def main():
         for offer in offers:
             await handle_offer(offer)
 
+    @sio.event
+    async def newOfferAwaiting(offers):
+        # A camera module that came up after the server
+        for offer in offers:
+            await handle_offer(offer)
 
     async def handle_offer(offer_data):
         try:
-            # Only process offers from 'camera-module'
-            if offer_data["offererUserName"] != 'camera-module':
-                print(f"❌ Ignoring offer from unauthorized user: {offer_data['offererUserName']}")
+            # Only process offers from camera modules
+            name = offer_data["offererUserName"]
+            if not name.startswith(config.CAMERA_PREFIX):
+                print(f"❌ Ignoring offer from unauthorized user: {name}")
+                return
+
+            # Repeated offers and cameras over the session limit are skipped, a restarted camera replaces its old session
+            session = await sessions.admit(name, create_incoming_pc, offer_data['offer']['sdp'])
+            if session is None:
                 return
+            setup_session(session)
+            incoming_pc = session.pc
 
             await incoming_pc.setRemoteDescription(RTCSessionDescription(
                 sdp=offer_data['offer']['sdp'],
                 type=offer_data['offer']['type']
             ))
+            # Every track has fired on_track by now. One viewer offer carries all of them, and one
+            # open offer per camera at a time, the next one goes up when a viewer takes it
+            if session.outputs and not session.pending_viewers:
+                asyncio.create_task(safe_create_offer(session))
 
             answer = await incoming_pc.createAnswer()
             await incoming_pc.setLocalDescription(answer)
@@ -252,7 +782,7 @@ async def main():
                 offer_ice_candidates = await sio.call(
                     "newAnswer",
                     {
-                        "offererUserName": offer_data["offererUserName"],
+                        "offererUserName": name,
                         "answer": {
                             "type": answer.type,
                             "sdp": answer.sdp
@@ -283,130 +813,124 @@ async def main():
             ice_candidate = aiortc.sdp.candidate_from_sdp(candidate["candidate"])
             ice_candidate.sdpMid = candidate["sdpMid"]
             ice_candidate.sdpMLineIndex = candidate["sdpMLineIndex"]
-            await incoming_pc.addIceCandidate(ice_candidate)
-            await outgoing_pc.addIceCandidate(ice_candidate)
+            # Candidates don't say which peer they belong to, only connections still being set up can use them
+            for pc in sessions.peer_connections():
+                if pc.connectionState in ("new", "connecting"):
+                    await pc.addIceCandidate(ice_candidate)
         except Exception as e:
             print(f"Error adding ICE candidate: {str(e)}")
 
-    @incoming_pc.on("icecandidate")
-    def on_ice_candidate(candidate):
-        if candidate:
-            print("❄️ Sending ICE candidate")
-            asyncio.create_task(sio.emit("sendIceCandidateToSignalingServer", {
-                "didIOffer": False,
-                "iceUserName": "server-in",
-                "iceCandidate": {
-                    "candidate": candidate.candidate,
-                    "sdpMid": candidate.sdpMid,
-                    "sdpMLineIndex": candidate.sdpMLineIndex
-                }
-            }))
-
-    @outgoing_pc.on("icecandidate")
-    def on_ice_candidate_outgoing(candidate):
-        if candidate:
-            print("❄️ Sending ICE candidate")
-            asyncio.create_task(sio.emit("sendIceCandidateToSignalingServer", {
-                "didIOffer": False,
-                "iceUserName": "server",
-                "iceCandidate": {
-                    "candidate": candidate.candidate,
-                    "sdpMid": candidate.sdpMid,
-                    "sdpMLineIndex": candidate.sdpMLineIndex
-                }
-            }))
-
-    async def setup_forwarding():
-        # Wait for the track to be ready
-        #await original_video_track.wait_until_ready()
-        print("🔄 Original video track has frames, creating offer...")
-        await create_offer()
-
-    @incoming_pc.on("track")
-    def on_track(track):
-        print("🎉 Got a track from the other peer! How exciting")
-        print(f"Track details: {track}")
-
-        # Only process video tracks
-        if track.kind == "video":
-            print("🎥 Processing video track...")
-            asyncio.create_task(processor.process_track(track))
-
-            # Make setup_forwarding more robust by handling errors
-            async def safe_setup_forwarding():
-                try:
-                    print("⏳ Waiting for video track to be ready...")
-                    #await original_video_track.wait_until_ready()
-                    print("🔄 Original video track has frames, creating offer...")
-                    await create_offer()
-                except Exception as e:
-                    print(f"❌ Error in setup_forwarding: {e}")
-
-            # Use create_task with explicit variable to avoid garbage collection
-            setup_task = asyncio.create_task(safe_setup_forwarding())
-        else:
-            print(f"📢 Ignoring non-video track: {track.kind}")
-
-
-    @incoming_pc.on("connectionstatechange")
-    async def on_connectionstatechange():
-        print(f"Connection state is {incoming_pc.connectionState}")
-        if incoming_pc.connectionState == "failed":
-            await incoming_pc.close()
-            print("❌ Connection failed, closing peer connection")
-
-    @outgoing_pc.on("connectionstatechange")
-    async def on_outgoing_connectionstatechange():
-        print(f"🔌 Outgoing connection state is {outgoing_pc.connectionState}")
-        if outgoing_pc.connectionState == "connected":
-            print("✅ Successfully forwarding video")
-        elif outgoing_pc.connectionState == "failed":
-            print("❌ Outgoing connection failed")
-
-    async def create_peer_connection():
+    def setup_session(session):
+        incoming_pc = session.pc
 
         @incoming_pc.on("icecandidate")
-        def on_icecandidate(candidate):
+        def on_ice_candidate(candidate):
             if candidate:
-                asyncio.create_task(send_ice_candidate(candidate))
+                print("❄️ Sending ICE candidate")
+                asyncio.create_task(sio.emit("sendIceCandidateToSignalingServer", {
+                    "didIOffer": False,
+                    "iceUserName": "server",
+                    "offerSdp": incoming_pc.remoteDescription.sdp if incoming_pc.remoteDescription else None,
+                    "iceCandidate": {
+                        "candidate": candidate.candidate,
+                        "sdpMid": candidate.sdpMid,
+                        "sdpMLineIndex": candidate.sdpMLineIndex
+                    }
+                }))
+
+        @incoming_pc.on("datachannel")
+        def on_datachannel(channel):
+            if channel.label == "control":
+                session.control = channel
+                channel.on("message", session.on_control_message)
+                # Simulcast cameras scale their inference streams to what the model takes
+                channel.send(json.dumps({"type": "inference", "width": config.INPUT_SIZE, "height": config.INPUT_SIZE}))
 
         @incoming_pc.on("track")
         def on_track(track):
-            print(f"Received {track.kind} track")
-
-    async def send_ice_candidate(candidate):
-        await sio.emit('sendIceCandidateToSignalingServer', {
-            'didIOffer': True,  # Change this based on your role (offerer/answerer)
-            'iceUserName': 'server',
-            'iceCandidate': {
-                'candidate': candidate.candidate,
-                'sdpMid': candidate.sdpMid,
-                'sdpMLineIndex': candidate.sdpMLineIndex
-            }
-        })
-
-    async def create_offer():
-        global original_video_track
-        print("📤 Adding track to outgoing peer connection...")
-        outgoing_pc.addTrack(original_video_track)
-        outgoing_pc.addTrack(depth_video_track)
+            print(f"🎉 Got a track from {session.name}! How exciting")
+            print(f"Track details: {track}")
+
+            # Only process video tracks
+            if track.kind == "video":
+                print("🎥 Processing video track...")
+                if track.id.endswith(DISPLAY_SUFFIX):
+                    # Only forwarded, depth and outputs come from the matching inference stream
+                    task = asyncio.create_task(processor.receive_display(track, session))
+                    session.tasks.add(task)
+                    task.add_done_callback(session.tasks.discard)
+                    return
+                # Outputs exist before the viewer offer is made, so it carries every track's pair
+                session.add_outputs(track.id)
+                task = asyncio.create_task(processor.process_track(track, session))
+                session.tasks.add(task)
+                task.add_done_callback(session.tasks.discard)
+            else:
+                print(f"📢 Ignoring non-video track: {track.kind}")
+
+        @incoming_pc.on("connectionstatechange")
+        async def on_connectionstatechange():
+            print(f"Connection state of {session.name} is {incoming_pc.connectionState}")
+            if incoming_pc.connectionState in ("failed", "closed"):
+                print("❌ Camera connection ended, closing its session")
+                await sessions.close(session)
+
+    async def safe_create_offer(session):
+        try:
+            print("🔄 Creating viewer offer...")
+            await create_offer(session)
+        except Exception as e:
+            print(f"❌ Error in setup_forwarding: {e}")
+
+    async def create_offer(session):
+        print(f"📤 Adding {session.name} tracks to a new viewer peer connection...")
+        outgoing_pc = RTCPeerConnection()
+        # Frame ids and stage times of every frame the viewer gets, to pair tracks and time the pipeline
+        frames_channel = outgoing_pc.createDataChannel("frames") if config.FRAME_INFO else None
+        session.hub.add_viewer(outgoing_pc, frames_channel)
+        channels = []
+        for index, outputs in enumerate(session.outputs.values()):
+            if outputs.depth_sender is None:
+                continue
+            # Reliable and ordered because frames are deltas, the sender drops whole frames when it backs up.
+            # One per camera track in track order: "depth", "depth-1", ...
+            channel = outgoing_pc.createDataChannel("depth" if index == 0 else f"depth-{index}")
+            outputs.depth_sender.add_channel(channel)
+            channels.append((outputs.depth_sender, channel))
+
+        @outgoing_pc.on("connectionstatechange")
+        async def on_outgoing_connectionstatechange():
+            print(f"🔌 Outgoing connection state is {outgoing_pc.connectionState} ({len(session.hub)} viewers of {session.name})")
+            if outgoing_pc.connectionState == "connected":
+                print("✅ Successfully forwarding video")
+            elif outgoing_pc.connectionState in ("failed", "closed"):
+                print("❌ Outgoing connection ended")
+                for sender, channel in channels:
+                    sender.remove_channel(channel)
+                await outgoing_pc.close()
 
         # Create and set local description
         print("📝 Creating outgoing offer...")
         offer = await outgoing_pc.createOffer()
         await outgoing_pc.setLocalDescription(offer)
+        session.pending_viewers[outgoing_pc.localDescription.sdp] = outgoing_pc
 
-        # Send offer to signaling server
+        # Send offer to signaling server, tagged with the camera so viewers can pick one
         print("📡 Sending offer to signaling server...")
         await sio.emit('newOffer', {
             'sdp': outgoing_pc.localDescription.sdp,
-            'type': outgoing_pc.localDescription.type
+            'type': outgoing_pc.localDescription.type,
+            'camera': session.name
         })
         print("💬 Offer sent, waiting for answer...")
 
     @sio.event
     async def answerResponse(data):
         print(f"📨 Received answer to my offer from {data.get('answererUserName', 'unknown')}")
+        session, outgoing_pc = sessions.find_pending_viewer(data['offer']['sdp'])
+        if outgoing_pc is None:
+            print("❌ Answer for an offer that is no longer open")
+            return
         try:
             await outgoing_pc.setRemoteDescription(RTCSessionDescription(
                 sdp=data['answer']['sdp'],
@@ -416,31 +940,32 @@ async def main():
         except Exception as e:
             print(f"❌ Error setting remote description: {e}")
 
+        # Put the next offer up so another viewer can attach
+        await create_offer(session)
+
     @sio.event
     async def connect():
         print("✅ Connected to signaling server")
         await sio.emit("requestOffers")
-        await create_peer_connection()
 
     try:
         await sio.connect(
-            'https://192.168.0.151:8181/',
+            config.SIGNALING_URL,
             auth={'userName': 'server', 'password': 'x'},
             transports=['websocket']
         )
         await sio.wait()
     except asyncio.CancelledError:
         print("🛑 Asyncio task cancelled")
-        await outgoing_pc.close()
-        await incoming_pc.close()
+        await sessions.close_all()
         await sio.disconnect()
     except Exception as e:
         print(f"Connection error: {str(e)}")
 
-        await outgoing_pc.close()
-        await incoming_pc.close()
+        await sessions.close_all()
         await sio.disconnect()
-        cv2.destroyAllWindows()  # Clean up OpenCV windows
+        if not config.HEADLESS:
+            cv2.destroyAllWindows()  # Clean up OpenCV windows
 
 if __name__ == "__main__":
     try:
@@ -449,8 +974,9 @@ if __name__ == "__main__":
         print("\n👋 User interrupted execution")
     finally:
         # Final cleanup
-        cv2.destroyAllWindows()
-        cv2.waitKey(1)  # Process any OpenCV events
+        if not config.HEADLESS:
+            cv2.destroyAllWindows()
+            cv2.waitKey(1)  # Process any OpenCV events
 
         # Force exit if needed
         import os, sys
@@ -0,0 +1,95 @@
+"""Per-stage latency histograms and counters, served as Prometheus text
+
+Recording a sample is a bisect and two additions, cheap enough to leave on for every frame.
+Stages, in seconds, labelled by track:
+    decode_wait   waiting on track.recv() for the next decoded camera frame
+    batch_wait    frame waiting in the batch scheduler for the rest of its batch
+    preprocess    resize and normalize on the inference thread (whole batch)
+    inference     forward pass (whole batch, or the tiled update)
+    postprocess   normalizing and resizing depth to the frame
+    enqueue       handing the frame pair to the output tracks and depth channel
+    queue_wait    frame waiting in an output track's queue for the encoder (track is "original" or "depth")
+    encode        from a viewer track's recv() returning to that viewer's sender asking for the next
+                  frame, which covers aiortc's encode and packetization of that frame (all viewers
+                  of the "original" or "depth" track together)
+"""
+from bisect import bisect_left
+
+from aiohttp import web
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+def format_labels(labels):
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f"{name}_sum{{{labels}}} {self.sum}"
+        yield f"{name}_count{{{labels}}} {self.count}"
+
+class Metrics:
+    """Stage histograms recorded inline, plus gauges and counters read from their owners at scrape time"""
+    def __init__(self):
+        self.stages = {}  # (stage, track) -> Histogram
+        self.collectors = []
+        self.runner = None
+
+    def observe(self, stage, track, seconds):
+        histogram = self.stages.get((stage, track))
+        if histogram is None:
+            histogram = self.stages[(stage, track)] = Histogram()
+        histogram.observe(seconds)
+
+    def remove_track(self, track):
+        """Forget a finished track's histograms so reconnecting cameras don't grow the scrape forever"""
+        for key in [key for key in self.stages if key[1] == track]:
+            del self.stages[key]
+
+    def collect(self, name, kind, help_text, collector):
+        """Register collector() -> iterable of (labels dict, value), read on every scrape"""
+        self.collectors.append((name, kind, help_text, collector))
+
+    def render(self):
+        lines = ["# HELP depth_stage_seconds Time spent per pipeline stage",
+                 "# TYPE depth_stage_seconds histogram"]
+        for (stage, track), histogram in sorted(self.stages.items()):
+            lines.extend(histogram.lines("depth_stage_seconds", format_labels({"stage": stage, "track": track})))
+
+        for name, kind, help_text, collector in self.collectors:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in collector():
+                lines.append(f"{name}{{{format_labels(labels)}}} {value}" if labels else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    async def handle_metrics(self, request):
+        return web.Response(body=self.render().encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    async def start(self, host="127.0.0.1", port=9100):
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        print(f"📈 Metrics at http://{host}:{port}/metrics")
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
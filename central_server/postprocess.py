@@ -0,0 +1,61 @@
+import sys
+
+import cv2
+import numpy as np
+
+def colormap_lut(name):
+    """256-entry BGR lookup table for one of OpenCV's colormaps ("viridis", "turbo", "inferno", ...)"""
+    code = getattr(cv2, f"COLORMAP_{name.upper()}", None)
+    if code is None:
+        raise ValueError(f"Unknown colormap: {name}")
+    return cv2.applyColorMap(np.arange(256, dtype=np.uint8).reshape(256, 1), code)
+
+class DepthPostprocessor:
+    """Raw prediction to a frame-sized 8-bit depth image, gray or colorized, in three passes
+
+    min/max and the normalize-and-cast run at model resolution, then one resize to the frame,
+    then (colorized only) one table lookup. Intermediates are reused frame to frame. Outputs come
+    from a small pool and a pooled image is only rewritten once nothing else holds it.
+    Not thread-safe, each thread keeps its own instance.
+    """
+    def __init__(self, colormap=None, pool_size=4, interpolation=cv2.INTER_LINEAR):
+        self.lut = colormap_lut(colormap) if colormap else None
+        self.interpolation = interpolation
+        self.small = None
+        self.gray = None
+        self.pool = [None] * pool_size
+        self.next_index = 0
+
+    def output(self, shape):
+        out = self.pool[self.next_index]
+        # Three references: the pool's, out and getrefcount's argument
+        if out is None or out.shape != shape or sys.getrefcount(out) > 3:
+            out = self.pool[self.next_index] = np.empty(shape, dtype=np.uint8)
+        self.next_index = (self.next_index + 1) % len(self.pool)
+        return out
+
+    def __call__(self, depth_map, shape):
+        h, w = shape[:2]
+        if self.small is None or self.small.shape != depth_map.shape:
+            self.small = np.empty(depth_map.shape, dtype=np.uint8)
+
+        # Normalize to 0-255 and cast in one pass over the small map
+        lo, hi = cv2.minMaxLoc(depth_map)[:2]
+        scale = 255.0 / (hi - lo) if hi > lo else 0.0
+        cv2.convertScaleAbs(depth_map, dst=self.small, alpha=scale, beta=-lo * scale)
+
+        if self.lut is None:
+            # Single-channel, DepthVideoStreamTrack sends it as the luma plane of a yuv420p frame
+            return cv2.resize(self.small, (w, h), dst=self.output((h, w)), interpolation=self.interpolation)
+
+        # Map colors after upscaling so edges interpolate in depth, not between palette entries
+        if self.gray is None or self.gray.shape != (h, w):
+            self.gray = np.empty((h, w), dtype=np.uint8)
+        cv2.resize(self.small, (w, h), dst=self.gray, interpolation=self.interpolation)
+        return cv2.applyColorMap(self.gray, self.lut, dst=self.output((h, w, 3)))
+
+def depth_to_bgr(depth_img):
+    """Gray or colorized depth image as BGR, for previews"""
+    if depth_img.ndim == 2:
+        return cv2.cvtColor(depth_img, cv2.COLOR_GRAY2BGR)
+    return depth_img
@@ -0,0 +1,122 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from aiohttp import web
+
+from postprocess import depth_to_bgr
+
+PAGE = b"<html><body style='margin:0;background:#000'><img src='/preview.mjpg' style='width:100%'></body></html>"
+
+def compose_preview(img, depth_img=None, width=320, quality=70):
+    """Downscaled original | depth side by side, as JPEG bytes"""
+    h, w = img.shape[:2]
+    size = (width, max(1, h * width // w))
+    panes = [cv2.resize(img, size, interpolation=cv2.INTER_AREA)]
+    if depth_img is not None:
+        panes.append(depth_to_bgr(cv2.resize(depth_img, size, interpolation=cv2.INTER_AREA)))
+    ok, jpeg = cv2.imencode(".jpg", np.hstack(panes) if len(panes) > 1 else panes[0],
+                            [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return jpeg.tobytes()
+
+class PreviewServer:
+    """Local HTTP preview of the latest frames, rendered only for connected clients
+
+    The hot path only swaps two references in offer(). Resizing and JPEG encoding happen on a
+    dedicated thread, at most fps times a second however many clients are watching.
+    GET /preview.mjpg streams MJPEG, GET /preview.jpg returns a single snapshot.
+    """
+    def __init__(self, host="127.0.0.1", port=8090, fps=5.0, width=320, quality=70):
+        self.host = host
+        self.port = port
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self.width = width
+        self.quality = quality
+        self.clients = 0
+
+        self.frames = None
+        self.version = 0
+        self.updated = asyncio.Event()
+        self.jpeg = None
+        self.jpeg_version = -1
+        self.last_render = 0.0
+        self.lock = asyncio.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="preview")
+        self.runner = None
+
+    def offer(self, img, depth_img=None):
+        """Make these the frames the next render picks up, no copying or encoding happens here"""
+        self.frames = (img, depth_img)
+        self.version += 1
+        if self.clients:
+            self.updated.set()
+
+    async def render(self):
+        """JPEG of the newest frames, re-encoded at most once per interval and shared by all clients"""
+        async with self.lock:
+            wait = self.last_render + self.interval - time.monotonic()
+            if self.jpeg_version != self.version and wait > 0:
+                await asyncio.sleep(wait)
+            if self.jpeg_version != self.version and self.frames is not None:
+                # Read after the sleep so the newest frame is what gets encoded
+                version, (img, depth_img) = self.version, self.frames
+                loop = asyncio.get_running_loop()
+                self.jpeg = await loop.run_in_executor(self.executor, compose_preview, img, depth_img,
+                                                       self.width, self.quality)
+                self.jpeg_version = version
+                self.last_render = time.monotonic()
+            return self.jpeg
+
+    async def wait_for_frame(self, seen):
+        while self.version == seen:
+            self.updated.clear()
+            await self.updated.wait()
+
+    async def handle_page(self, request):
+        return web.Response(body=PAGE, content_type="text/html")
+
+    async def handle_snapshot(self, request):
+        jpeg = await self.render()
+        if jpeg is None:
+            return web.Response(status=503, text="No frames yet")
+        return web.Response(body=jpeg, content_type="image/jpeg", headers={"Cache-Control": "no-cache"})
+
+    async def handle_stream(self, request):
+        response = web.StreamResponse(headers={
+            "Content-Type": "multipart/x-mixed-replace; boundary=frame",
+            "Cache-Control": "no-cache",
+        })
+        await response.prepare(request)
+
+        self.clients += 1
+        # Version 0 means nothing was offered yet
+        seen = 0
+        try:
+            while True:
+                await self.wait_for_frame(seen)
+                jpeg = await self.render()
+                seen = self.jpeg_version
+                await response.write(b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n" % len(jpeg)
+                                     + jpeg + b"\r\n")
+        except ConnectionResetError:
+            pass
+        finally:
+            self.clients -= 1
+        return response
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/", self.handle_page)
+        app.router.add_get("/preview.jpg", self.handle_snapshot)
+        app.router.add_get("/preview.mjpg", self.handle_stream)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        print(f"🖼️ Preview at http://{self.host}:{self.port}/")
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+        self.executor.shutdown(wait=False)
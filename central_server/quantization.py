@@ -0,0 +1,48 @@
+"""INT8 depth models for CPU-only servers
+
+Dynamic quantization converts the Linear layers of an eager model (the ViT blocks in the DPT models,
+MiDaS_small is all convolutions and barely changes). Static quantization works on an exported ONNX
+model and calibrates activation ranges on real frames, so it covers convolutions as well.
+"""
+import torch
+import torch.nn as nn
+
+from depth import Preprocessor
+
+def quantize_dynamic_model(model):
+    """Return a copy of an eager MiDaS module with INT8 Linear layers, CPU only"""
+    return torch.ao.quantization.quantize_dynamic(model.cpu().eval(), {nn.Linear}, dtype=torch.qint8)
+
+def quantize_onnx_dynamic(fp32_path, int8_path):
+    """Quantize the weights of an exported ONNX model, no calibration needed"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+
+def quantize_onnx_static(fp32_path, int8_path, frames, input_size=(256, 256)):
+    """Quantize an exported ONNX model, calibrating activation ranges on a list of BGR frames"""
+    import onnxruntime as ort
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    input_name = ort.InferenceSession(fp32_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    preprocessor = Preprocessor(input_size)
+
+    class FrameReader(CalibrationDataReader):
+        """Feeds calibration frames through the same preprocessing the server uses"""
+        def __init__(self):
+            self.frames = iter(frames)
+
+        def get_next(self):
+            img = next(self.frames, None)
+            if img is None:
+                return None
+            # The preprocessor reuses its buffer, so hand ONNX Runtime a copy
+            return {input_name: preprocessor([img]).numpy().copy()}
+
+    quantize_static(
+        fp32_path, int8_path, FrameReader(),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+    )
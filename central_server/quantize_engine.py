@@ -0,0 +1,32 @@
+"""Build an INT8 ONNX depth model from an fp32 export (see export_engine.py)
+
+Static quantization calibrates on sample frames, ideally ones recorded from the deployment cameras.
+
+    python quantize_engine.py --input models/DPT_Hybrid.onnx --output models/DPT_Hybrid_int8.onnx --frames-dir calibration/
+    DEPTH_ENGINE=onnx DEPTH_ENGINE_PATH=models/DPT_Hybrid_int8.onnx python main.py
+"""
+import argparse
+
+import config
+from bench_utils import sample_frames
+from quantization import quantize_onnx_dynamic, quantize_onnx_static
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", required=True, help="fp32 ONNX model")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--mode", choices=["static", "dynamic"], default="static")
+    parser.add_argument("--frames-dir", help="calibration images, synthetic frames are used when omitted")
+    parser.add_argument("--calibration-frames", type=int, default=32)
+    args = parser.parse_args()
+
+    if args.mode == "dynamic":
+        quantize_onnx_dynamic(args.input, args.output)
+    else:
+        frames = sample_frames(args.frames_dir, args.calibration_frames)
+        print(f"📏 Calibrating on {len(frames)} frames...")
+        quantize_onnx_static(args.input, args.output, frames, (config.INPUT_SIZE, config.INPUT_SIZE))
+    print(f"✅ Wrote {args.mode} INT8 model to {args.output}")
+
+if __name__ == "__main__":
+    main()
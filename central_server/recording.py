@@ -0,0 +1,128 @@
+"""Record decoded camera frames to disk and replay them as a video track
+
+A recording is a directory:
+    meta.json    {"width", "height", "format": "yuv420p", "count"}
+    frames.yuv   count raw yuv420p frames back to back, memory-mapped on replay
+    times.npy    float64 seconds since the first frame, one per frame
+
+yuv420p is what the decoder hands over, so recording costs no conversion and is half the size of BGR.
+"""
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from aiortc.mediastreams import MediaStreamError, MediaStreamTrack, VIDEO_TIME_BASE
+from av import VideoFrame
+
+class FrameRecorder:
+    """Appends decoded frames to a recording on its own thread, the first frame fixes the size"""
+    def __init__(self, path, max_frames=None):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.max_frames = max_frames
+        self.file = open(os.path.join(path, "frames.yuv"), "wb")
+        self.size = None
+        self.times = []
+        self.start = None
+        self.skipped = 0
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="recorder")
+
+    def write(self, frame, timestamp=None):
+        """Queue a frame for writing, frames of a different size than the first are skipped
+
+        timestamp is seconds since the first frame, by default the time write() is called.
+        """
+        now = time.perf_counter()
+        if self.start is None:
+            self.start = now
+            self.size = (frame.width, frame.height)
+        if (frame.width, frame.height) != self.size or (self.max_frames and len(self.times) >= self.max_frames):
+            self.skipped += 1
+            return
+        self.times.append(now - self.start if timestamp is None else timestamp)
+        self.executor.submit(self.write_frame, frame)
+
+    def write_frame(self, frame):
+        if frame.format.name != "yuv420p":
+            frame = frame.reformat(format="yuv420p")
+        self.file.write(frame.to_ndarray().tobytes())
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.file.close()
+        width, height = self.size or (0, 0)
+        np.save(os.path.join(self.path, "times.npy"), np.asarray(self.times, dtype=np.float64))
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump({"width": width, "height": height, "format": "yuv420p", "count": len(self.times)}, f)
+        print(f"💾 Recorded {len(self.times)} frames to {self.path} ({self.skipped} skipped)")
+
+def record_frames(path, frames, fps=30.0):
+    """Write BGR frames straight to a recording, for making synthetic ones"""
+    recorder = FrameRecorder(path)
+    for i, img in enumerate(frames):
+        recorder.write(VideoFrame.from_ndarray(img, format="bgr24").reformat(format="yuv420p"), i / fps)
+    recorder.close()
+
+def open_recording(path):
+    """Return (frames, times) with frames a read-only memmap of shape (count, height * 3 // 2, width)"""
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    width, height, count = meta["width"], meta["height"], meta["count"]
+    frames = np.memmap(os.path.join(path, "frames.yuv"), dtype=np.uint8, mode="r",
+                       shape=(count, height * 3 // 2, width))
+    return frames, np.load(os.path.join(path, "times.npy"))
+
+class RecordedVideoTrack(MediaStreamTrack):
+    """Plays a recording back as if it were the camera's decoded track
+
+    speed 1.0 keeps the recorded timing, 2.0 plays twice as fast, 0 ignores the timing and hands
+    out each frame once the optional pace() coroutine returns, so a caller can hold frames back
+    until the pipeline has dealt with the previous one. Frame i gets pts i, and delivered[i] is
+    when recv() returned it.
+    """
+    kind = "video"
+
+    def __init__(self, path, speed=1.0, loops=1, pace=None):
+        super().__init__()
+        self.frames, self.times = open_recording(path)
+        self.speed = speed
+        self.loops = loops
+        self.pace = pace
+        self.index = 0
+        self.start = None
+        self.delivered = {}
+        # A loop lasts the recording plus one average frame interval
+        count = len(self.times)
+        self.duration = self.times[-1] * count / (count - 1) if count > 1 else 0.0
+
+    def __len__(self):
+        return len(self.frames) * self.loops
+
+    async def recv(self):
+        if self.speed <= 0 and self.pace is not None:
+            await self.pace()
+        if self.index >= len(self):
+            self.stop()
+            raise MediaStreamError
+
+        i = self.index % len(self.frames)
+        if self.start is None:
+            self.start = time.perf_counter()
+        if self.speed > 0:
+            due = self.start + (self.times[i] + self.index // len(self.frames) * self.duration) / self.speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elif self.pace is None:
+            # Still give the pipeline's other tasks a turn
+            await asyncio.sleep(0)
+
+        frame = VideoFrame.from_ndarray(self.frames[i], format="yuv420p")
+        frame.pts = self.index
+        frame.time_base = VIDEO_TIME_BASE
+        self.delivered[self.index] = time.perf_counter()
+        self.index += 1
+        return frame
@@ -0,0 +1,143 @@
+"""Python stand-in for the Node signaling server in webrtc/server.js, for local runs without Node
+
+Speaks the same Socket.IO events with the same offer bookkeeping: newOffer, newAnswer (acked with
+the offer's ICE candidates), sendIceCandidateToSignalingServer, answerResponse, availableOffers,
+newOfferAwaiting and receivedIceCandidateFromServer. Answers carry the offer they answer and ICE
+candidates may carry its SDP as offerSdp, since one user can have several offers up. Plain HTTP, no static files.
+
+    python signaling.py --port 8181
+    SIGNALING_URL=http://127.0.0.1:8181 python main.py
+"""
+import argparse
+import asyncio
+
+import socketio
+from aiohttp import web
+
+class SignalingServer:
+    def __init__(self):
+        self.sio = socketio.AsyncServer(async_mode="aiohttp", cors_allowed_origins="*")
+        self.app = web.Application()
+        self.sio.attach(self.app)
+        self.runner = None
+        self.offers = []
+        self.users = {}  # sid -> userName
+        self.register()
+
+    def sid_of(self, user_name):
+        return next((sid for sid, name in self.users.items() if name == user_name), None)
+
+    def find_offer(self, role, user_name, sdp=None):
+        """The offer user_name made or answered (role is the field to match) with this offer SDP
+
+        A user can have several offers up at once, the server one per camera, so clients say which
+        one they mean by its SDP. Without it, the newest.
+        """
+        mine = [o for o in self.offers if o[role] == user_name]
+        if sdp is not None:
+            return next((o for o in mine if o["offer"]["sdp"] == sdp), None)
+        return mine[-1] if mine else None
+
+    def register(self):
+        sio = self.sio
+
+        @sio.event
+        async def connect(sid, environ, auth):
+            if not auth or auth.get("password") != "x":
+                return False
+            self.users[sid] = auth.get("userName")
+            # A new client has joined, send it the offers already up
+            if self.offers:
+                await sio.emit("availableOffers", self.offers, to=sid)
+
+        @sio.event
+        async def newOffer(sid, offer):
+            self.offers.append({
+                "offererUserName": self.users[sid],
+                "offer": offer,
+                "offerIceCandidates": [],
+                "answererUserName": None,
+                "answer": None,
+                "answererIceCandidates": [],
+            })
+            await sio.emit("newOfferAwaiting", self.offers[-1:], skip_sid=sid)
+
+        @sio.event
+        async def newAnswer(sid, data):
+            offerer_sid = self.sid_of(data["offererUserName"])
+            if offerer_sid is None:
+                print("No matching socket")
+                return None
+            sdp = (data.get("offer") or {}).get("sdp")
+            if sdp is not None:
+                offer = self.find_offer("offererUserName", data["offererUserName"], sdp)
+            else:
+                # Clients that don't say which offer they answered get the first one not taken yet
+                mine = [o for o in self.offers if o["offererUserName"] == data["offererUserName"]]
+                offer = next((o for o in mine if not o["answererUserName"]), mine[0] if mine else None)
+            if offer is None:
+                print("No OfferToUpdate")
+                return None
+            offer["answer"] = data["answer"]
+            offer["answererUserName"] = self.users[sid]
+            await sio.emit("answerResponse", offer, to=offerer_sid)
+            # The ack carries the candidates the offerer trickled so far
+            return offer["offerIceCandidates"]
+
+        @sio.event
+        async def sendIceCandidateToSignalingServer(sid, data):
+            user_name, candidate, sdp = data["iceUserName"], data["iceCandidate"], data.get("offerSdp")
+            if data["didIOffer"]:
+                offer = self.find_offer("offererUserName", user_name, sdp)
+                if offer is None:
+                    return
+                offer["offerIceCandidates"].append(candidate)
+                peer = offer["answererUserName"]
+            else:
+                offer = self.find_offer("answererUserName", user_name, sdp)
+                peer = offer["offererUserName"] if offer else None
+            peer_sid = self.sid_of(peer) if peer else None
+            if peer_sid is not None:
+                await sio.emit("receivedIceCandidateFromServer", candidate, to=peer_sid)
+
+        @sio.event
+        async def disconnect(sid, *args):
+            user_name = self.users.pop(sid, None)
+            if user_name is None:
+                return
+            # Drop their offers and tell everyone what is left
+            self.offers = [o for o in self.offers
+                           if user_name not in (o["offererUserName"], o["answererUserName"])]
+            await sio.emit("availableOffers", self.offers)
+
+    async def start(self, host="127.0.0.1", port=8181):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        print(f"📡 Signaling stand-in on http://{host}:{port}")
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+async def serve(host, port):
+    server = SignalingServer()
+    await server.start(host, port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8181)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -45,7 +45,8 @@ export default function VideoReceiver() {
         const validOffer = offers.find(offer => {
           // Check for both legacy and current properties
           const offerUserName = offer.offererUserName || offer.userName;
-          return offerUserName === ALLOWED_USERNAME;
+          // The server keeps one open offer per waiting viewer, skip the ones already taken
+          return offerUserName === ALLOWED_USERNAME && !offer.answererUserName;
         });
 
         if (validOffer) {
@@ -103,6 +104,7 @@ export default function VideoReceiver() {
               iceCandidate: e.candidate,
               iceUserName: userName,
               didIOffer,
+              offerSdp: offerObj?.offer?.sdp,
             });
           }
         });
@@ -41,6 +41,17 @@ const connectedSockets = [
   //username, socketId
 ];
 
+// The offer userName made or answered (role is the field to match) with this offer SDP.
+// A user can have several offers up at once, the server one per camera, so clients say
+// which one they mean by its SDP. Without it, the newest
+const findOffer = (role, userName, sdp) => {
+  const mine = offers.filter((o) => o[role] === userName);
+  if (sdp) {
+    return mine.find((o) => o.offer.sdp === sdp);
+  }
+  return mine[mine.length - 1];
+};
+
 io.on("connection", (socket) => {
   // console.log("Someone has connected");
   const userName = socket.handshake.auth.userName;
@@ -87,9 +98,16 @@ io.on("connection", (socket) => {
     }
 
     const socketIdToAnswer = socketToAnswer.socketId;
-    const offerToUpdate = offers.find(
-      (o) => o.offererUserName === offerObj.offererUserName
-    );
+    // Answer the offer the client answered, clients that don't say get the first one not taken yet
+    const answeredSdp = offerObj.offer && offerObj.offer.sdp;
+    const offerToUpdate = answeredSdp
+      ? findOffer("offererUserName", offerObj.offererUserName, answeredSdp)
+      : offers.find(
+          (o) =>
+            o.offererUserName === offerObj.offererUserName &&
+            !o.answererUserName
+        ) ||
+        offers.find((o) => o.offererUserName === offerObj.offererUserName);
     if (!offerToUpdate) {
       console.log("No OfferToUpdate");
       return;
@@ -108,13 +126,11 @@ io.on("connection", (socket) => {
   });
 
   socket.on("sendIceCandidateToSignalingServer", (iceCandidateObj) => {
-    const { didIOffer, iceUserName, iceCandidate } = iceCandidateObj;
+    const { didIOffer, iceUserName, iceCandidate, offerSdp } = iceCandidateObj;
     // console.log(iceCandidate);
     if (didIOffer) {
       //this ice is coming from the offerer. Send to the answerer
-      const offerInOffers = offers.find(
-        (o) => o.offererUserName === iceUserName
-      );
+      const offerInOffers = findOffer("offererUserName", iceUserName, offerSdp);
       if (offerInOffers) {
         offerInOffers.offerIceCandidates.push(iceCandidate);
         // 1. When the answerer answers, all existing ice candidates are sent
@@ -136,12 +152,10 @@ io.on("connection", (socket) => {
     } else {
       //this ice is coming from the answerer. Send to the offerer
       //pass it through to the other socket
-      const offerInOffers = offers.find(
-        (o) => o.answererUserName === iceUserName
-      );
-      const socketToSendTo = connectedSockets.find(
-        (s) => s.userName === offerInOffers.offererUserName
-      );
+      const offerInOffers = findOffer("answererUserName", iceUserName, offerSdp);
+      const socketToSendTo =
+        offerInOffers &&
+        connectedSockets.find((s) => s.userName === offerInOffers.offererUserName);
       if (socketToSendTo) {
         socket
           .to(socketToSendTo.socketId)